@@ -1,11 +1,9 @@
 import sys
 import google.generativeai as genai
 import streamlit as st
-import sqlite3
 import pandas as pd
 from datetime import datetime, timedelta
 import gspread
-from google.oauth2.service_account import Credentials
 import time
 import re
 import pytz
@@ -14,6 +12,20 @@ import plotly.express as px
 import plotly.graph_objects as go
 from PIL import Image, ImageDraw
 import streamlit.components.v1 as components
+from report_parsing import clean_headers
+from formatting import format_date_display, status_badges
+import db
+from presence import PresenceTracker
+from sheet_sync import SheetMirror, FETCH_API
+from gsheet_client import get_shared_client
+from sheet_writer import SCAN_RANGE, tail_pointers, ticket_row_requests, append_row_request, format_row_requests
+from dataset_store import DatasetStore
+from snapshot_files import SNAPSHOT_DIR
+from search_index import SearchIndex
+from customer_directory import CustomerDirectory
+import lldtek_client
+from row_locator import RowLocator, locator_key, row_matches, parse_row_ref
+from sheet_outbox import SheetOutbox, PermanentError, KIND_APPEND, KIND_UPDATE, STATUS_PENDING, STATUS_SENDING, STATUS_DONE, STATUS_FAILED, row_key
 
 # Ép nạp thư viện khi đóng gói file .exe
 if getattr(sys, 'frozen', False):
@@ -117,38 +129,17 @@ components.html(
 # CƠ SỞ DỮ LIỆU & BỘ CÔNG CỤ (SOP)
 # ==========================================
 def init_db():
-    conn = sqlite3.connect('crm_data.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS tickets (id INTEGER PRIMARY KEY AUTOINCREMENT, Date TEXT, Salon_Name TEXT, Phone TEXT, Issue_Category TEXT, Note TEXT, Status TEXT, Created_At TEXT, CID TEXT, Contact TEXT, Card_16_Digits TEXT, Training_Note TEXT, Demo_Note TEXT, Agent_Name TEXT, Support_Time TEXT, Caller_Info TEXT, ISO_System TEXT, Ticket_Type TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS cid_cache (cid TEXT PRIMARY KEY, salon_name TEXT, phone TEXT, owner TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT, role TEXT, is_active INTEGER, last_seen TEXT)''')
-    
-    # [V151] - TẠO BẢNG CHỨA KỊCH BẢN SOP VÀ BÁO ĐỘNG CỨU NÉT
-    c.execute('''CREATE TABLE IF NOT EXISTS sops (id INTEGER PRIMARY KEY AUTOINCREMENT, category TEXT, device_name TEXT, steps TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS escalations (id INTEGER PRIMARY KEY AUTOINCREMENT, agent_name TEXT, salon_name TEXT, phone TEXT, note TEXT, status TEXT, created_at TEXT)''')
-    
-    try: c.execute("ALTER TABLE users ADD COLUMN vici_id TEXT")
-    except: pass
-    try: c.execute("ALTER TABLE cid_cache ADD COLUMN phone TEXT")
-    except: pass
-    try: c.execute("ALTER TABLE cid_cache ADD COLUMN owner TEXT")
-    except: pass
-    # [V152] Bảng chứa lệnh Giao việc nội bộ
-    c.execute('''CREATE TABLE IF NOT EXISTS dispatches (id INTEGER PRIMARY KEY AUTOINCREMENT, target_agent TEXT, salon_name TEXT, phone TEXT, note TEXT, status TEXT, created_by TEXT, created_at TEXT)''')
+    # Tạo bảng / thêm cột / index theo từng phiên bản schema (xem db_migrations.py)
+    db.migrate()
 
     # Khởi tạo user mặc định
-    c.execute("SELECT COUNT(*) FROM users")
-    if c.fetchone()[0] == 0:
+    if db.users.count() == 0:
         agents_list = ["Phương Loan", "Hương Giang", "Phương Anh", "Tuấn Võ", "Thùy Dung", "Phương Hồ", "Chiến Phạm", "Anh Đạt", "Tiến Dương", "Schang Sanh", "Tuyết Anh", "Liên Chi", "Anh Thư"]
-        for a in agents_list:
-            r = 'Admin' if a in ["Phương Loan", "Thùy Dung"] else 'Agent'
-            c.execute("INSERT INTO users VALUES (?, '123456', ?, 1, '', '')", (a, r))
-        c.execute("INSERT OR IGNORE INTO users VALUES ('admin', 'admin123', 'Admin', 1, '', '')")
+        seed_users = [(a, '123456', 'Admin' if a in ["Phương Loan", "Thùy Dung"] else 'Agent') for a in agents_list]
+        db.users.seed(seed_users + [('admin', 'admin123', 'Admin')])
         
     # [V151] - Khởi tạo bộ Data chuẩn LLDTEK nếu bảng trống
-    c.execute("SELECT COUNT(*) FROM sops")
-    if c.fetchone()[0] == 0:
+    if db.sops.count() == 0:
         defaults_sops = [
             ('Phần cứng', 'PAX A800 / A920 / A35', 'Check IP cùng lớp mạng với System|Test connection|Khởi động lại PAX|Clear Batch'),
             ('Phần cứng', 'PAX E800', 'Kiểm tra nguồn điện|Check kết nối Wi-Fi/LAN|Thực hiện Ping Test|Reboot thiết bị'),
@@ -164,10 +155,7 @@ def init_db():
             ('Phần mềm', 'Refund tiền / VOID Ticket', 'Yêu cầu Manager Pass|Thực hiện Void/Refund trên System|Thực hiện Refund tương ứng trên máy PAX|Thu hồi lại receipt cũ'),
             ('Phần mềm', 'Add thêm thợ (Technician)', 'Lấy thông tin thợ mới|Vào mục Tech Management|Tạo Profile thợ|Set quyền và Passcode')
         ]
-        c.executemany("INSERT INTO sops (category, device_name, steps) VALUES (?, ?, ?)", defaults_sops)
-    
-    conn.commit()
-    conn.close()
+        db.sops.add_many(defaults_sops)
 
 init_db()
 
@@ -189,11 +177,7 @@ vici_user_param = qp.get("user", "")
 js_auto_user = qp.get("auto_login_js", "")
 
 if st.session_state.get("clear_storage", False):
-    conn = sqlite3.connect('crm_data.db')
-    c = conn.cursor()
-    c.execute("UPDATE users SET vici_id='' WHERE username=?", (st.session_state.current_user,))
-    conn.commit()
-    conn.close()
+    db.users.set_vici_id(st.session_state.current_user, '')
     clear_js = """<script>try { window.parent.localStorage.removeItem('crm_auto_user'); } catch(e) {}
     try { window.localStorage.removeItem('crm_auto_user'); } catch(e) {}
     let url = new URL(window.location.href); url.searchParams.delete('auto_login_js');
@@ -207,22 +191,14 @@ if st.session_state.get("clear_storage", False):
 
 if not st.session_state.logged_in:
     if vici_user_param:
-        conn = sqlite3.connect('crm_data.db')
-        c = conn.cursor()
-        c.execute("SELECT username, role, is_active FROM users WHERE vici_id=? AND vici_id != '' AND vici_id IS NOT NULL", (vici_user_param,))
-        res = c.fetchone()
-        conn.close()
+        res = db.users.by_vici_id(vici_user_param)
         if res and res[2] == 1:
             st.session_state.logged_in = True
             st.session_state.current_user = res[0]
             st.session_state.user_role = res[1]
 
     elif js_auto_user:
-        conn = sqlite3.connect('crm_data.db')
-        c = conn.cursor()
-        c.execute("SELECT role, is_active FROM users WHERE username=?", (js_auto_user,))
-        res = c.fetchone()
-        conn.close()
+        res = db.users.get(js_auto_user)
         if res and res[1] == 1:
             st.session_state.logged_in = True
             st.session_state.current_user = js_auto_user
@@ -247,29 +223,22 @@ if not st.session_state.logged_in:
             remember_me = st.checkbox("💾 Ghi nhớ đăng nhập", value=True)
             
             if st.form_submit_button("Đăng Nhập", use_container_width=True):
-                conn = sqlite3.connect('crm_data.db')
-                c = conn.cursor()
-                c.execute("SELECT role, is_active FROM users WHERE username=? AND password=?", (user_input, pass_input))
-                res = c.fetchone()
+                res = db.users.authenticate(user_input, pass_input)
                 if res:
                     if res[1] == 1:
                         if remember_me:
                             if vici_user_param:
-                                c.execute("UPDATE users SET vici_id=? WHERE username=?", (vici_user_param, user_input))
+                                db.users.set_vici_id(user_input, vici_user_param)
                             st.session_state.trigger_js_remember = user_input 
                         
                         st.session_state.logged_in = True
                         st.session_state.current_user = user_input
                         st.session_state.user_role = res[0]
-                        conn.commit()
-                        conn.close()
                         st.rerun()
                     else:
                         st.error("❌ Tài khoản của bạn đã bị khóa. Vui lòng liên hệ Admin.")
-                        conn.close()
                 else:
                     st.error("❌ Sai tên đăng nhập hoặc mật khẩu!")
-                    conn.close()
     st.stop() 
 
 if 'trigger_js_remember' in st.session_state:
@@ -278,20 +247,19 @@ if 'trigger_js_remember' in st.session_state:
     components.html(js_save, height=0, width=0)
     del st.session_state['trigger_js_remember']
 
-conn = sqlite3.connect('crm_data.db')
-c = conn.cursor()
-c.execute("UPDATE users SET last_seen=? WHERE username=?", (datetime.now().strftime("%d/%m/%Y %H:%M:%S"), st.session_state.current_user))
-conn.commit()
-conn.close()
+@st.cache_resource(show_spinner=False)
+def get_presence():
+    # Heartbeat giữ trong RAM, thread nền ghi users.last_seen theo lô (không ghi DB mỗi lần rerun)
+    tracker = PresenceTracker(db.users)
+    tracker.start()
+    return tracker
+
+get_presence().beat(st.session_state.current_user)
 
 def check_recent_duplicate(phone, agent):
-    conn = sqlite3.connect('crm_data.db')
-    c = conn.cursor()
-    c.execute("SELECT Created_At FROM tickets WHERE Phone=? AND Agent_Name=? ORDER BY id DESC LIMIT 1", (phone, agent))
-    res = c.fetchone()
-    conn.close()
-    if res:
-        last_time = datetime.strptime(res[0], '%Y-%m-%d %H:%M:%S')
+    last_created = db.tickets.last_created_at(phone, agent)
+    if last_created:
+        last_time = datetime.strptime(last_created, '%Y-%m-%d %H:%M:%S')
         if (datetime.now() - last_time).total_seconds() < 180:
             return True
     return False
@@ -307,6 +275,7 @@ try:
     from selenium.webdriver.support import expected_conditions as EC
     from selenium.webdriver.common.keys import Keys
     from webdriver_manager.chrome import ChromeDriverManager
+    import web_bot
     HAS_BOT_LIBS = True
 except ImportError:
     HAS_BOT_LIBS = False
@@ -314,17 +283,30 @@ except ImportError:
 is_cloud_mode = False
 if not HAS_BOT_LIBS or "web_account" not in st.secrets:
     is_cloud_mode = True
+# Tra cứu qua HTTP (requests) không cần Chrome nên chạy được cả trên Cloud
+HAS_HTTP_LOOKUP = lldtek_client.HAS_REQUESTS and "web_account" in st.secrets
 
 # ==========================================
 # 2. AUTO-DETECT SHEETS 
 # ==========================================
-@st.cache_data(ttl=3600) 
+def get_sheets_client():
+    # 1 client đã authorize cho cả process (token tự làm mới, cache handle file/tab theo tên)
+    return get_shared_client(st.secrets["gcp_service_account"])
+
+@st.cache_resource(show_spinner=False)
+def get_dataset_store():
+    # Dữ liệu dùng chung cho mọi phiên (danh sách file, Master DB, report): 1 bản/nguồn, làm mới từng nguồn riêng
+    # Bản tải tốt gần nhất lưu ra crm_snapshots/ cạnh crm_data.db: khởi động lại là có dữ liệu ngay, thread nền tự đối chiếu với Google
+    store = DatasetStore(snapshot_dir=SNAPSHOT_DIR)
+    store.start()
+    return store
+
 def get_dynamic_sheets():
+    return get_dataset_store().get("sheet_list", loader=_fetch_dynamic_sheets, ttl=3600, persist=True)
+
+def _fetch_dynamic_sheets():
     try:
-        scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-        credentials = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=scopes)
-        gc = gspread.authorize(credentials)
-        all_files = gc.list_spreadsheet_files()
+        all_files = get_sheets_client().list_spreadsheet_files()
         
         crm_files = [f['name'] for f in all_files if "DAILY REPORT" in f['name'].upper()]
         
@@ -346,8 +328,9 @@ def get_dynamic_sheets():
 
 AVAILABLE_SHEETS = get_dynamic_sheets()
 MASTER_DB_FILE = "CID Salon"
-IGNORED_TAB_NAMES = ["form request", "sheet 4", "sheet4", "request", "request daily", "total", "summary", "copy of", "bản sao", "copy"]
-KEEP_COLUMNS = ["Date", "Salon_Name", "Agent_Name", "Phone", "CID", "Owner", "Note", "Status", "Issue_Category", "Support_Time", "End_Time", "Ticket_Type", "Caller_Info", "ISO_System", "Training_Note", "Demo_Note", "Card_16_Digits"]
+# Cách tải lần đầu 1 file cho trang Lịch sử: FETCH_API (batchGet qua Sheets API) hoặc FETCH_XLSX (export XLSX qua Drive, không tốn quota đọc Sheets).
+# Đo bằng `python sheet_sync.py <file>.xlsx`: file 22 tab ~5k dòng, batchGet ~0.5 MB / 1.2s còn XLSX ~2.2 MB / 5.4s -> mặc định vẫn là API
+HISTORY_FETCH_MODE = FETCH_API
 
 def get_company_time():
     utc_now = datetime.now(pytz.utc)
@@ -368,132 +351,56 @@ def get_current_month_sheet():
             defaults.append(s)
     return defaults if defaults else ([AVAILABLE_SHEETS[0]] if AVAILABLE_SHEETS else [])
 
-def clean_headers(headers):
-    seen = {}
-    result = []
-    for h in headers:
-        h = str(h).strip()
-        h = "Unnamed" if not h else h
-        if h in seen: 
-            seen[h] += 1
-            result.append(f"{h}_{seen[h]}")
-        else: 
-            seen[h] = 0
-            result.append(h)
-    return result
-
-def construct_date_from_context(val, sheet_name, tab_name):
-    match = re.search(r'(\d{1,2})/(\d{2})', sheet_name)
-    file_year = "20" + match.group(2) if match else str(datetime.now().year)
-    file_month = match.group(1) if match else "01"
-    day_str = str(tab_name).strip()
-    if "/" in day_str and len(day_str) <= 5: 
-        return f"{day_str}/{file_year}"
-    if day_str.isdigit() and int(day_str) <= 31: 
-        return f"{file_month}/{day_str}/{file_year}" 
-    return f"{tab_name}/{file_year}"
-
-def format_date_display(val):
-    try: 
-        return pd.to_datetime(str(val), errors='coerce').strftime('%m/%d/%Y') if not pd.isna(val) and str(val).strip() != "" else str(val)
-    except: 
-        return str(val)
-
-def safe_process_dataframe(df, rename_map):
-    df = df.rename(columns=rename_map)
-    df = df.loc[:, ~df.columns.duplicated()]
-    for col in KEEP_COLUMNS: 
-        if col not in df.columns: 
-            df[col] = ""
-    return df[KEEP_COLUMNS]
-
-def map_status_badge(status_str):
-    s = str(status_str).lower()
-    if "done" in s: return f"🟢 {status_str}"
-    elif "support" in s or "pending" in s: return f"🔴 {status_str}"
-    elif "request" in s or "forward" in s: return f"🟠 {status_str}"
-    elif "no answer" in s: return f"⚫ {status_str}"
-    return status_str
-
-def extract_final_data(driver, search_term):
-    try:
-        html = driver.page_source
-        dfs = pd.read_html(html)
-        if dfs:
-            for df in dfs:
-                str_df = df.astype(str).sum(axis=1)
-                if str_df.str.contains(search_term, case=False).any():
-                     final_rows = df[str_df.str.contains(search_term, case=False)]
-                     return final_rows
-            return max(dfs, key=lambda x: x.shape[1])
-        return None
-    except: 
-        return None
+def count_values(series):
+    # Agent_Name/Ticket_Type là cột category: value_counts mặc định đếm cả các category không còn dòng nào
+    counts = series.value_counts()
+    return counts[counts > 0]
 
 def run_search_engine(search_term):
-    if is_cloud_mode: 
+    if is_cloud_mode and not HAS_HTTP_LOOKUP:
         return "CLOUD_MODE"
     status_log = st.empty()
-    chrome_options = Options()
-    chrome_options.page_load_strategy = 'eager'
-    chrome_options.add_argument("--headless=new") 
-    chrome_options.add_argument("--window-size=1920,1080")
-    chrome_options.add_argument("--ignore-certificate-errors")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    
-    driver = None
-    try:
-        status_log.info("🚀 Bot đang khởi động...")
-        driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
-        wait = WebDriverWait(driver, 15)
-        
-        driver.get("https://www.lldtek.org/salon/login")
-        try:
-            user_in = wait.until(EC.presence_of_element_located((By.NAME, "username")))
-            pass_in = driver.find_element(By.NAME, "password")
-            user_in.send_keys(st.secrets["web_account"]["username"])
-            pass_in.send_keys(st.secrets["web_account"]["password"])
-            pass_in.submit()
-        except: 
-            driver.quit()
-            return None
-        
+    status, final_df = None, None
+    # Đường nhanh: HTTP (requests.Session). Trang lạ / lỗi mạng / đăng nhập hỏng thì mới mở Chrome
+    if HAS_HTTP_LOOKUP:
         status_log.info("🔍 Đang tra cứu thông tin...")
-        driver.get("https://lldtek.org/salon/web/pos/list")
-        
         try:
-            search_btn = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(translate(., 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'search')]")))
-            target_input = search_btn.find_element(By.XPATH, "./preceding::input[1]")
-            
-            ph = str(target_input.get_attribute("placeholder")).lower()
-            if "date" in ph or "mm/dd" in ph:
-                status_log.error("❌ Bot nhầm ô Date.")
-            else:
-                target_input.click()
-                target_input.clear()
-                target_input.send_keys(search_term)
-                driver.execute_script("arguments[0].click();", search_btn)
-                status_log.info("⏳ Đang tải dữ liệu...")
-                time.sleep(2.5)
-                
-                body_text = driver.find_element(By.TAG_NAME, "body").text
-                if search_term in body_text:
-                    status_log.success("✅ Đã tìm thấy dữ liệu!")
-                    final_df = extract_final_data(driver, search_term)
-                    driver.quit()
-                    return final_df
-                else:
-                     status_log.warning("⚠️ Không tìm thấy kết quả phù hợp.")
-            driver.quit()
+            status, final_df = get_http_lookup().lookup(search_term)
+        except Exception:
+            status = None
+    if status in (None, lldtek_client.LOGIN_FAILED) and not is_cloud_mode:
+        try:
+            bot = get_lookup_bot()
+            queued = bot.pending_count()
+            status_log.info(f"🔍 Đang tra cứu thông tin..." + (f" (đang chờ {queued} yêu cầu trước)" if queued else ""))
+            status, final_df = bot.lookup(search_term)
+        except Exception:
             status_log.empty()
-            return pd.DataFrame()
-        except Exception as e:
-            if driver: driver.quit()
             return None
-    except Exception as e:
-        if driver: driver.quit()
-        return None
+    if status == lldtek_client.FOUND:
+        status_log.success("✅ Đã tìm thấy dữ liệu!")
+        return final_df
+    if status == lldtek_client.WRONG_INPUT:
+        status_log.error("❌ Bot nhầm ô Date.")
+        return pd.DataFrame()
+    if status == lldtek_client.NOT_FOUND:
+        status_log.warning("⚠️ Không tìm thấy kết quả phù hợp.")
+        return pd.DataFrame()
+    status_log.empty()
+    return None
+
+@st.cache_resource(show_spinner=False)
+def get_http_lookup():
+    # 1 requests.Session đã đăng nhập cho cả process (keep-alive), dùng chung cache cid_cache với bot
+    return lldtek_client.HttpLookupClient(dict(st.secrets["web_account"]), cache=db.lookup_cache)
+
+@st.cache_resource(show_spinner=False)
+def get_lookup_bot():
+    # Pool Chrome đã đăng nhập sẵn cho cả process, các lượt tra cứu xếp hàng dùng chung
+    # Kết quả tìm thấy được lưu trong cid_cache (SQLite), tra lại cùng CID/SĐT trong ca thì không phải mở web
+    bot = web_bot.LookupBot(dict(st.secrets["web_account"]), cache=db.lookup_cache)
+    bot.start()
+    return bot
 
 def save_to_master_db_gsheet(df):
     status_box = st.status("🛠️ Đang thực hiện lưu Database...", expanded=True)
@@ -503,14 +410,15 @@ def save_to_master_db_gsheet(df):
             return False, "Không có dữ liệu để lưu."
 
         status_box.write("1. Kết nối Google Drive...")
-        credentials = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive'])
-        gc = gspread.authorize(credentials)
+        client = get_sheets_client()
         
-        try: sh = gc.open(MASTER_DB_FILE)
+        try: sh = client.open(MASTER_DB_FILE)
         except: return False, f"Không tìm thấy file '{MASTER_DB_FILE}'."
 
-        try: ws = sh.worksheet("CID")
-        except: ws = sh.add_worksheet(title="CID", rows=1000, cols=10)
+        try: ws = client.worksheet(MASTER_DB_FILE, "CID")
+        except: 
+            ws = sh.add_worksheet(title="CID", rows=1000, cols=10)
+            client.invalidate(MASTER_DB_FILE)
 
         status_box.write("2. Đang map đúng cột dữ liệu...")
         count = 0
@@ -536,104 +444,90 @@ def get_target_worksheet(date_obj):
     month_year_1 = date_obj.strftime("%m/%y")
     month_year_2 = f"{date_obj.month}/{date_obj.strftime('%y')}"
     target_sheet_name = None
-    for s in AVAILABLE_SHEETS:
-        if month_year_1 in s or month_year_2 in s: 
-            target_sheet_name = s
-            break
+    # Đọc danh sách file từ dataset store mỗi lần (hàm này chạy cả trong thread outbox, không dùng biến AVAILABLE_SHEETS của lần chạy đầu);
+    # chưa thấy file tháng (VD: vừa sang tháng mới) thì tải lại danh sách 1 lần
+    for refresh in (False, True):
+        sheet_list = get_dataset_store().refresh("sheet_list") if refresh else get_dynamic_sheets()
+        target_sheet_name = next((s for s in sheet_list if month_year_1 in s or month_year_2 in s), None)
+        if target_sheet_name: break
             
     if not target_sheet_name: 
         return None, None, f"⚠️ Không tìm thấy file Report tháng {month_year_1}"
         
-    credentials = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive'])
-    gc = gspread.authorize(credentials)
-    sh = gc.open(target_sheet_name)
+    client = get_sheets_client()
+    sh = client.open(target_sheet_name)
     day_str = str(date_obj.day)
     target_ws = None
-    for ws in sh.worksheets():
-        if ws.title.strip() == day_str or ws.title.startswith(f"{day_str}/"): 
-            target_ws = ws
-            break
+    # Danh sách tab lấy từ cache; chưa thấy tab ngày (VD: tab mới tạo sáng nay) thì tải lại 1 lần
+    for refresh in (False, True):
+        worksheets = client.worksheets(target_sheet_name, refresh=refresh)
+        for ws in worksheets:
+            if ws.title.strip() == day_str or ws.title.startswith(f"{day_str}/"): 
+                target_ws = ws
+                break
+        if target_ws: break
             
     if not target_ws: 
-        target_ws = sh.worksheets()[-1]
+        target_ws = worksheets[-1]
     return sh, target_ws, target_sheet_name
 
 def apply_full_format(ws, row_idx, color_type):
-    colors = {'red': {"red": 1.0, "green": 0.0, "blue": 0.0}, 'blue': {"red": 0.0, "green": 0.0, "blue": 1.0}, 'black': {"red": 0.0, "green": 0.0, "blue": 0.0}}
-    fg_color = colors.get(color_type, colors['black'])
-
-    fmt_center_clip = {
-        "textFormat": {"fontFamily": "Times New Roman", "fontSize": 12, "foregroundColor": fg_color},
-        "verticalAlignment": "BOTTOM", "horizontalAlignment": "CENTER", "wrapStrategy": "CLIP"
-    }
-    
-    fmt_left_clip = {
-        "textFormat": {"fontFamily": "Times New Roman", "fontSize": 12, "foregroundColor": fg_color},
-        "verticalAlignment": "BOTTOM", "horizontalAlignment": "LEFT", "wrapStrategy": "CLIP"
-    }
-
-    fmt_left_wrap = {
-        "textFormat": {"fontFamily": "Times New Roman", "fontSize": 12, "foregroundColor": fg_color},
-        "verticalAlignment": "BOTTOM", "horizontalAlignment": "LEFT", "wrapStrategy": "WRAP"
-    }
-
+    # 6 vùng định dạng gộp thành 1 request batchUpdate
     try:
-        ws.format(f"B{row_idx}:E{row_idx}", fmt_center_clip)  
-        ws.format(f"F{row_idx}", fmt_left_clip)                
-        ws.format(f"G{row_idx}:H{row_idx}", fmt_center_clip)  
-        ws.format(f"I{row_idx}", fmt_center_clip)   
-        ws.format(f"J{row_idx}", fmt_left_wrap)                
-        ws.format(f"K{row_idx}", fmt_left_clip)            
+        ws.spreadsheet.batch_update({"requests": format_row_requests(ws.id, row_idx, color_type)})
     except Exception as e:
         pass
 
-def save_to_google_sheet(ticket_data):
+def _remember_saved_row(ticket_data, sheet_name, tab_title, row_idx):
+    try: get_row_locator().remember(sheet_name, tab_title, row_idx, locator_key(ticket_data['Date_Str'], ticket_data['Phone'], ticket_data['Salon_Name']), ticket_data.get('Ticket_Id'))
+    except: pass
+    try: get_sheet_mirror().mark_dirty(sheet_name, tab_title)
+    except: pass
+
+def save_to_google_sheet(ticket_data, on_reserve=None):
+    # on_reserve(reserved): lưu [file, tab, dòng, STT] đã giữ chỗ trước khi gửi; ticket_data['Reserved_Row'] là chỗ của lần gửi trước
     try:
         sh, target_ws, sheet_name = get_target_worksheet(ticket_data['Date_Obj'])
         if not target_ws: 
             return False, sheet_name
         
-        # 1. LƯU VÀO TAB DAILY REPORT (Như cũ)
-        all_values = target_ws.get_values("A7:K1000") 
-        start_row = 7
-        target_row_idx = -1
-        last_stt_val = 0 
-        
-        for i, row in enumerate(all_values):
-            real_row_idx = start_row + i
-            row_padded = [str(x).strip() for x in row] + [""] * (11 - len(row))
-            if bool(row_padded[1] or row_padded[5] or row_padded[7] or row_padded[9]):
-                if row_padded[0].isdigit(): last_stt_val = int(row_padded[0])
-                continue 
-            else:
-                target_row_idx = real_row_idx
-                break
-        
-        if target_row_idx == -1: 
-            target_row_idx = start_row + len(all_values)
-                
-        if target_row_idx > 6:
-            if last_stt_val == 0:
-                try:
-                    prev_stt = target_ws.cell(target_row_idx - 1, 1).value
-                    if prev_stt and str(prev_stt).isdigit(): last_stt_val = int(prev_stt)
-                except: pass
-            target_ws.update_cell(target_row_idx, 1, last_stt_val + 1)
-        
+        # 1. LƯU VÀO TAB DAILY REPORT
         row_data = [
             ticket_data['Agent_Name'], ticket_data['Support_Time'], ticket_data['End_Time'], 
             ticket_data['Duration'], ticket_data['Salon_Name'], ticket_data['CID'], 
             ticket_data['Phone'], ticket_data['Caller_Info'], ticket_data['Note'], ticket_data['Status']
         ]
-        target_ws.update(f"B{target_row_idx}:K{target_row_idx}", [row_data])
+        tail_key = (sheet_name, target_ws.title)
+        target_row_idx = None
+        reserved = ticket_data.get('Reserved_Row')
+        if reserved and list(reserved[:2]) == [sheet_name, target_ws.title]:
+            # Gửi lại sau lỗi/timeout: Google có thể đã ghi rồi -> xem dòng đã giữ chỗ trước khi thêm dòng mới
+            current = target_ws.get_values(f"A{reserved[2]}:K{reserved[2]}")
+            current = current[0] if current else []
+            if row_matches(current, ticket_data['Phone'], ticket_data['Salon_Name']):
+                # Đã lên Sheet (cả tab phụ, vì batchUpdate là nguyên khối); chỉ ghi lại dòng nếu Status/Note đã được sửa trong lúc chờ
+                if [str(v) for v in current[9:11]] != [str(ticket_data['Note']), str(ticket_data['Status'])]:
+                    color = 'red' if "Support" in ticket_data['Status'] else 'black'
+                    sh.batch_update({"requests": ticket_row_requests(target_ws.id, reserved[2], reserved[3], row_data, color)})
+                _remember_saved_row(ticket_data, sheet_name, target_ws.title, reserved[2])
+                return True, f"✅ Đã lưu Daily Report (Dòng {reserved[2]}) và tự động đồng bộ Tab phụ."
+            if not any(str(v).strip() for v in current):
+                # Dòng vẫn trống: ghi lại đúng dòng đó; cache con trỏ không biết dòng này nên quét lại ở lần sau
+                target_row_idx, stt = reserved[2], reserved[3]
+                tail_pointers.invalidate(tail_key)
+        if target_row_idx is None:
+            # Dòng trống kế tiếp + STT tính từ con trỏ trong bộ nhớ (chỉ quét tab khi chưa có cache, cache quá hạn hoặc Sheet đã đổi)
+            target_row_idx, stt = tail_pointers.reserve(tail_key, lambda: target_ws.get_values(SCAN_RANGE), row_data,
+                                                        probe=lambda first, last: target_ws.get_values(f"A{first}:K{last}"))
+            if on_reserve: on_reserve([sheet_name, target_ws.title, target_row_idx, stt])
         
         color = 'red' if "Support" in ticket_data['Status'] else 'black'
-        apply_full_format(target_ws, target_row_idx, color)
+        requests = ticket_row_requests(target_ws.id, target_row_idx, stt, row_data, color)
 
         # 2. [TÍNH NĂNG MỚI] LƯU TỰ ĐỘNG SANG TAB TRAINING HOẶC 16 DIGITS
         if ticket_data['Ticket_Type'] == 'Training':
             try:
-                ws_train = sh.worksheet("Training")
+                ws_train = get_sheets_client().worksheet(sheet_name, "Training")
                 # Format: No | Date | Name | Time | Salon | CID | ISO | Phone | Owner | Email | Train 1 Date | Train 1 Note
                 train_row = [
                     "", ticket_data['Date_Str'], ticket_data['Agent_Name'], ticket_data['Support_Time'],
@@ -641,12 +535,12 @@ def save_to_google_sheet(ticket_data):
                     ticket_data['Phone'], ticket_data['Caller_Info'], ticket_data.get('Train_Email', ''),
                     ticket_data['Date_Str'], ticket_data['Training_Note']
                 ]
-                ws_train.append_row(train_row)
+                requests.append(append_row_request(ws_train.id, train_row))
             except: pass
 
         elif ticket_data['Ticket_Type'] == 'Request (16 Digits)':
             try:
-                ws_16 = sh.worksheet("16 Digits")
+                ws_16 = get_sheets_client().worksheet(sheet_name, "16 Digits")
                 c_dict = ticket_data.get('Card_Dict', {})
                 # Format: Name | MID | SALON | Date | Card Last 4 | Amount | App Code | Ticket No | Extra Due | Missed Tip | Refund | Void Mistake | 16 Digits | Exp Date | ISO | Note
                 row_16 = [
@@ -655,30 +549,57 @@ def save_to_google_sheet(ticket_data):
                     c_dict.get('ExtraDue', ''), c_dict.get('MissedTip', ''), c_dict.get('Refund', ''), c_dict.get('VoidMistake', ''),
                     "", "", c_dict.get('ISO', ''), ticket_data['Status']
                 ]
-                ws_16.append_row(row_16)
+                requests.append(append_row_request(ws_16.id, row_16))
             except: pass
 
+        # STT + dữ liệu + định dạng + dòng tab phụ: tất cả trong 1 request spreadsheets.batchUpdate
+        try:
+            sh.batch_update({"requests": requests})
+        except Exception:
+            tail_pointers.invalidate(tail_key)
+            raise
+
+        _remember_saved_row(ticket_data, sheet_name, target_ws.title, target_row_idx)
         return True, f"✅ Đã lưu Daily Report (Dòng {target_row_idx}) và tự động đồng bộ Tab phụ."
     except Exception as e: 
         return False, f"❌ Lỗi: {str(e)}"
 
-def update_google_sheet_row(date_str, phone, salon_name, new_status, new_note):
+def update_google_sheet_row(date_str, phone, salon_name, new_status, new_note, row_ref=None):
     try:
         try: date_obj = pd.to_datetime(date_str, format='%m/%d/%Y')
         except: date_obj = pd.to_datetime(date_str)
             
         sh, target_ws, sheet_name = get_target_worksheet(date_obj)
         if not target_ws: return False, sheet_name
-            
-        all_values = target_ws.get_all_values()
+
+        locator = get_row_locator()
+        key = locator_key(date_str, phone, salon_name)
         target_row_idx = -1
-        
-        for idx, row in enumerate(all_values):
-            if idx < 6: continue
-            if len(row) > 7:
-                row_phone = str(row[7]).strip()
-                row_salon = str(row[5]).strip()
-                if phone in row_phone and salon_name in row_salon: 
+
+        # Vị trí đã biết: Row_Ref của dòng đang sửa -> theo ngày|SĐT|tiệm -> theo mirror
+        candidates = []
+        if row_ref and parse_row_ref(row_ref): candidates.append(parse_row_ref(row_ref))
+        candidates += locator.by_key(key)
+        try: candidates += [(sheet_name, target_ws.title, r) for r in get_sheet_mirror().locate_rows(sheet_name, target_ws.title, phone, salon_name)]
+        except: pass
+
+        checked = set()
+        for s_name, t_title, r_idx in candidates:
+            if (s_name, t_title) != (sheet_name, target_ws.title) or r_idx in checked: continue
+            checked.add(r_idx)
+            # Chỉ đọc lại đúng 1 dòng để xác minh trước khi ghi
+            row_vals = target_ws.get_values(f"A{r_idx}:K{r_idx}")
+            if row_vals and row_matches(row_vals[0], phone, salon_name):
+                target_row_idx = r_idx
+                break
+            locator.forget(s_name, t_title, r_idx)
+
+        if target_row_idx == -1:
+            # Chưa biết vị trí (hoặc sheet đã bị sửa tay) -> quét cả tab như cũ
+            all_values = target_ws.get_all_values()
+            for idx, row in enumerate(all_values):
+                if idx < 6: continue
+                if row_matches(row, phone, salon_name): 
                     target_row_idx = idx + 1
                     break
                     
@@ -686,63 +607,104 @@ def update_google_sheet_row(date_str, phone, salon_name, new_status, new_note):
             target_ws.update(f"J{target_row_idx}:K{target_row_idx}", [[new_note, new_status]])
             color = 'blue' if "Done" in new_status else ('red' if "Support" in new_status else 'black')
             apply_full_format(target_ws, target_row_idx, color)
+            try: locator.remember(sheet_name, target_ws.title, target_row_idx, key)
+            except: pass
+            try: get_sheet_mirror().apply_row_update(sheet_name, target_ws.title, target_row_idx, {"Note": new_note, "Issue_Category": new_note, "Status": new_status})
+            except: pass
             return True, f"✅ Đã cập nhật (Dòng {target_row_idx})"
         else: 
-            return False, f"⚠️ Không tìm thấy dòng khớp"
+            # Đã quét cả tab mà không thấy: thử lại cũng không thấy, chỉ tốn thêm quota đọc
+            raise PermanentError("⚠️ Không tìm thấy dòng khớp")
+    except PermanentError:
+        raise
     except Exception as e: 
         return False, f"❌ Lỗi Update: {str(e)}"
 
-@st.cache_data(ttl=600, show_spinner=False)
-def load_gsheet_data(selected_sheets):
+@st.cache_resource(show_spinner=False)
+def get_row_locator():
+    return RowLocator()
+
+@st.cache_resource(show_spinner=False)
+def get_sheet_mirror():
+    # 1 mirror + 1 thread nền cho cả process, mọi phiên làm việc dùng chung
+    client = get_sheets_client()
+    mirror = SheetMirror(lambda: client)
+    mirror.start()
+    return mirror
+
+def _outbox_save_ticket(payload, checkpoint):
+    data_pack = dict(payload)
+    data_pack['Date_Obj'] = datetime.fromisoformat(data_pack['Date_Obj'])
+    return save_to_google_sheet(data_pack, on_reserve=lambda reserved: checkpoint(dict(payload, Reserved_Row=reserved)))
+
+def _outbox_update_row(payload, checkpoint):
+    return update_google_sheet_row(payload['date_str'], payload['phone'], payload['salon_name'], payload['new_status'], payload['new_note'], payload.get('row_ref'))
+
+@st.cache_resource(show_spinner=False)
+def get_sheet_outbox():
+    # Hàng đợi ghi Sheet + 1 thread nền cho cả process: lưu ticket không phải chờ Google
+    outbox = SheetOutbox({KIND_APPEND: _outbox_save_ticket, KIND_UPDATE: _outbox_update_row})
+    outbox.start()
+    return outbox
+
+def queue_ticket_sync(data_pack, ticket_id):
+    payload = {k: v for k, v in data_pack.items() if k != 'Date_Obj'}
+    payload['Date_Obj'] = data_pack['Date_Obj'].isoformat()
+    payload['Ticket_Id'] = ticket_id
+    key = row_key(data_pack['Date_Str'], data_pack['Phone'], data_pack['Salon_Name'])
+    return get_sheet_outbox().enqueue(KIND_APPEND, key, payload, ticket_id=ticket_id, agent_name=data_pack['Agent_Name'])
+
+def queue_row_update(date_str, phone, salon_name, new_status, new_note, agent_name="", row_ref=None):
+    # Dòng sửa lấy từ mirror Sheet (không có id ticket SQLite): xác định dòng bằng Row_Ref hoặc ngày|SĐT|tiệm
+    payload = {'date_str': date_str, 'phone': phone, 'salon_name': salon_name, 'new_status': new_status, 'new_note': new_note, 'row_ref': row_ref}
+    key = row_key(date_str, phone, salon_name, row_ref)
+    return get_sheet_outbox().enqueue(KIND_UPDATE, key, payload, agent_name=agent_name)
+
+def read_mirror_data(selected_sheets, mirror_version):
+    # 1 frame cho mỗi bộ file đang chọn, mọi phiên đọc chung; mirror đổi version thì tải lại từ SQLite
+    mirror = get_sheet_mirror()
+    name = ("reports", tuple(selected_sheets))
+    return get_dataset_store().get(name, token=mirror_version, loader=lambda: mirror.read_frame(list(name[1])), group="reports",
+                                   persist=True, signature=lambda: mirror.data_signature(list(name[1])))
+
+def load_gsheet_data(selected_sheets, fetch_mode=FETCH_API):
+    # fetch_mode chỉ áp dụng cho lần tải đầu của file mới (FETCH_API / FETCH_XLSX), sync nền sau đó luôn dùng Sheets API
     if not selected_sheets: return pd.DataFrame()
     try:
-        credentials = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive'])
-        gc = gspread.authorize(credentials)
-        all_data = []
-        for idx, s_name in enumerate(selected_sheets):
-            try:
-                sh = gc.open(s_name)
-                tabs = [ws for ws in sh.worksheets() if not any(ign in ws.title.lower() for ign in IGNORED_TAB_NAMES)]
-                for i, ws in enumerate(tabs):
-                    try:
-                        raw = ws.get_all_values()
-                        if len(raw) < 2: continue
-                        if len(ws.title) < 10 or "/" in ws.title:
-                            header_idx = -1
-                            for r_idx, row in enumerate(raw[:15]):
-                                if "salon" in "".join([str(c).lower() for c in row]): 
-                                    header_idx = r_idx
-                                    break
-                            if header_idx != -1:
-                                df_d = pd.DataFrame(raw[header_idx+1:], columns=clean_headers(raw[header_idx]))
-                                rename = {"Salon Name": "Salon_Name", "Name": "Agent_Name", "Time": "Support_Time", "Owner": "Caller_Info", "Phone": "Phone", "CID": "CID", "Note": "Note", "Status": "Status"}
-                                df_d = safe_process_dataframe(df_d, rename)
-                                if "Note" in df_d.columns: df_d["Issue_Category"] = df_d["Note"]
-                                df_d["Date"] = construct_date_from_context(None, s_name, ws.title)
-                                df_d["Ticket_Type"] = "Support"
-                                df_d["Status"] = df_d["Status"].replace({"Pending": "Support", "pending": "Support"})
-                                all_data.append(df_d)
-                    except: continue
-            except: pass
-        if all_data:
-            final_df = pd.concat(all_data, ignore_index=True).replace({'nan': '', 'None': '', 'NaN': ''})
-            final_df = final_df.drop_duplicates(subset=['Phone', 'Date', 'Support_Time', 'Agent_Name']).reset_index(drop=True)
-            return final_df
-        return pd.DataFrame()
+        mirror = get_sheet_mirror()
+        mirror.watch(selected_sheets)
+        # Chỉ lần đầu gặp file mới phải chờ tải từ Google, các lần sau đọc thẳng SQLite
+        missing = [s for s in selected_sheets if mirror.needs_initial_sync(s)]
+        if missing: mirror.sync_sheets(missing, mode=fetch_mode)
+        return read_mirror_data(tuple(selected_sheets), mirror.version)
     except Exception as e: 
         st.error(f"Lỗi: {e}")
         return pd.DataFrame()
 
-@st.cache_data(ttl=3600, show_spinner=False)
+@st.cache_resource(show_spinner=False, max_entries=8)
+def get_search_index(selected_sheets):
+    # 1 index cho mỗi bộ file đang xem, dùng chung mọi phiên; dữ liệu đổi thì chỉ index lại dòng mới/đổi
+    return SearchIndex()
+
+@st.cache_resource(show_spinner=False)
+def get_customer_directory():
+    # Bảng tra SĐT/CID -> tiệm + radar, dựng sẵn 1 lần cho cả process
+    return CustomerDirectory()
+
+def search_gsheet_data(df, selected_sheets, term, data_version):
+    return df.iloc[get_search_index(tuple(selected_sheets)).search(df, term, data_version)]
+
 def load_master_db():
+    return get_dataset_store().get("master_db", loader=_fetch_master_db, ttl=3600, persist=lambda data: "Error" not in data)
+
+def _fetch_master_db():
     try:
-        credentials = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive'])
-        gc = gspread.authorize(credentials)
-        sh = gc.open(MASTER_DB_FILE)
+        client = get_sheets_client()
+        client.open(MASTER_DB_FILE)
         master_data = {}
         
         try: 
-            ws_cid = sh.worksheet("CID")
+            ws_cid = client.worksheet(MASTER_DB_FILE, "CID")
             raw_cid = ws_cid.get_all_values()
             if len(raw_cid) > 1:
                 headers = clean_headers(raw_cid[0])
@@ -752,12 +714,12 @@ def load_master_db():
         except: master_data['CID'] = pd.DataFrame()
             
         try: 
-            ws_note = sh.worksheet("NOTE")
+            ws_note = client.worksheet(MASTER_DB_FILE, "NOTE")
             master_data['NOTE'] = pd.DataFrame(ws_note.get_all_values())
         except: master_data['NOTE'] = pd.DataFrame()
             
         try: 
-            ws_conf = sh.worksheet("CONFIRMATION")
+            ws_conf = client.worksheet(MASTER_DB_FILE, "CONFIRMATION")
             raw_conf = ws_conf.get_all_values()
             if len(raw_conf) > 1:
                 headers = clean_headers(raw_conf[1])
@@ -767,7 +729,7 @@ def load_master_db():
             
         try: 
             ws_term = None
-            for w in sh.worksheets(): 
+            for w in client.worksheets(MASTER_DB_FILE): 
                 if "terminal" in w.title.lower(): 
                     ws_term = w
                     break
@@ -779,33 +741,15 @@ def load_master_db():
         return {"Error": str(e)}
 
 def insert_ticket(date, salon, phone, issue, note, status, cid, agent, time_str, caller, ticket_type, iso="", train_note="", demo_note="", card_info=""):
-    conn = sqlite3.connect('crm_data.db')
-    c = conn.cursor()
-    created = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    c.execute('''INSERT INTO tickets (Date, Salon_Name, Phone, Issue_Category, Note, Status, Created_At, CID, Agent_Name, Support_Time, Caller_Info, Ticket_Type, ISO_System, Training_Note, Demo_Note, Card_16_Digits) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)''', (date, salon, phone, issue, note, status, created, cid, agent, time_str, caller, ticket_type, iso, train_note, demo_note, card_info))
-    conn.commit()
-    conn.close()
+    return db.tickets.insert(date, salon, phone, issue, note, status, cid, agent, time_str, caller, ticket_type, iso, train_note, demo_note, card_info)
 
 def update_ticket(tid, status, note, salon, phone, cid, caller, card_16="", exp_date=""):
-    conn = sqlite3.connect('crm_data.db')
-    c = conn.cursor()
     extra = f"{card_16} | EXP: {exp_date}" if exp_date else card_16
-    if extra:
-        sql = '''UPDATE tickets SET Status=?, Note=?, Salon_Name=?, Phone=?, CID=?, Caller_Info=?, Card_16_Digits=? WHERE id=?'''
-        params = (status, note, salon, phone, cid, caller, extra, tid)
-    else:
-        sql = '''UPDATE tickets SET Status=?, Note=?, Salon_Name=?, Phone=?, CID=?, Caller_Info=? WHERE id=?'''
-        params = (status, note, salon, phone, cid, caller, tid)
-    c.execute(sql, params)
-    conn.commit()
-    conn.close()
+    db.tickets.update(tid, status, note, salon, phone, cid, caller, extra)
 
 def update_confirmation_note(cid, new_note):
     try:
-        credentials = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive'])
-        gc = gspread.authorize(credentials)
-        sh = gc.open(MASTER_DB_FILE)
-        ws = sh.worksheet("CONFIRMATION")
+        ws = get_sheets_client().worksheet(MASTER_DB_FILE, "CONFIRMATION")
         cell = ws.find(cid)
         if cell: 
             ws.update_cell(cell.row, 5, new_note)
@@ -818,18 +762,18 @@ def update_confirmation_note(cid, new_note):
 # ==========================================
 st.sidebar.title("🏢 CRM - LLDTEK")
 
-conn = sqlite3.connect('crm_data.db')
-c = conn.cursor()
-c.execute("SELECT username FROM users WHERE is_active=1")
-active_users = [row[0] for row in c.fetchall()]
-conn.close()
+active_users = db.users.active_usernames()
 
 if st.sidebar.button("🔄 Cập nhật Dữ liệu Mới"): 
-    st.cache_data.clear()
+    # Chỉ kéo các tab đã thay đổi của file đang chọn về mirror local
+    with st.spinner("⏳ Đang đồng bộ Google Sheet..."):
+        get_sheet_mirror().sync_sheets(st.session_state.get("report_sheets", get_current_month_sheet()))
+    # Report tự tải lại theo version mới của mirror; danh sách file làm mới nền. Master DB giữ nguyên (không kéo cả sàn tải lại)
+    get_dataset_store().request_refresh("sheet_list")
     st.rerun()
 
 default_sheets = get_current_month_sheet()
-sheets = st.sidebar.multiselect("Dữ liệu Report:", AVAILABLE_SHEETS, default=default_sheets)
+sheets = st.sidebar.multiselect("Dữ liệu Report:", AVAILABLE_SHEETS, default=default_sheets, key="report_sheets")
 st.sidebar.markdown("---")
 
 if st.session_state.user_role == 'Admin':
@@ -844,17 +788,17 @@ if st.sidebar.button("🚪 Đăng xuất", type="secondary"):
     st.session_state.clear_storage = True
     st.rerun()
 
+try: sidebar_version = get_sheet_mirror().version
+except Exception: sidebar_version = None
 df_sidebar = load_gsheet_data(sheets)
 if sel_agent:
     if not df_sidebar.empty:
         today_str = get_company_time().strftime('%m/%d/%Y')
-        df_sidebar['Display_Date'] = df_sidebar['Date'].apply(format_date_display)
-        agent_today_df = df_sidebar[(df_sidebar['Display_Date'] == today_str) & (df_sidebar['Agent_Name'] == sel_agent)].copy()
+        agent_today_df = df_sidebar[(df_sidebar['Display_Date'] == today_str) & (df_sidebar['Agent_Name'] == sel_agent)]
         
         st.sidebar.markdown("---")
         st.sidebar.markdown(f"**🎯 Thành tích hôm nay của {sel_agent}**")
         if not agent_today_df.empty:
-            agent_today_df['Status_Norm'] = agent_today_df['Status'].astype(str).str.lower()
             done_count = len(agent_today_df[agent_today_df['Status_Norm'].str.contains('done')])
             pending_count = len(agent_today_df[agent_today_df['Status_Norm'].str.contains('pending') | agent_today_df['Status_Norm'].str.contains('support')])
             c_sd1, c_sd2 = st.sidebar.columns(2)
@@ -865,6 +809,26 @@ if sel_agent:
             c_sd1.metric("✅ Done", 0)
             c_sd2.metric("⚠️ Nợ", 0)
 
+    # Trạng thái đồng bộ Google Sheet của các ticket vừa lưu (outbox)
+    try:
+        sync_items = get_sheet_outbox().recent_items(sel_agent, limit=5)
+    except Exception:
+        sync_items = []
+    if sync_items:
+        sync_icons = {STATUS_PENDING: "⏳", STATUS_SENDING: "📤", STATUS_DONE: "✅", STATUS_FAILED: "❌"}
+        with st.sidebar.expander("📤 Đồng bộ Google Sheet", expanded=any(it[4] == STATUS_FAILED for it in sync_items)):
+            for item_id, ticket_id, kind, payload, status, attempts, last_error, result, updated_at in sync_items:
+                salon_part = payload.get('Salon_Name', payload.get('salon_name', ''))
+                phone_part = payload.get('Phone', payload.get('phone', ''))
+                label = "Lưu" if kind == KIND_APPEND else "Sửa"
+                st.caption(f"{sync_icons.get(status, '')} {label} {salon_part or phone_part} ({phone_part}) - {updated_at[11:16]}")
+                if status == STATUS_PENDING and attempts: st.caption(f"↻ Thử lại lần {attempts + 1}: {last_error[:80]}")
+                if status == STATUS_FAILED:
+                    st.caption(f"⚠️ {last_error[:120]}")
+                    if st.button("🔁 Thử lại", key=f"outbox_retry_{item_id}"):
+                        get_sheet_outbox().retry(item_id)
+                        st.rerun()
+
 menu_options = ["🆕 New Ticket", "📌 Cần Follow-up", "📥 Inbox Phân Việc", "🗂️ Tra cứu Master Data", "🔍 Search & History"]
 if st.session_state.user_role == 'Admin':
     menu_options.append("📊 Dashboard (SUP Only)")
@@ -901,16 +865,17 @@ def confirm_save_dialog(data_pack, is_duplicate=False):
     st.markdown("---")
 
     if st.button("✅ ĐỒNG Ý LƯU & CLEAR FORM", type="primary", use_container_width=True):
-        insert_ticket(data_pack['Date_Str'], data_pack['Salon_Name'], data_pack['Phone'], data_pack['Note'], data_pack['Note'], data_pack['Status'], data_pack['CID'], data_pack['Agent_Name'], data_pack['Support_Time'], data_pack['Caller_Info'], data_pack['Ticket_Type'], "", data_pack['Training_Note'], "", data_pack['Card_16_Digits'])
-        with st.spinner("⏳ Đang đồng bộ Google Sheet..."):
-            success, msg = save_to_google_sheet(data_pack)
-        if success: 
-            if "messages" in st.session_state: del st.session_state.messages
-            st.toast("✅ Đã lưu Ticket & Reset Trí nhớ AI!", icon="✨")
-            clear_form()
-            st.rerun() 
-        else: 
-            st.error(f"Lỗi GSheet: {msg}")
+        ticket_id = insert_ticket(data_pack['Date_Str'], data_pack['Salon_Name'], data_pack['Phone'], data_pack['Note'], data_pack['Note'], data_pack['Status'], data_pack['CID'], data_pack['Agent_Name'], data_pack['Support_Time'], data_pack['Caller_Info'], data_pack['Ticket_Type'], "", data_pack['Training_Note'], "", data_pack['Card_16_Digits'])
+        # Google Sheet được ghi ở thread nền (outbox), trạng thái đồng bộ xem ở sidebar
+        try:
+            queue_ticket_sync(data_pack, ticket_id)
+        except Exception as e:
+            st.error(f"Lỗi hàng đợi GSheet: {e}")
+            return
+        if "messages" in st.session_state: del st.session_state.messages
+        st.toast("✅ Đã lưu Ticket & Reset Trí nhớ AI! Đang đồng bộ Google Sheet...", icon="✨")
+        clear_form()
+        st.rerun() 
 
 # ==========================================
 # MODULE 1: NEW TICKET (TÍCH HỢP SMART TOOLKIT & LIVE PING)
@@ -966,17 +931,13 @@ if menu == "🆕 New Ticket":
 
     # --- [V151 TÍNH NĂNG MỚI] SMART DEVICE TOOLKIT ---
     st.markdown("### 🛠️ SMART DEVICE TOOLKIT (Chẩn đoán & Tạo Note Chuẩn)")
-    conn = sqlite3.connect('crm_data.db')
-    c = conn.cursor()
-    c.execute("SELECT DISTINCT category FROM sops")
-    cats = [r[0] for r in c.fetchall()]
+    cats = db.sops.categories()
     
     if cats:
         c_tk1, c_tk2, c_tk3 = st.columns([1, 1.5, 2])
         sop_cat = c_tk1.selectbox("Loại lỗi:", cats)
         
-        c.execute("SELECT device_name, steps FROM sops WHERE category=?", (sop_cat,))
-        sops_data = c.fetchall()
+        sops_data = db.sops.devices(sop_cat)
         device_names = [r[0] for r in sops_data]
         
         if device_names:
@@ -990,7 +951,6 @@ if menu == "🆕 New Ticket":
                 new_text = f"[{sop_dev}] Đã xử lý: {', '.join(selected_steps)}."
                 st.session_state[f"ticket_note_{fk}"] = (st.session_state[f"ticket_note_{fk}"] + "\n" + new_text).strip()
                 st.rerun()
-    conn.close()
     st.markdown("---")
         
     warn_obj = st.session_state.get(f"ticket_warnings_{fk}", {})
@@ -1162,47 +1122,17 @@ if menu == "🆕 New Ticket":
         
         if lookup_val:
             with st.spinner("Đang lục tìm & Quét Radar..."):
-                found_data = None
-                if df_sidebar is not None and not df_sidebar.empty:
-                    df_search = df_sidebar.copy()
-                    if 'Date_Obj' not in df_search.columns:
-                        try: df_search['Date_Obj'] = pd.to_datetime(df_search['Date'], errors='coerce')
-                        except: pass
-                    if 'Date_Obj' in df_search.columns:
-                        df_search = df_search.sort_values('Date_Obj', ascending=False)
-                        
-                    w_mask = pd.Series([False]*len(df_search))
-                    w_mask |= df_search['Phone'].astype(str).str.contains(lookup_val, case=False, na=False)
-                    w_mask |= df_search['CID'].astype(str).str.contains(lookup_val, case=False, na=False)
-                    
-                    if w_mask.any():
-                        match_row = df_search[w_mask].iloc[0]
-                        found_data = {"salon": str(match_row.get('Salon_Name', '')), "cid": str(match_row.get('CID', '')), "phone": str(match_row.get('Phone', '')), "owner": str(match_row.get('Caller_Info', ''))}
-
-                if not found_data:
-                    conn = sqlite3.connect('crm_data.db')
-                    c = conn.cursor()
-                    c.execute("SELECT Salon_Name, CID, Phone, Caller_Info FROM tickets WHERE Phone LIKE ? OR CID LIKE ? ORDER BY id DESC LIMIT 1", (f"%{lookup_val}%", f"%{lookup_val}%"))
-                    res = c.fetchone()
-                    if res: found_data = {"salon": res[0], "cid": res[1], "phone": res[2], "owner": res[3]}
-                    conn.close()
-                
+                directory = get_customer_directory()
+                history_token = (tuple(sheets), sidebar_version)
+                directory.refresh_history(df_sidebar, history_token, format_date_display)
+                directory.refresh_local(db.tickets)
+                found_data = directory.resolve(lookup_val, sources=("history", "local"), history_token=history_token)
                 if not found_data:
-                    master_data = load_master_db()
-                    df_cid = master_data.get('CID', pd.DataFrame())
-                    if not df_cid.empty:
-                        try:
-                            mask = df_cid.astype(str).apply(lambda x: x.str.contains(lookup_val, case=False, na=False)).any(axis=1)
-                            res_df = df_cid[mask]
-                            if not res_df.empty:
-                                first_row = res_df.iloc[0]
-                                cols = [str(c).lower().strip() for c in df_cid.columns]
-                                def get_val(col_keywords, default_idx):
-                                    for idx, c_name in enumerate(cols):
-                                        if any(k in c_name for k in col_keywords): return str(first_row.iloc[idx])
-                                    return str(first_row.iloc[default_idx]) if len(first_row) > default_idx else ""
-                                found_data = {"salon": get_val(["salon", "name", "tiệm"], 0), "cid": get_val(["cid", "id"], 1) or lookup_val, "phone": get_val(["phone", "sđt", "tel"], 2), "owner": get_val(["owner", "caller", "contact"], 3)}
-                        except: pass
+                    # Master Data chỉ tải khi 2 nguồn trên không có (tốn 1 lần gọi Google)
+                    try:
+                        directory.refresh_master(load_master_db().get('CID', pd.DataFrame()))
+                        found_data = directory.resolve(lookup_val, sources=("master",))
+                    except: pass
 
                 if found_data:
                     st.session_state[f"ticket_salon_{fk}"] = found_data.get("salon", "")
@@ -1211,24 +1141,11 @@ if menu == "🆕 New Ticket":
                     st.session_state[f"ticket_owner_{fk}"] = found_data.get("owner", "")
                     st.toast("✅ Đã tự động điền dữ liệu!", icon="⚡")
                     
-                    radar_data, called_today, today_str = [], False, get_company_time().strftime('%m/%d/%Y')
-                    if df_sidebar is not None and not df_sidebar.empty:
-                        r_mask = pd.Series([False]*len(df_sidebar))
-                        if found_data.get("phone", ""): r_mask |= df_sidebar['Phone'].astype(str).str.contains(found_data.get("phone", ""), case=False, na=False)
-                        if found_data.get("cid", ""): r_mask |= df_sidebar['CID'].astype(str).str.contains(found_data.get("cid", ""), case=False, na=False)
-                        if r_mask.any():
-                            df_recent = df_sidebar[r_mask].copy()
-                            if 'Date_Obj' not in df_recent.columns:
-                                try: df_recent['Date_Obj'] = pd.to_datetime(df_recent['Date'], errors='coerce')
-                                except: pass
-                            if 'Date_Obj' in df_recent.columns: df_recent = df_recent.sort_values('Date_Obj', ascending=False)
-                            for _, r in df_recent.head(5).iterrows():
-                                d_str = format_date_display(r.get('Date',''))
-                                if d_str == today_str: called_today = True
-                                full_note_text = str(r.get('Issue_Category', r.get('Note', '')))
-                                if r.get('Ticket_Type') == 'Training' and r.get('Training_Note'): full_note_text = str(r.get('Training_Note')) + " | " + full_note_text
-                                radar_data.append({"Ngày": d_str, "Nhân Viên": r.get('Agent_Name', 'Unknown'), "Trạng Thái": r.get('Status', ''), "Nội Dung Note": full_note_text})
-                            st.session_state[f"ticket_warnings_{fk}"] = {"data": radar_data, "called_today": called_today}
+                    today_str = get_company_time().strftime('%m/%d/%Y')
+                    radar_data = directory.recent_contacts(found_data.get("phone", ""), found_data.get("cid", ""), history_token=history_token)
+                    if radar_data:
+                        called_today = any(r["Ngày"] == today_str for r in radar_data)
+                        st.session_state[f"ticket_warnings_{fk}"] = {"data": radar_data, "called_today": called_today}
                 else: st.warning("⚠️ Không tìm thấy tiệm trong DB. Vui lòng nhập tay.")
         st.rerun()
 
@@ -1241,13 +1158,7 @@ if menu == "🆕 New Ticket":
     if btn_ping:
         save_current_form_state()
         if new_salon or new_phone:
-            conn = sqlite3.connect('crm_data.db')
-            c = conn.cursor()
-            created = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            c.execute("INSERT INTO escalations (agent_name, salon_name, phone, note, status, created_at) VALUES (?, ?, ?, ?, 'Active', ?)",
-                      (sel_agent, new_salon, new_phone, new_note, created))
-            conn.commit()
-            conn.close()
+            db.escalations.create(sel_agent, new_salon, new_phone, new_note)
             st.error(f"🚨 ĐÃ PHÁT TÍN HIỆU CỨU NÉT LÊN DASHBOARD CỦA SUP! Vui lòng giữ máy với khách và chờ hỗ trợ.")
         else:
             st.warning("⚠️ Vui lòng điền ít nhất Tên tiệm hoặc Số điện thoại để SUP biết bạn đang hỗ trợ ai!")
@@ -1300,17 +1211,12 @@ elif menu == "📌 Cần Follow-up":
             df_fu = load_gsheet_data(sheets)
         
         if not df_fu.empty:
-            df_fu['Status_Norm'] = df_fu['Status'].astype(str).str.lower()
             mask_fu = (df_fu['Agent_Name'] == sel_agent) & (df_fu['Status_Norm'].str.contains('support') | df_fu['Status_Norm'].str.contains('pending'))
             df_pending = df_fu[mask_fu].copy()
             
             if not df_pending.empty:
-                if "Date" in df_pending.columns: 
-                    df_pending['Date_Obj'] = pd.to_datetime(df_pending['Date'], errors='coerce')
-                    df_pending = df_pending.sort_values('Date_Obj', ascending=False)
-                
-                df_pending['Display_Date'] = df_pending['Date'].apply(format_date_display)
-                df_pending['Status'] = df_pending['Status'].apply(map_status_badge)
+                df_pending = df_pending.sort_values('Date_Obj', ascending=False)
+                df_pending['Status'] = status_badges(df_pending['Status'])
                 
                 st.info(f"🚨 Hiện tại bạn đang có **{len(df_pending)}** ticket cần xử lý (Support/Pending). Vui lòng follow-up và chuyển sang Done.")
                 
@@ -1335,17 +1241,14 @@ elif menu == "📌 Cần Follow-up":
                     if st.button("Lưu Thay Đổi (Cập nhật 2 nơi)", type="primary"):
                         clean_status = re.sub(r'^[🟢🔴🟠⚫]\s*', '', str(new_status))
                         update_ticket(row.get('id'), clean_status, new_note, row.get('Salon_Name'), row.get('Phone'), row.get('CID'), row.get('Caller_Info'), str(row.get('Card_16_Digits', '')))
-                        with st.spinner("Đang cập nhật Google Sheet & Đổi màu..."):
-                            date_str = row.get('Display_Date') if row.get('Display_Date') else row.get('Date')
-                            success, msg = update_google_sheet_row(date_str, row.get('Phone'), row.get('Salon_Name'), clean_status, new_note)
-                        if success: 
-                            st.cache_data.clear() 
-                            st.success(f"✅ Đã cập nhật Database!\n{msg}")
-                            time.sleep(1)
-                            st.rerun()
-                        else: 
-                            st.warning(f"✅ Đã cập nhật Database nhưng ❌ {msg}")
-                            st.rerun()
+                        date_str = row.get('Display_Date') if row.get('Display_Date') else row.get('Date')
+                        try:
+                            queue_row_update(date_str, row.get('Phone'), row.get('Salon_Name'), clean_status, new_note, sel_agent, row.get('Row_Ref'))
+                            st.success("✅ Đã cập nhật Database! Google Sheet & màu chữ sẽ được cập nhật ở nền.")
+                        except Exception as e:
+                            st.warning(f"✅ Đã cập nhật Database nhưng ❌ {e}")
+                        time.sleep(1)
+                        st.rerun()
 
                 event_fu = st.dataframe(df_pending[final_cols_fu], hide_index=True, use_container_width=True, selection_mode="single-row", on_select="rerun", column_config={"Note": st.column_config.TextColumn("Nội dung", width="large")})
                 if len(event_fu.selection.rows) > 0: process_followup_ticket(df_pending.iloc[event_fu.selection.rows[0]])
@@ -1363,9 +1266,7 @@ elif menu == "📥 Inbox Phân Việc":
         tab_pending, tab_history = st.tabs(["🔴 Việc Mới (Cần Nhận)", "🟢 Lịch Sử & Đang Xử Lý"])
         
         with tab_pending:
-            conn = sqlite3.connect('crm_data.db')
-            df_inbox = pd.read_sql_query("SELECT id, salon_name as 'Tên Tiệm', phone as 'SĐT', note as 'Nội dung dặn dò', created_by as 'Người giao', created_at as 'Thời gian giao' FROM dispatches WHERE target_agent=? AND status='Pending'", conn, params=(sel_agent,))
-            conn.close()
+            df_inbox = db.dispatches.pending_for(sel_agent)
             
             if df_inbox.empty:
                 st.success("🎉 Bạn đang không có task mới nào. Rất tuyệt vời!")
@@ -1377,11 +1278,7 @@ elif menu == "📥 Inbox Phân Việc":
                         st.info(f"**Lời dặn:** {row['Nội dung dặn dò']}")
                         
                         if st.button("🚀 XÁC NHẬN NHẬN TICKET NÀY", key=f"take_{row['id']}", type="primary"):
-                            conn = sqlite3.connect('crm_data.db')
-                            c = conn.cursor()
-                            c.execute("UPDATE dispatches SET status='In Progress' WHERE id=?", (row['id'],))
-                            conn.commit()
-                            conn.close()
+                            db.dispatches.set_status(int(row['id']), 'In Progress')
                             
                             fk = st.session_state.form_key
                             st.session_state[f"ticket_salon_{fk}"] = row['Tên Tiệm']
@@ -1393,10 +1290,8 @@ elif menu == "📥 Inbox Phân Việc":
                             st.rerun()
 
         with tab_history:
-            conn = sqlite3.connect('crm_data.db')
             # Lấy các task Đang làm hoặc Đã xong
-            df_hist = pd.read_sql_query("SELECT id, salon_name as 'Tên Tiệm', phone as 'SĐT', note as 'Nội dung dặn dò', created_by as 'Người giao', created_at as 'Thời gian giao', status as 'Trạng thái' FROM dispatches WHERE target_agent=? AND status != 'Pending' ORDER BY id DESC LIMIT 20", conn, params=(sel_agent,))
-            conn.close()
+            df_hist = db.dispatches.history_for(sel_agent)
             
             if df_hist.empty:
                 st.info("Chưa có lịch sử nhận việc.")
@@ -1411,11 +1306,7 @@ elif menu == "📥 Inbox Phân Việc":
                         # Nếu đang xử lý thì hiện nút Báo Cáo Xong
                         if row['Trạng thái'] == 'In Progress':
                             if st.button("✅ Báo cáo ĐÃ XỬ LÝ XONG (Done)", key=f"done_{row['id']}"):
-                                conn = sqlite3.connect('crm_data.db')
-                                c = conn.cursor()
-                                c.execute("UPDATE dispatches SET status='Done' WHERE id=?", (row['id'],))
-                                conn.commit()
-                                conn.close()
+                                db.dispatches.set_status(int(row['id']), 'Done')
                                 st.success("Đã báo cáo hoàn thành cho SUP!")
                                 st.rerun()
 
@@ -1442,7 +1333,7 @@ elif menu == "🗂️ Tra cứu Master Data":
                         mask = df_cid.astype(str).apply(lambda x: x.str.contains(search_term, case=False, na=False)).any(axis=1)
                         st.dataframe(df_cid[mask], use_container_width=True)
                     if enable_bot:
-                        if is_cloud_mode: st.warning("⚠️ Bot chỉ chạy trên Localhost.")
+                        if is_cloud_mode and not HAS_HTTP_LOOKUP: st.warning("⚠️ Bot chỉ chạy trên Localhost.")
                         else:
                             with st.spinner(f"🤖 Bot đang tra cứu ngầm..."): st.session_state.search_result_df = run_search_engine(search_term)
             if st.session_state.search_result_df is not None and not st.session_state.search_result_df.empty:
@@ -1450,7 +1341,7 @@ elif menu == "🗂️ Tra cứu Master Data":
                 st.dataframe(st.session_state.search_result_df, use_container_width=True)
                 if st.button("💾 Lưu kết quả vào Database"):
                     success, msg = save_to_master_db_gsheet(st.session_state.search_result_df)
-                    if success: st.success(f"✅ {msg}"); st.balloons(); st.cache_data.clear()
+                    if success: st.success(f"✅ {msg}"); st.balloons(); get_dataset_store().refresh("master_db")
                     else: st.error(f"❌ {msg}")
         with tab_conf:
              st.dataframe(master_data.get('CONFIRMATION', pd.DataFrame()), use_container_width=True)
@@ -1481,29 +1372,23 @@ elif menu == "🗂️ Tra cứu Master Data":
 
 elif menu == "🔍 Search & History":
     st.title("🔍 Tra cứu & Lịch sử")
-    with st.spinner("⏳ Đang tải dữ liệu lịch sử..."): df = load_gsheet_data(sheets)
+    # Lấy version trước khi tải: lỡ mirror vừa đổi thì lần rerun sau index tự cập nhật lại
+    try: data_version = get_sheet_mirror().version
+    except Exception: data_version = None
+    with st.spinner("⏳ Đang tải dữ liệu lịch sử..."): df = load_gsheet_data(sheets, fetch_mode=HISTORY_FETCH_MODE)
 
     term = st.text_input("🔎 Nhập từ khóa (Tên tiệm, SĐT, CID):")
     filter_type = st.radio("Lọc:", ["Tất cả", "Training", "Request (16 Digits)", "SMS"], horizontal=True)
     
     if term and not df.empty:
-        mask = pd.Series([False]*len(df))
-        cols = ['Salon_Name', 'Phone', 'CID', 'Agent_Name', 'Date']
-        valid = [c for c in cols if c in df.columns] 
-        for c in valid: mask |= df[c].astype(str).str.lower().str.contains(term.lower(), na=False)
-            
-        df_search = df[mask].copy()
+        df_search = search_gsheet_data(df, sheets, term, data_version).copy()
         if filter_type == 'Training': df_search = df_search[df_search['Ticket_Type'] == 'Training']
         elif filter_type == 'Request (16 Digits)': df_search = df_search[df_search['Ticket_Type'].str.contains('Request', na=False)]
         elif filter_type == 'SMS': df_search = df_search[df_search['Ticket_Type'].str.contains('SMS', na=False)]
             
         if not df_search.empty:
-            if "Date" in df_search.columns: 
-                df_search['Date_Obj'] = pd.to_datetime(df_search['Date'], errors='coerce')
-                df_search = df_search.sort_values('Date_Obj', ascending=False)
-                
-            df_search['Display_Date'] = df_search['Date'].apply(format_date_display)
-            df_search['Status'] = df_search['Status'].apply(map_status_badge)
+            df_search = df_search.sort_values('Date_Obj', ascending=False)
+            df_search['Status'] = status_badges(df_search['Status'])
             
             cols = ['Display_Date','Agent_Name','Ticket_Type','Salon_Name','Note','Status'] 
             if filter_type == 'Request (16 Digits)': cols.append('Card_16_Digits')
@@ -1530,11 +1415,11 @@ elif menu == "🔍 Search & History":
                 if st.button("Lưu Thay Đổi (Cập nhật 2 nơi)"):
                     clean_status = re.sub(r'^[🟢🔴🟠⚫]\s*', '', str(new_status))
                     update_ticket(row.get('id'), clean_status, new_note, row.get('Salon_Name'), row.get('Phone'), row.get('CID'), row.get('Caller_Info'), new_card, new_exp)
-                    with st.spinner("Đang cập nhật Google Sheet & Đổi màu..."):
-                        date_str = row.get('Display_Date') if row.get('Display_Date') else row.get('Date')
-                        success, msg = update_google_sheet_row(date_str, row.get('Phone'), row.get('Salon_Name'), clean_status, new_note)
-                    if success: st.cache_data.clear(); st.success(f"✅ Đã cập nhật Database!\n{msg}"); time.sleep(1); st.rerun()
-                    else: st.warning(f"✅ Đã cập nhật Database nhưng ❌ {msg}"); st.rerun()
+                    date_str = row.get('Display_Date') if row.get('Display_Date') else row.get('Date')
+                    try:
+                        queue_row_update(date_str, row.get('Phone'), row.get('Salon_Name'), clean_status, new_note, sel_agent, row.get('Row_Ref'))
+                        st.success("✅ Đã cập nhật Database! Google Sheet sẽ được cập nhật ở nền."); time.sleep(1); st.rerun()
+                    except Exception as e: st.warning(f"✅ Đã cập nhật Database nhưng ❌ {e}"); st.rerun()
                         
             event = st.dataframe(df_search[final_cols], hide_index=True, use_container_width=True, selection_mode="single-row", on_select="rerun", column_config={"Note": st.column_config.TextColumn("Nội dung", width="large")}) 
             if len(event.selection.rows) > 0: edit_ticket(df_search.iloc[event.selection.rows[0]])
@@ -1548,8 +1433,7 @@ elif menu == "📊 Dashboard (SUP Only)":
     company_now = get_company_time()
     
     # --- [V151 TÍNH NĂNG MỚI] HIỂN THỊ CẢNH BÁO CỨU NÉT TỪ AGENT ---
-    conn = sqlite3.connect('crm_data.db')
-    df_esc = pd.read_sql_query("SELECT * FROM escalations WHERE status='Active'", conn)
+    df_esc = db.escalations.active()
     if not df_esc.empty:
         st.error(f"🚨 CẢNH BÁO: ĐANG CÓ {len(df_esc)} TÍN HIỆU CẦN CỨU NÉT TỪ AGENT! 🚨")
         for idx, row in df_esc.iterrows():
@@ -1557,22 +1441,24 @@ elif menu == "📊 Dashboard (SUP Only)":
                 st.markdown(f"**Lúc:** {row['created_at']}")
                 st.code(row['note'], language="text")
                 if st.button(f"✅ Đã tiếp nhận & Hỗ trợ xong (ID: {row['id']})", key=f"esc_{row['id']}"):
-                    c = conn.cursor()
-                    c.execute("UPDATE escalations SET status='Resolved' WHERE id=?", (row['id'],))
-                    conn.commit()
+                    db.escalations.resolve(int(row['id']))
                     st.toast("Đã đóng tín hiệu cứu nét!")
                     st.rerun()
-    conn.close()
     # -------------------------------------------------------------
 
+    # Agent đang online (heartbeat trong 5 phút gần nhất)
+    online_now = get_presence().online_agents()
+    with st.expander(f"🟢 Agent đang online: {len(online_now)}", expanded=False):
+        if online_now:
+            now_dt = datetime.now()
+            st.markdown("  \n".join(f"🟢 **{u}** - {max(0, int((now_dt - ts).total_seconds() // 60))} phút trước" for u, ts in online_now))
+        else:
+            st.caption("Không có agent nào hoạt động trong 5 phút gần nhất.")
+
     with st.spinner("⏳ Đang tải dữ liệu vận hành..."): df = load_gsheet_data(sheets)
         
     if not df.empty:
-        df_chart = df.copy() 
-        if 'Date' in df_chart.columns: 
-            df_chart['Date_Obj'] = pd.to_datetime(df_chart['Date'], errors='coerce')
-            df_chart = df_chart.dropna(subset=['Date_Obj'])
-            df_chart['Status_Norm'] = df_chart['Status'].astype(str).str.lower()
+        df_chart = df.dropna(subset=['Date_Obj'])
             
         with st.expander("📅 BỘ LỌC DỮ LIỆU", expanded=False):
             col_filter, col_range = st.columns([1, 2])
@@ -1606,7 +1492,7 @@ elif menu == "📊 Dashboard (SUP Only)":
                         st.dataframe(top_urgent[top_urgent['Số ticket đang treo'] > 1], hide_index=True, use_container_width=True)
                     with col_urg2:
                         st.markdown("**👤 Trách Nhiệm Tồn Đọng Theo Agent**")
-                        pending_agent = df_pending['Agent_Name'].value_counts().reset_index()
+                        pending_agent = df_pending['Agent_Name'].pipe(count_values).reset_index()
                         pending_agent.columns = ['Agent', 'Số lượng']
                         st.dataframe(pending_agent, hide_index=True, use_container_width=True)
                     st.markdown("**📋 Chi Tiết Danh Sách Tồn Đọng**")
@@ -1626,11 +1512,7 @@ elif menu == "📊 Dashboard (SUP Only)":
                 if c_s2.button("Tìm & Điền", use_container_width=True):
                     if search_kw:
                         with st.spinner("Đang lục tìm dữ liệu..."):
-                            conn = sqlite3.connect('crm_data.db')
-                            c = conn.cursor()
-                            c.execute("SELECT Salon_Name, Phone FROM tickets WHERE CID LIKE ? OR Phone LIKE ? ORDER BY id DESC LIMIT 1", (f"%{search_kw}%", f"%{search_kw}%"))
-                            res = c.fetchone()
-                            conn.close()
+                            res = db.tickets.find_latest_by_phone_or_cid(search_kw, "Salon_Name, Phone")
                             
                             if res:
                                 st.session_state.disp_salon = res[0]
@@ -1649,13 +1531,7 @@ elif menu == "📊 Dashboard (SUP Only)":
                     
                     if st.form_submit_button("🚀 PHÓNG LỆNH GIAO VIỆC", type="primary"):
                         if d_phone:
-                            conn = sqlite3.connect('crm_data.db')
-                            c = conn.cursor()
-                            created = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                            c.execute("INSERT INTO dispatches (target_agent, salon_name, phone, note, status, created_by, created_at) VALUES (?, ?, ?, ?, 'Pending', ?, ?)", 
-                                      (d_agent, d_salon, d_phone, d_note, st.session_state.current_user, created))
-                            conn.commit()
-                            conn.close()
+                            db.dispatches.create(d_agent, d_salon, d_phone, d_note, st.session_state.current_user)
                             
                             # Xóa bộ nhớ form sau khi giao
                             st.session_state.disp_salon = ""
@@ -1669,9 +1545,7 @@ elif menu == "📊 Dashboard (SUP Only)":
                 # 4. Bảng Theo dõi tiến độ Giao việc
                 st.markdown("---")
                 st.markdown("### 📋 Lịch Sử & Tiến Độ Việc Đã Giao")
-                conn = sqlite3.connect('crm_data.db')
-                df_dispatched = pd.read_sql_query("SELECT id, target_agent as 'Giao cho', salon_name as 'Tên Tiệm', phone as 'SĐT', note as 'Nội dung', created_at as 'Lúc giao', status as 'Trạng thái' FROM dispatches ORDER BY id DESC LIMIT 50", conn)
-                conn.close()
+                df_dispatched = db.dispatches.recent(50)
                 
                 if not df_dispatched.empty:
                     # Chuyển đổi trạng thái sang text tiếng Việt có biểu tượng
@@ -1755,7 +1629,7 @@ elif menu == "📊 Dashboard (SUP Only)":
                 done = len(df_filtered[df_filtered['Status_Norm'].str.contains('done')])
                 pending = len(df_filtered[df_filtered['Status_Norm'].str.contains('pending')|df_filtered['Status_Norm'].str.contains('support')])
                 report_str = f"📋 BÁO CÁO VẬN HÀNH LLDTEK - {d_start.strftime('%d/%m/%Y')}\n--------------------------------------------------\n**1. TỔNG QUAN TICKET:**\n- Tổng: {total} | Done: {done} | Support: {pending}\n\n**2. TOP NHÂN SỰ XUẤT SẮC:**\n"
-                for i, (name, count) in enumerate(df_filtered[df_filtered['Status_Norm'].str.contains('done')]['Agent_Name'].value_counts().head(3).items()):
+                for i, (name, count) in enumerate(df_filtered[df_filtered['Status_Norm'].str.contains('done')]['Agent_Name'].pipe(count_values).head(3).items()):
                     report_str += f"- Top {i+1}: {name} ({count} tickets done)\n"
                 st.text_area("Copy gửi Group Zalo/Viber:", value=report_str, height=250)
 
@@ -1763,11 +1637,11 @@ elif menu == "📊 Dashboard (SUP Only)":
                 # [THÊM LẠI THEO YÊU CẦU] BẢNG THỐNG KÊ NĂNG SUẤT TỪNG NHÂN SỰ
                 st.markdown("### 🏆 Bảng Tổng Kết Năng Suất & Tồn Đọng Theo Agent")
                 if 'Agent_Name' in df_filtered.columns:
-                    agent_stats = df_filtered['Agent_Name'].value_counts().reset_index()
+                    agent_stats = df_filtered['Agent_Name'].pipe(count_values).reset_index()
                     agent_stats.columns = ['Nhân viên', 'Tổng Ticket']
-                    pending_stats = df_filtered[df_filtered['Status_Norm'].str.contains('pending') | df_filtered['Status_Norm'].str.contains('support')]['Agent_Name'].value_counts().reset_index()
+                    pending_stats = df_filtered[df_filtered['Status_Norm'].str.contains('pending') | df_filtered['Status_Norm'].str.contains('support')]['Agent_Name'].pipe(count_values).reset_index()
                     pending_stats.columns = ['Nhân viên', 'Đang nợ (Support)']
-                    done_stats = df_filtered[df_filtered['Status_Norm'].str.contains('done')]['Agent_Name'].value_counts().reset_index()
+                    done_stats = df_filtered[df_filtered['Status_Norm'].str.contains('done')]['Agent_Name'].pipe(count_values).reset_index()
                     done_stats.columns = ['Nhân viên', 'Đã chốt (Done)']
                     final_stats = pd.merge(agent_stats, done_stats, on='Nhân viên', how='left').fillna(0)
                     final_stats = pd.merge(final_stats, pending_stats, on='Nhân viên', how='left').fillna(0)
@@ -1792,7 +1666,6 @@ elif menu == "👥 Quản lý Nhân sự / SOP":
     
     with tab_users:
         st.markdown("### 🛠️ Thêm / Cập nhật Tài khoản")
-        conn = sqlite3.connect('crm_data.db')
         col_u1, col_u2, col_u3, col_u4 = st.columns(4)
         with st.form("user_management"):
             u_name = col_u1.text_input("Tên Nhân viên (Username)")
@@ -1802,35 +1675,25 @@ elif menu == "👥 Quản lý Nhân sự / SOP":
             
             if st.form_submit_button("Lưu thay đổi nhân sự", type="primary"):
                 if u_name:
-                    c = conn.cursor()
-                    c.execute("SELECT * FROM users WHERE username=?", (u_name,))
-                    exists = c.fetchone()
                     active_val = 1 if u_status == "Hoạt động" else 0
-                    if exists:
-                        if u_pass: c.execute("UPDATE users SET password=?, role=?, is_active=? WHERE username=?", (u_pass, u_role, active_val, u_name))
-                        else: c.execute("UPDATE users SET role=?, is_active=? WHERE username=?", (u_role, active_val, u_name))
-                        st.success(f"Đã cập nhật tài khoản: {u_name}")
-                    else:
-                        if not u_pass: u_pass = '123456' 
-                        c.execute("INSERT INTO users (username, password, role, is_active, last_seen, vici_id) VALUES (?, ?, ?, ?, '', '')", (u_name, u_pass, u_role, active_val))
+                    if db.users.save(u_name, u_pass, u_role, active_val):
                         st.success(f"Đã tạo mới tài khoản: {u_name}")
-                    conn.commit()
+                    else:
+                        st.success(f"Đã cập nhật tài khoản: {u_name}")
                     st.rerun()
                 else: st.warning("Vui lòng nhập tên nhân viên!")
                     
         st.markdown("### 📋 Danh sách Tài khoản")
-        df_users = pd.read_sql_query("SELECT username as 'Tên NV', password as 'Mật khẩu', role as 'Quyền', is_active as 'Trạng thái', last_seen as 'Hoạt động cuối' FROM users", conn)
+        df_users = db.users.frame()
         df_users['Trạng thái'] = df_users['Trạng thái'].apply(lambda x: "🟢 Hoạt động" if x==1 else "🔴 Khóa")
         st.dataframe(df_users, hide_index=True, use_container_width=True)
-        conn.close()
 
     # --- [V151 TÍNH NĂNG MỚI] GIAO DIỆN QUẢN TRỊ SOP ---
     with tab_sops:
         st.markdown("### 📝 Bảng Cấu Hình Kịch Bản Xử Lý Lỗi (Smart Toolkit)")
         st.caption("Các kịch bản này sẽ hiển thị trực tiếp ở mục 'Tạo Ticket Mới' để nhân viên chọn và tạo Note tự động.")
         
-        conn = sqlite3.connect('crm_data.db')
-        df_sops = pd.read_sql_query("SELECT id, category as 'Phân Loại', device_name as 'Tên Thiết Bị / Tác Vụ', steps as 'Các Bước Kiểm Tra (Cách nhau bởi dấu |)' FROM sops", conn)
+        df_sops = db.sops.frame()
         st.dataframe(df_sops, hide_index=True, use_container_width=True)
         
         st.markdown("**✨ Thêm Mới / Sửa SOP**")
@@ -1842,14 +1705,12 @@ elif menu == "👥 Quản lý Nhân sự / SOP":
             
             if st.form_submit_button("💾 Lưu Kịch Bản", type="primary"):
                 if s_dev and s_steps:
-                    c = conn.cursor()
                     if s_id == 0:
-                        c.execute("INSERT INTO sops (category, device_name, steps) VALUES (?, ?, ?)", (s_cat, s_dev, s_steps))
+                        db.sops.add(s_cat, s_dev, s_steps)
                         st.success(f"Đã thêm kịch bản cho: {s_dev}")
                     else:
-                        c.execute("UPDATE sops SET category=?, device_name=?, steps=? WHERE id=?", (s_cat, s_dev, s_steps, s_id))
+                        db.sops.update(s_id, s_cat, s_dev, s_steps)
                         st.success(f"Đã cập nhật kịch bản ID {s_id}")
-                    conn.commit()
                     st.rerun()
                 else: st.warning("Vui lòng điền đủ Tên Thiết bị và Quy trình!")
                 
@@ -1857,9 +1718,6 @@ elif menu == "👥 Quản lý Nhân sự / SOP":
         with st.form("del_sop_form"):
             del_id = st.number_input("Nhập ID cần xóa", value=0, step=1)
             if st.form_submit_button("Xóa Kịch Bản", type="primary"):
-                 c = conn.cursor()
-                 c.execute("DELETE FROM sops WHERE id=?", (del_id,))
-                 conn.commit()
+                 db.sops.delete(del_id)
                  st.success("Đã xóa kịch bản thành công!")
-                 st.rerun()
-        conn.close()
\ No newline at end of file
+                 st.rerun()
\ No newline at end of file
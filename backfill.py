@@ -0,0 +1,134 @@
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import workbook_stream
+from schema_registry import registry
+from report_parsing import report_month
+
+# Cấu hình encoding cho Windows console
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+HISTORY_CSV = 'cleaned_tickets_history.csv'
+WORKBOOK_PATTERN = '*.xlsx'
+# Khóa chống trùng giống finalize_report_frame (Phone, Date, Support_Time, Agent_Name)
+DEDUP_COLUMNS = ['Phone', 'Date', 'Time', 'Name']
+
+
+def find_workbooks(sources):
+    """Danh sách file .xlsx (đã sắp xếp, không trùng) từ các thư mục / mẫu glob / đường dẫn file."""
+    paths = set()
+    for source in sources:
+        if os.path.isdir(source):
+            paths.update(glob.glob(os.path.join(source, WORKBOOK_PATTERN)))
+        else:
+            paths.update(glob.glob(source))
+    # Bỏ file tạm của Excel (~$...) khi đang mở file
+    return sorted(p for p in paths if not os.path.basename(p).startswith('~$'))
+
+
+def parse_workbook(path, year, month):
+    """
+    Chạy trong process con: đọc stream cả workbook, trả về (path, các dòng dạng tuple theo TICKET_COLUMNS, lỗi từng sheet, số giây).
+    Mỗi workbook 1 task: mở file (load_workbook) tốn nhiều hơn đọc các sheet ngày, nên không chia nhỏ theo sheet.
+    """
+    t0 = time.perf_counter()
+    errors = []
+    wb = workbook_stream.open_workbook(path)
+    try:
+        records = workbook_stream.iter_workbook_tickets(
+            wb, lambda day: f"{year}-{month:02d}-{day:02d}", on_sheet=lambda name, e: errors.append(f"{name}: {e}"), registry=registry)
+        rows = [tuple(r.get(col) for col in workbook_stream.TICKET_COLUMNS) for r in records]
+    finally:
+        wb.close()
+    return path, rows, errors, time.perf_counter() - t0
+
+
+def merge_rows(results):
+    """Gộp kết quả các workbook (theo thứ tự tháng), bỏ dòng trùng theo DEDUP_COLUMNS, giữ dòng gặp trước."""
+    key_idx = [workbook_stream.TICKET_COLUMNS.index(c) for c in DEDUP_COLUMNS]
+    seen = set()
+    duplicates = 0
+    for rows in results:
+        for row in rows:
+            key = tuple('' if row[i] is None else str(row[i]).strip() for i in key_idx)
+            if key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            yield row
+    print(f"   Bỏ {duplicates} dòng trùng")
+
+
+def backfill(sources, workers=None, to_sqlite=False, out_csv=HISTORY_CSV):
+    t0 = time.perf_counter()
+    jobs = []
+    for path in find_workbooks(sources):
+        ym = report_month(os.path.basename(path))
+        if ym is None:
+            print(f"⚠️ Bỏ qua {path}: tên file không có tháng/năm (VD: ... 12_25.xlsx)")
+            continue
+        jobs.append((ym, path))
+    jobs.sort()
+    if not jobs:
+        print("❌ Không tìm thấy workbook nào.")
+        return 0
+    print(f"⏳ {len(jobs)} workbook, {workers or os.cpu_count()} process...")
+
+    results = {}
+    total_rows = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(parse_workbook, path, year, month): path for (year, month), path in jobs}
+        for done, future in enumerate(as_completed(futures), start=1):
+            path = futures[future]
+            try:
+                _, rows, errors, seconds = future.result()
+            except Exception as e:
+                print(f"[{done}/{len(jobs)}] ⚠️ Bỏ qua {os.path.basename(path)}: {e}")
+                continue
+            results[path] = rows
+            total_rows += len(rows)
+            elapsed = time.perf_counter() - t0
+            print(f"[{done}/{len(jobs)}] {os.path.basename(path)}: {len(rows)} dòng trong {seconds:.1f}s"
+                  f" | tổng {total_rows} dòng, {total_rows / elapsed:,.0f} dòng/giây")
+            for err in errors:
+                print(f"   ⚠️ Bỏ qua sheet {err}")
+
+    ordered = (results[path] for _, path in jobs if path in results)
+    records = (dict(zip(workbook_stream.TICKET_COLUMNS, row)) for row in merge_rows(ordered))
+    if to_sqlite:
+        import db
+        from db_migrations import run_migrations
+        conn = db.connect()
+        try:
+            run_migrations(conn)
+            inserted, updated, unchanged, skipped = workbook_stream.write_sqlite(records, conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        count = inserted + updated + unchanged
+        print(f"✅ {db.DB_PATH}: thêm {inserted}, cập nhật {updated}, không đổi {unchanged} tickets (bỏ qua {skipped} dòng thiếu Salon Name/Phone)")
+    else:
+        count = workbook_stream.write_csv(records, out_csv)
+        print(f"✅ Đã tạo xong file: {out_csv} ({count} tickets)")
+    elapsed = time.perf_counter() - t0
+    print(f"   {elapsed:.1f}s - {total_rows / max(elapsed, 1e-9):,.0f} dòng/giây")
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Nạp lịch sử từ nhiều file Daily Report (.xlsx), tháng/năm lấy từ tên file")
+    parser.add_argument('sources', nargs='+', help="Thư mục, mẫu glob (VD: \"reports/*DAILY REPORT*.xlsx\") hoặc đường dẫn file")
+    parser.add_argument('--workers', type=int, default=None, help="Số process (mặc định = số CPU)")
+    parser.add_argument('--sqlite', action='store_true', help="Nạp thẳng vào bảng tickets thay vì ghi CSV")
+    parser.add_argument('--out', default=HISTORY_CSV)
+    args = parser.parse_args()
+    backfill(args.sources, workers=args.workers, to_sqlite=args.sqlite, out_csv=args.out)
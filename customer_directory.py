@@ -0,0 +1,200 @@
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+import pandas as pd
+
+from db_migrations import normalize_phone, normalize_cid
+
+RADAR_SIZE = 5                    # Số lần liên hệ gần nhất hiện trong Radar
+MIN_PREFIX_LEN = 4                # Gõ thiếu số: chỉ tra tiền tố khi đã có ít nhất 4 ký tự
+HISTORY_SLOTS = 4                 # Số bộ lịch sử (mỗi bộ file/tháng các phiên đang chọn) giữ cùng lúc
+
+# Thứ tự ưu tiên khi tự điền (giống thứ tự fallback cũ): lịch sử Sheet -> ticket local -> Master Data
+SOURCES = ("history", "local", "master")
+
+
+def _key_pair(phone, cid):
+    return normalize_phone(phone), normalize_cid(cid)
+
+
+def _pick_column(columns, keywords, default_idx):
+    for idx, name in enumerate(columns):
+        if any(k in name for k in keywords):
+            return idx
+    return default_idx if len(columns) > default_idx else None
+
+
+class _Layer:
+    """1 nguồn dữ liệu: SĐT chuẩn hóa -> bản ghi, CID chuẩn hóa -> bản ghi (+ danh sách khóa đã sắp xếp để tra tiền tố)."""
+
+    def __init__(self):
+        self.by_key = {"phone": {}, "cid": {}}
+        self._sorted = {"phone": None, "cid": None}   # Sắp xếp lại khi cần tra tiền tố lần đầu sau khi thêm khóa
+
+    def put(self, kind, key, record, overwrite=False):
+        if not key:
+            return
+        bucket = self.by_key[kind]
+        if key not in bucket:
+            self._sorted[kind] = None
+        elif not overwrite:
+            return
+        bucket[key] = record
+
+    def find(self, kind, key):
+        if not key:
+            return None
+        bucket = self.by_key[kind]
+        if key in bucket:
+            return bucket[key]
+        if len(key) < MIN_PREFIX_LEN:
+            return None
+        # Không khớp nguyên số thì lấy bản ghi ưu tiên nhất trong các khóa bắt đầu bằng key
+        keys = self._sorted[kind]
+        if keys is None:
+            keys = self._sorted[kind] = sorted(bucket)
+        best = None
+        for i in range(bisect_left(keys, key), len(keys)):
+            if not keys[i].startswith(key):
+                break
+            record = bucket[keys[i]]
+            if best is None or record["rank"] < best["rank"]:
+                best = record
+        return best
+
+
+class CustomerDirectory:
+    """
+    Bảng tra khách hàng dựng sẵn cho nút "⚡ Tự Điền & Radar".
+
+    Gộp 3 nguồn (lịch sử Sheet, bảng tickets local, sheet CID của Master Data), khóa theo SĐT/CID đã chuẩn hóa.
+    Mỗi khóa có sẵn 5 lần liên hệ gần nhất trong lịch sử Sheet, nên tự điền + radar chỉ còn vài lần tra dict.
+    Mỗi nguồn có token riêng: nguồn nào đổi thì dựng lại nguồn đó; ticket local chỉ nạp thêm các id mới.
+    Lịch sử Sheet giữ riêng 1 bộ cho mỗi token (bộ file + version), tối đa HISTORY_SLOTS bộ dùng gần nhất:
+    các phiên chọn tháng khác nhau không đẩy lịch sử của nhau ra, resolve luôn tra đúng bộ của phiên mình.
+    """
+
+    def __init__(self):
+        self._layers = {name: _Layer() for name in SOURCES if name != "history"}
+        self._history = OrderedDict()     # token -> (_Layer, radar), mới dùng nhất ở cuối
+        self._tokens = {}
+        self._last_ticket_id = 0
+        self._lock = threading.Lock()
+
+    # ---------- Nạp dữ liệu ----------
+    def refresh_history(self, df, token, format_date=str):
+        """df: frame lịch sử từ load_gsheet_data. Token đã có bộ lịch sử thì bỏ qua."""
+        with self._lock:
+            if token in self._history:
+                self._history.move_to_end(token)
+                return False
+        layer, radar = _Layer(), {"phone": {}, "cid": {}}
+        if df is not None and not df.empty and {'Phone', 'CID'} <= set(df.columns):
+            if 'Date_Obj' in df.columns:
+                df = df.sort_values('Date_Obj', ascending=False, kind='stable', na_position='last')
+            for rank, r in enumerate(df.to_dict('records')):
+                phone_key, cid_key = _key_pair(r.get('Phone', ''), r.get('CID', ''))
+                if not phone_key and not cid_key:
+                    continue
+                record = {"salon": str(r.get('Salon_Name', '')), "cid": str(r.get('CID', '')), "phone": str(r.get('Phone', '')),
+                          "owner": str(r.get('Caller_Info', '')), "rank": rank}
+                layer.put("phone", phone_key, record)
+                layer.put("cid", cid_key, record)
+                contact = None
+                for kind, key in (("phone", phone_key), ("cid", cid_key)):
+                    if not key:
+                        continue
+                    recent = radar[kind].setdefault(key, [])
+                    if len(recent) < RADAR_SIZE:
+                        contact = contact or self._contact(r, rank, format_date)
+                        recent.append(contact)
+        with self._lock:
+            self._history[token] = (layer, radar)
+            self._history.move_to_end(token)
+            while len(self._history) > HISTORY_SLOTS:
+                self._history.popitem(last=False)
+        return True
+
+    def _history_for(self, token):
+        """(layer, radar) lịch sử của token; None = bộ vừa dựng gần nhất. Gọi khi đang giữ _lock."""
+        if token is None:
+            return next(reversed(self._history.values()), None)
+        return self._history.get(token)
+
+    @staticmethod
+    def _contact(r, rank, format_date):
+        d_str = r['Display_Date'] if 'Display_Date' in r else format_date(r.get('Date', ''))
+        full_note_text = str(r.get('Issue_Category', r.get('Note', '')))
+        if r.get('Ticket_Type') == 'Training' and r.get('Training_Note'): full_note_text = str(r.get('Training_Note')) + " | " + full_note_text
+        return {"rank": rank, "Ngày": d_str, "Nhân Viên": r.get('Agent_Name', 'Unknown'), "Trạng Thái": r.get('Status', ''), "Nội Dung Note": full_note_text}
+
+    def refresh_local(self, ticket_repo):
+        """Nạp thêm các ticket local mới (id lớn hơn lần trước). Ticket mới hơn ghi đè ticket cũ cùng khóa."""
+        rows = ticket_repo.customers_since(self._last_ticket_id)
+        if not rows:
+            return 0
+        with self._lock:
+            layer = self._layers["local"]
+            for tid, salon, cid, phone, owner, phone_key, cid_key in rows:
+                record = {"salon": salon, "cid": cid, "phone": phone, "owner": owner, "rank": -tid}
+                layer.put("phone", phone_key or "", record, overwrite=True)
+                layer.put("cid", cid_key or "", record, overwrite=True)
+            self._last_ticket_id = rows[-1][0]
+        return len(rows)
+
+    def refresh_master(self, df_cid):
+        """df_cid: sheet CID của Master Data. Dựng lại khi nội dung đổi."""
+        if df_cid is None or df_cid.empty:
+            return False
+        token = int(pd.util.hash_pandas_object(df_cid.astype(str), index=False).sum())
+        if self._tokens.get("master") == token:
+            return False
+        cols = [str(c).lower().strip() for c in df_cid.columns]
+        picks = {field: _pick_column(cols, keywords, default_idx) for field, keywords, default_idx in [
+            ("salon", ["salon", "name", "tiệm"], 0), ("cid", ["cid", "id"], 1),
+            ("phone", ["phone", "sđt", "tel"], 2), ("owner", ["owner", "caller", "contact"], 3)]}
+        layer = _Layer()
+        for rank, row in enumerate(df_cid.astype(str).itertuples(index=False, name=None)):
+            record = {field: (row[idx] if idx is not None else "") for field, idx in picks.items()}
+            record["rank"] = rank
+            phone_key, cid_key = _key_pair(record["phone"], record["cid"])
+            layer.put("phone", phone_key, record)
+            layer.put("cid", cid_key, record)
+        with self._lock:
+            self._layers["master"] = layer
+            self._tokens["master"] = token
+        return True
+
+    # ---------- Tra cứu ----------
+    def resolve(self, value, sources=SOURCES, history_token=None):
+        """Thông tin tiệm (salon, cid, phone, owner) theo SĐT hoặc CID, None nếu không có. history_token: token đã truyền cho refresh_history."""
+        phone_key, cid_key = _key_pair(value, value)
+        with self._lock:
+            for name in sources:
+                if name == "history":
+                    history = self._history_for(history_token)
+                    if history is None:
+                        continue
+                    layer = history[0]
+                else:
+                    layer = self._layers[name]
+                record = layer.find("phone", phone_key) or layer.find("cid", cid_key)
+                if record:
+                    found = {k: v for k, v in record.items() if k != "rank"}
+                    if name == "master" and not found["cid"]:
+                        found["cid"] = value
+                    return found
+        return None
+
+    def recent_contacts(self, phone="", cid="", limit=RADAR_SIZE, history_token=None):
+        """Các lần liên hệ gần nhất (mới nhất trước) của khách theo SĐT/CID, lấy từ lịch sử Sheet."""
+        phone_key, cid_key = _key_pair(phone, cid)
+        with self._lock:
+            history = self._history_for(history_token)
+            radar = history[1] if history else {"phone": {}, "cid": {}}
+            merged = {}
+            for kind, key in (("phone", phone_key), ("cid", cid_key)):
+                for contact in radar[kind].get(key, []) if key else []:
+                    merged[contact["rank"]] = contact
+        return [{k: v for k, v in c.items() if k != "rank"} for _, c in sorted(merged.items())[:limit]]
@@ -0,0 +1,213 @@
+import threading
+import time
+from collections import OrderedDict
+
+import snapshot_files
+
+POLL_SECONDS = 30                 # Thread nền kiểm tra nguồn nào hết hạn mỗi 30s
+GROUP_MAX_ENTRIES = 8             # Nguồn động (VD: report theo bộ file đang chọn) giữ tối đa 8 bản, bỏ bản ít dùng nhất
+
+
+class Snapshot:
+    """1 bản dữ liệu đã tải xong. Dùng chung cho mọi phiên: chỉ đọc, muốn sửa thì .copy() trước."""
+
+    __slots__ = ("value", "version", "token", "loaded_at")
+
+    def __init__(self, value, version, token, loaded_at):
+        self.value = value
+        self.version = version
+        self.token = token
+        self.loaded_at = loaded_at
+
+
+class _Source:
+    def __init__(self, name, loader, ttl, group, persist, signature):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.group = group
+        self.persist = persist
+        self.signature = signature
+        self.snapshot = None
+        self.last_error = None
+        self.stale = False
+        self.lock = threading.Lock()
+
+
+class DatasetStore:
+    """
+    Kho dữ liệu dùng chung cho cả process (thay cho st.cache_data: không pickle/copy cho từng phiên).
+
+    Mỗi nguồn (danh sách file report, Master DB, report theo bộ file...) giữ 1 Snapshot có số version.
+    - get(): có sẵn thì trả ngay; chưa có thì tải (nhiều phiên cùng gọi chỉ tải 1 lần, các phiên khác chờ kết quả).
+    - Nguồn có ttl được thread nền tải lại khi hết hạn rồi tráo snapshot mới vào; trong lúc đó vẫn phục vụ bản cũ.
+    - Làm mới theo từng nguồn (refresh / request_refresh), không bao giờ xóa hết.
+    - Nguồn persist: bản tải tốt gần nhất được lưu ra snapshot_dir (Arrow IPC). Khởi động lại thì mở file đó
+      (memory-map) để UI dùng ngay, rồi thread nền tải lại từ Google để đối chiếu.
+    """
+
+    def __init__(self, poll_interval=POLL_SECONDS, group_max_entries=GROUP_MAX_ENTRIES, snapshot_dir=None):
+        self.poll_interval = poll_interval
+        self.group_max_entries = group_max_entries
+        self.snapshot_dir = snapshot_dir
+        self._sources = OrderedDict()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---------- Đăng ký nguồn ----------
+    def register(self, name, loader, ttl=None, group=None, persist=False, signature=None):
+        """
+        loader() -> dữ liệu. ttl (giây): tự tải lại nền khi quá hạn. Đăng ký lại cùng tên thì giữ nguồn cũ.
+
+        persist: True hoặc hàm persist(value) -> bool (lưu bản này ra đĩa không).
+        signature(): dấu vân tay dữ liệu gốc. Có thì bản trên đĩa chỉ được dùng khi còn khớp;
+        không có thì dùng tạm bản trên đĩa và cho thread nền tải lại ngay.
+        """
+        with self._lock:
+            if name not in self._sources:
+                self._sources[name] = _Source(name, loader, ttl, group, persist, signature)
+                if group is not None:
+                    self._evict(group)
+            self._sources.move_to_end(name)
+            return self._sources[name]
+
+    def _evict(self, group):
+        members = [n for n, s in self._sources.items() if s.group == group]
+        for name in members[:max(0, len(members) - self.group_max_entries)]:
+            del self._sources[name]
+
+    def _source(self, name):
+        with self._lock:
+            source = self._sources[name]
+            self._sources.move_to_end(name)
+            return source
+
+    # ---------- Đọc ----------
+    def get(self, name, token=None, loader=None, **options):
+        """
+        Dữ liệu hiện tại của nguồn. token: dấu hiệu dữ liệu gốc đã đổi (VD: mirror.version),
+        khác token của snapshot đang giữ thì tải lại. Truyền loader (+ tùy chọn của register) thì tự đăng ký nguồn nếu chưa có.
+        """
+        source = self.register(name, loader, **options) if loader else self._source(name)
+        snap = source.snapshot
+        if snap is not None and (token is None or snap.token == token):
+            return snap.value
+        if snap is None and source.persist and self._restore(source, token):
+            return source.snapshot.value
+        return self._load(source, token, force=False).value
+
+    def snapshot(self, name):
+        with self._lock:
+            source = self._sources.get(name)
+        return source.snapshot if source else None
+
+    def version(self, name):
+        snap = self.snapshot(name)
+        return snap.version if snap else 0
+
+    def last_error(self, name):
+        with self._lock:
+            source = self._sources.get(name)
+        return source.last_error if source else None
+
+    # ---------- Lưu / mở bản trên đĩa ----------
+    def _restore(self, source, token):
+        if not self.snapshot_dir:
+            return False
+        with source.lock:
+            if source.snapshot is not None:
+                return True
+            saved = snapshot_files.load(self.snapshot_dir, source.name)
+            if saved is None:
+                return False
+            value, meta, saved_at = saved
+            if source.signature is not None:
+                try:
+                    if (meta or {}).get("signature") != source.signature():
+                        return False
+                except Exception:
+                    return False
+            else:
+                source.stale = True
+            source.snapshot = Snapshot(value, 1, token, saved_at or time.time())
+        if source.stale:
+            self._wake.set()
+        return True
+
+    def _persist(self, source, value, signature):
+        if not self.snapshot_dir or not source.persist:
+            return
+        if callable(source.persist) and not source.persist(value):
+            return
+        try:
+            snapshot_files.save(self.snapshot_dir, source.name, value, {"signature": signature})
+        except Exception:
+            pass
+
+    # ---------- Tải / làm mới ----------
+    def _load(self, source, token=None, force=True):
+        with source.lock:
+            snap = source.snapshot
+            # Phiên khác vừa tải xong trong lúc mình chờ khóa thì dùng luôn
+            if not force and snap is not None and (token is None or snap.token == token):
+                return snap
+            try:
+                # Lấy dấu vân tay trước khi tải: dữ liệu đổi trong lúc tải thì lần khởi động sau sẽ không khớp, tự tải lại
+                signature = source.signature() if source.persist and source.signature else None
+                value = source.loader()
+            except Exception as e:
+                source.last_error = str(e)
+                if snap is None:
+                    raise
+                return snap
+            source.last_error = None
+            source.stale = False
+            source.snapshot = Snapshot(value, (snap.version if snap else 0) + 1, token, time.time())
+            self._persist(source, value, signature)
+            return source.snapshot
+
+    def refresh(self, name, token=None):
+        """Tải lại ngay 1 nguồn (chờ xong). Các phiên khác vẫn đọc bản cũ đến khi bản mới được tráo vào."""
+        return self._load(self._source(name), token).value
+
+    def request_refresh(self, name):
+        """Đánh dấu 1 nguồn cần tải lại, thread nền sẽ làm (không bắt người bấm phải chờ)."""
+        with self._lock:
+            source = self._sources.get(name)
+            if source is None:
+                return False
+            source.stale = True
+        self._wake.set()
+        return True
+
+    # ---------- Thread nền ----------
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="dataset-store", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _due(self):
+        now = time.time()
+        with self._lock:
+            sources = list(self._sources.values())
+        return [s for s in sources if s.snapshot is not None and (s.stale or (s.ttl and now - s.snapshot.loaded_at >= s.ttl))]
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            for source in self._due():
+                try:
+                    self._load(source, source.snapshot.token)
+                except Exception:
+                    pass
@@ -0,0 +1,268 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from io import StringIO
+from datetime import datetime
+
+import pandas as pd
+
+from db_migrations import run_migrations, find_latest_by_phone_or_cid
+
+DB_PATH = 'crm_data.db'
+BUSY_TIMEOUT_MS = 10000           # Chờ tối đa 10s khi DB đang bị khóa thay vì báo "database is locked" ngay
+WAL_AUTOCHECKPOINT_PAGES = 1000
+
+_local = threading.local()
+
+
+# ==========================================
+# KẾT NỐI
+# ==========================================
+def connect(db_path=DB_PATH):
+    """Mở 1 kết nối mới đã cấu hình WAL + busy_timeout + synchronous=NORMAL."""
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    # WAL: người đọc không chặn người ghi (nhiều agent cùng lúc), NORMAL là đủ an toàn khi đã dùng WAL
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA wal_autocheckpoint = {WAL_AUTOCHECKPOINT_PAGES}")
+    return conn
+
+
+def get_connection(db_path=DB_PATH):
+    """Kết nối dùng lại trong cùng 1 thread (mỗi thread 1 kết nối riêng, không đóng sau mỗi câu lệnh)."""
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = conns[db_path] = connect(db_path)
+    return conn
+
+
+def close_connection(db_path=DB_PATH):
+    conn = getattr(_local, "conns", {}).pop(db_path, None)
+    if conn is not None:
+        conn.close()
+
+
+@contextmanager
+def transaction(db_path=DB_PATH):
+    """with transaction() as conn: ... -> commit khi xong, rollback khi lỗi."""
+    conn = get_connection(db_path)
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def fetch_one(sql, params=(), db_path=DB_PATH):
+    return get_connection(db_path).execute(sql, params).fetchone()
+
+
+def fetch_all(sql, params=(), db_path=DB_PATH):
+    return get_connection(db_path).execute(sql, params).fetchall()
+
+
+def read_df(sql, params=(), db_path=DB_PATH):
+    return pd.read_sql_query(sql, get_connection(db_path), params=params)
+
+
+def execute(sql, params=(), db_path=DB_PATH):
+    with transaction(db_path) as conn:
+        return conn.execute(sql, params)
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+# ==========================================
+# REPOSITORY
+# ==========================================
+class TicketRepository:
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+
+    def insert(self, date, salon, phone, issue, note, status, cid, agent, time_str, caller, ticket_type, iso="", train_note="", demo_note="", card_info=""):
+        with transaction(self.db_path) as conn:
+            cur = conn.execute('''INSERT INTO tickets (Date, Salon_Name, Phone, Issue_Category, Note, Status, Created_At, CID, Agent_Name, Support_Time, Caller_Info, Ticket_Type, ISO_System, Training_Note, Demo_Note, Card_16_Digits) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)''',
+                               (date, salon, phone, issue, note, status, _now(), cid, agent, time_str, caller, ticket_type, iso, train_note, demo_note, card_info))
+            return cur.lastrowid
+
+    def update(self, tid, status, note, salon, phone, cid, caller, card_16=""):
+        if card_16:
+            sql = '''UPDATE tickets SET Status=?, Note=?, Salon_Name=?, Phone=?, CID=?, Caller_Info=?, Card_16_Digits=? WHERE id=?'''
+            params = (status, note, salon, phone, cid, caller, card_16, tid)
+        else:
+            sql = '''UPDATE tickets SET Status=?, Note=?, Salon_Name=?, Phone=?, CID=?, Caller_Info=? WHERE id=?'''
+            params = (status, note, salon, phone, cid, caller, tid)
+        execute(sql, params, self.db_path)
+
+    def last_created_at(self, phone, agent):
+        row = fetch_one("SELECT Created_At FROM tickets WHERE Phone=? AND Agent_Name=? ORDER BY id DESC LIMIT 1", (phone, agent), self.db_path)
+        return row[0] if row else None
+
+    def customers_since(self, last_id=0):
+        """list (id, Salon_Name, CID, Phone, Caller_Info, Phone_Norm, CID_Norm) của các ticket có id > last_id, id tăng dần."""
+        return fetch_all("SELECT id, Salon_Name, CID, Phone, Caller_Info, Phone_Norm, CID_Norm FROM tickets WHERE id > ? ORDER BY id", (last_id,), self.db_path)
+
+    def find_latest_by_phone_or_cid(self, value, columns="Salon_Name, CID, Phone, Caller_Info"):
+        return find_latest_by_phone_or_cid(get_connection(self.db_path), value, columns)
+
+
+class UserRepository:
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+
+    def count(self):
+        return fetch_one("SELECT COUNT(*) FROM users", (), self.db_path)[0]
+
+    def active_usernames(self):
+        return [r[0] for r in fetch_all("SELECT username FROM users WHERE is_active=1", (), self.db_path)]
+
+    def get(self, username):
+        """(role, is_active) hoặc None."""
+        return fetch_one("SELECT role, is_active FROM users WHERE username=?", (username,), self.db_path)
+
+    def authenticate(self, username, password):
+        """(role, is_active) nếu đúng mật khẩu, None nếu sai."""
+        return fetch_one("SELECT role, is_active FROM users WHERE username=? AND password=?", (username, password), self.db_path)
+
+    def by_vici_id(self, vici_id):
+        """(username, role, is_active) của user gắn với vici_id hoặc None."""
+        return fetch_one("SELECT username, role, is_active FROM users WHERE vici_id=? AND vici_id != '' AND vici_id IS NOT NULL", (vici_id,), self.db_path)
+
+    def set_vici_id(self, username, vici_id):
+        execute("UPDATE users SET vici_id=? WHERE username=?", (vici_id, username), self.db_path)
+
+    def touch_last_seen_many(self, rows):
+        """rows: list (last_seen, username) - ghi cả lô trong 1 transaction."""
+        with transaction(self.db_path) as conn:
+            conn.executemany("UPDATE users SET last_seen=? WHERE username=?", rows)
+
+    def last_seen_all(self):
+        """list (username, last_seen) của các user đang hoạt động."""
+        return fetch_all("SELECT username, last_seen FROM users WHERE is_active=1", (), self.db_path)
+
+    def save(self, username, password, role, is_active, default_password='123456'):
+        """Thêm mới hoặc cập nhật user. Mật khẩu rỗng: user cũ giữ nguyên, user mới dùng default_password. Trả về True nếu là user mới."""
+        with transaction(self.db_path) as conn:
+            if conn.execute("SELECT 1 FROM users WHERE username=?", (username,)).fetchone():
+                if password: conn.execute("UPDATE users SET password=?, role=?, is_active=? WHERE username=?", (password, role, is_active, username))
+                else: conn.execute("UPDATE users SET role=?, is_active=? WHERE username=?", (role, is_active, username))
+                return False
+            conn.execute("INSERT INTO users (username, password, role, is_active, last_seen, vici_id) VALUES (?, ?, ?, ?, '', '')", (username, password or default_password, role, is_active))
+            return True
+
+    def seed(self, users):
+        """users: list (username, password, role). Chỉ thêm user chưa có."""
+        with transaction(self.db_path) as conn:
+            conn.executemany("INSERT OR IGNORE INTO users VALUES (?, ?, ?, 1, '', '')", users)
+
+    def frame(self):
+        return read_df("SELECT username as 'Tên NV', password as 'Mật khẩu', role as 'Quyền', is_active as 'Trạng thái', last_seen as 'Hoạt động cuối' FROM users", (), self.db_path)
+
+
+class DispatchRepository:
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+
+    def create(self, target_agent, salon_name, phone, note, created_by):
+        execute("INSERT INTO dispatches (target_agent, salon_name, phone, note, status, created_by, created_at) VALUES (?, ?, ?, ?, 'Pending', ?, ?)",
+                (target_agent, salon_name, phone, note, created_by, _now()), self.db_path)
+
+    def set_status(self, dispatch_id, status):
+        execute("UPDATE dispatches SET status=? WHERE id=?", (status, dispatch_id), self.db_path)
+
+    def pending_for(self, agent):
+        return read_df("SELECT id, salon_name as 'Tên Tiệm', phone as 'SĐT', note as 'Nội dung dặn dò', created_by as 'Người giao', created_at as 'Thời gian giao' FROM dispatches WHERE target_agent=? AND status='Pending'", (agent,), self.db_path)
+
+    def history_for(self, agent, limit=20):
+        return read_df("SELECT id, salon_name as 'Tên Tiệm', phone as 'SĐT', note as 'Nội dung dặn dò', created_by as 'Người giao', created_at as 'Thời gian giao', status as 'Trạng thái' FROM dispatches WHERE target_agent=? AND status != 'Pending' ORDER BY id DESC LIMIT ?", (agent, limit), self.db_path)
+
+    def recent(self, limit=50):
+        return read_df("SELECT id, target_agent as 'Giao cho', salon_name as 'Tên Tiệm', phone as 'SĐT', note as 'Nội dung', created_at as 'Lúc giao', status as 'Trạng thái' FROM dispatches ORDER BY id DESC LIMIT ?", (limit,), self.db_path)
+
+
+class EscalationRepository:
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+
+    def create(self, agent_name, salon_name, phone, note):
+        execute("INSERT INTO escalations (agent_name, salon_name, phone, note, status, created_at) VALUES (?, ?, ?, ?, 'Active', ?)",
+                (agent_name, salon_name, phone, note, _now()), self.db_path)
+
+    def active(self):
+        return read_df("SELECT * FROM escalations WHERE status='Active'", (), self.db_path)
+
+    def resolve(self, escalation_id):
+        execute("UPDATE escalations SET status='Resolved' WHERE id=?", (escalation_id,), self.db_path)
+
+
+class SopRepository:
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+
+    def count(self):
+        return fetch_one("SELECT COUNT(*) FROM sops", (), self.db_path)[0]
+
+    def categories(self):
+        return [r[0] for r in fetch_all("SELECT DISTINCT category FROM sops", (), self.db_path)]
+
+    def devices(self, category):
+        """list (device_name, steps) của 1 loại lỗi."""
+        return fetch_all("SELECT device_name, steps FROM sops WHERE category=?", (category,), self.db_path)
+
+    def add(self, category, device_name, steps):
+        execute("INSERT INTO sops (category, device_name, steps) VALUES (?, ?, ?)", (category, device_name, steps), self.db_path)
+
+    def add_many(self, rows):
+        with transaction(self.db_path) as conn:
+            conn.executemany("INSERT INTO sops (category, device_name, steps) VALUES (?, ?, ?)", rows)
+
+    def update(self, sop_id, category, device_name, steps):
+        execute("UPDATE sops SET category=?, device_name=?, steps=? WHERE id=?", (category, device_name, steps, sop_id), self.db_path)
+
+    def delete(self, sop_id):
+        execute("DELETE FROM sops WHERE id=?", (sop_id,), self.db_path)
+
+    def frame(self):
+        return read_df("SELECT id, category as 'Phân Loại', device_name as 'Tên Thiết Bị / Tác Vụ', steps as 'Các Bước Kiểm Tra (Cách nhau bởi dấu |)' FROM sops", (), self.db_path)
+
+
+class LookupCacheRepository:
+    """Cache kết quả bot tra cứu lldtek.org trong bảng cid_cache (khóa = từ khóa tìm, đã chuẩn hóa)."""
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+
+    @staticmethod
+    def key(term):
+        return str(term or "").strip().lower()
+
+    def get(self, term, max_age):
+        """DataFrame đã cache nếu còn hạn (max_age giây), ngược lại None."""
+        row = fetch_one("SELECT result_json, cached_at FROM cid_cache WHERE cid=?", (self.key(term),), self.db_path)
+        if not row or not row[0] or time.time() - (row[1] or 0) > max_age:
+            return None
+        return pd.read_json(StringIO(row[0]), orient='split', dtype=False)
+
+    def put(self, term, df):
+        execute("INSERT INTO cid_cache (cid, result_json, cached_at) VALUES (?, ?, ?) ON CONFLICT(cid) DO UPDATE SET result_json=excluded.result_json, cached_at=excluded.cached_at",
+                (self.key(term), df.to_json(orient='split', index=False, force_ascii=False), time.time()), self.db_path)
+
+
+def migrate(db_path=DB_PATH):
+    return run_migrations(get_connection(db_path))
+
+
+tickets = TicketRepository()
+users = UserRepository()
+dispatches = DispatchRepository()
+escalations = EscalationRepository()
+sops = SopRepository()
+lookup_cache = LookupCacheRepository()
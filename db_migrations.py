@@ -0,0 +1,231 @@
+import hashlib
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+DB_PATH = 'crm_data.db'
+
+PHONE_STRIP_CHARS = " -().+"       # Ký tự bỏ đi khi chuẩn hóa SĐT (khớp với trigger SQL bên dưới)
+
+
+# ==========================================
+# CHUẨN HÓA SĐT / CID (Python + SQL phải cho cùng kết quả)
+# ==========================================
+def normalize_phone(phone):
+    s = str(phone or "").strip()
+    for ch in PHONE_STRIP_CHARS:
+        s = s.replace(ch, "")
+    return s
+
+
+def normalize_cid(cid):
+    return str(cid or "").strip().lstrip("0")
+
+
+# Khóa + hash nội dung của ticket nạp từ Daily Report (import_data.py): nạp lại chỉ thêm/sửa dòng mới hoặc đã đổi
+IMPORT_CONTENT_COLUMNS = ['Salon_Name', 'Issue_Category', 'Status', 'CID', 'Contact', 'Card_16_Digits', 'Training_Note', 'Demo_Note']
+
+
+def _digest(parts):
+    return hashlib.sha1("\x1f".join("" if p is None else str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+def ticket_import_key(date, agent, phone, created_at, note):
+    """Định danh 1 ticket nạp từ report: ngày, nhân viên, SĐT, giờ hỗ trợ (Created_At) + hash của Note."""
+    return _digest([date, agent, phone, created_at, _digest([note])])
+
+
+def ticket_content_hash(*values):
+    """Hash các cột IMPORT_CONTENT_COLUMNS (theo đúng thứ tự đó)."""
+    return _digest(values)
+
+
+def _phone_norm_sql(col):
+    expr = f"trim({col})"
+    for ch in PHONE_STRIP_CHARS:
+        expr = f"replace({expr}, '{ch}', '')"
+    return expr
+
+
+def _cid_norm_sql(col):
+    return f"ltrim(trim({col}), '0')"
+
+
+def glob_prefix(value):
+    """Mẫu GLOB "giá trị*" (bỏ ký tự đặc biệt của GLOB) - SQLite dùng được index cho dạng tra tiền tố này."""
+    return "".join(ch for ch in value if ch not in "*?[]") + "*"
+
+
+# ==========================================
+# CÁC MIGRATION (chỉ thêm mới vào cuối, không sửa migration đã phát hành)
+# ==========================================
+def _column_names(conn, table):
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def _add_column(conn, table, column, col_type="TEXT"):
+    if column not in _column_names(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}")
+
+
+def _m001_base_schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS tickets (id INTEGER PRIMARY KEY AUTOINCREMENT, Date TEXT, Salon_Name TEXT, Phone TEXT, Issue_Category TEXT, Note TEXT, Status TEXT, Created_At TEXT, CID TEXT, Contact TEXT, Card_16_Digits TEXT, Training_Note TEXT, Demo_Note TEXT, Agent_Name TEXT, Support_Time TEXT, Caller_Info TEXT, ISO_System TEXT, Ticket_Type TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS cid_cache (cid TEXT PRIMARY KEY, salon_name TEXT, phone TEXT, owner TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT, role TEXT, is_active INTEGER, last_seen TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS sops (id INTEGER PRIMARY KEY AUTOINCREMENT, category TEXT, device_name TEXT, steps TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS escalations (id INTEGER PRIMARY KEY AUTOINCREMENT, agent_name TEXT, salon_name TEXT, phone TEXT, note TEXT, status TEXT, created_at TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS dispatches (id INTEGER PRIMARY KEY AUTOINCREMENT, target_agent TEXT, salon_name TEXT, phone TEXT, note TEXT, status TEXT, created_by TEXT, created_at TEXT)''')
+    # Các cột thêm dần qua từng phiên bản (DB cũ có thể chưa có)
+    _add_column(conn, "tickets", "ISO_System")
+    _add_column(conn, "tickets", "Ticket_Type")
+    _add_column(conn, "users", "vici_id")
+    _add_column(conn, "cid_cache", "phone")
+    _add_column(conn, "cid_cache", "owner")
+
+
+def _m002_lookup_indexes(conn):
+    # check_recent_duplicate: WHERE Phone=? AND Agent_Name=? ORDER BY id DESC LIMIT 1
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tickets_phone_agent ON tickets (Phone, Agent_Name)")
+    # Inbox: WHERE target_agent=? AND status='Pending' / status != 'Pending' ORDER BY id DESC
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_dispatches_agent_status ON dispatches (target_agent, status)")
+    # Dashboard SUP: WHERE status='Active'
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_escalations_status ON escalations (status)")
+
+
+def _m003_normalized_phone_cid(conn):
+    _add_column(conn, "tickets", "Phone_Norm")
+    _add_column(conn, "tickets", "CID_Norm")
+    conn.execute(f"UPDATE tickets SET Phone_Norm = {_phone_norm_sql('Phone')}, CID_Norm = {_cid_norm_sql('CID')}")
+    # Trigger giữ cột chuẩn hóa đúng với mọi đường ghi (app.py, import_data.py...) mà không phải sửa từng câu INSERT
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_tickets_norm_insert AFTER INSERT ON tickets BEGIN
+                     UPDATE tickets SET Phone_Norm = {_phone_norm_sql('NEW.Phone')}, CID_Norm = {_cid_norm_sql('NEW.CID')} WHERE id = NEW.id; END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_tickets_norm_update AFTER UPDATE OF Phone, CID ON tickets BEGIN
+                     UPDATE tickets SET Phone_Norm = {_phone_norm_sql('NEW.Phone')}, CID_Norm = {_cid_norm_sql('NEW.CID')} WHERE id = NEW.id; END''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tickets_phone_norm ON tickets (Phone_Norm)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tickets_cid_norm ON tickets (CID_Norm)")
+
+
+def _m004_lookup_cache(conn):
+    # cid_cache dùng làm cache kết quả bot lldtek.org: cid = từ khóa đã chuẩn hóa, result_json = bảng kết quả
+    _add_column(conn, "cid_cache", "result_json")
+    _add_column(conn, "cid_cache", "cached_at", "REAL")
+
+
+def _m005_import_keys(conn):
+    _add_column(conn, "tickets", "Import_Key")
+    _add_column(conn, "tickets", "Content_Hash")
+    # Ticket đã nạp từ CSV trước đây (Support_Time NULL - app luôn ghi giờ hỗ trợ) -> tính khóa để lần nạp sau không nhân đôi
+    conn.create_function("ticket_import_key", 5, ticket_import_key, deterministic=True)
+    conn.create_function("ticket_content_hash", len(IMPORT_CONTENT_COLUMNS), ticket_content_hash, deterministic=True)
+    conn.execute(f"""UPDATE tickets SET Import_Key = ticket_import_key(Date, Agent_Name, Phone, Created_At, Note),
+                     Content_Hash = ticket_content_hash({', '.join(IMPORT_CONTENT_COLUMNS)})
+                     WHERE Support_Time IS NULL AND Import_Key IS NULL""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tickets_import_key ON tickets (Import_Key)")
+
+
+MIGRATIONS = [
+    (1, "Bảng gốc + các cột thêm sau", _m001_base_schema),
+    (2, "Index cho check trùng, inbox, cứu nét", _m002_lookup_indexes),
+    (3, "Cột Phone_Norm / CID_Norm + index tra tiền tố", _m003_normalized_phone_cid),
+    (4, "Cache kết quả bot tra cứu trong cid_cache", _m004_lookup_cache),
+    (5, "Khóa nạp lại (Import_Key / Content_Hash) cho ticket từ Daily Report", _m005_import_keys),
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def run_migrations(conn):
+    """
+    Chạy các migration chưa áp dụng (theo PRAGMA user_version), mỗi migration trong 1 transaction.
+
+    Returns:
+        list: Số hiệu các migration vừa chạy
+    """
+    applied = []
+    current = schema_version(conn)
+    for version, name, func in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute("BEGIN")
+        try:
+            func(conn)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+# ==========================================
+# TRA CỨU DÙNG INDEX
+# ==========================================
+def find_latest_by_phone_or_cid(conn, value, columns="Salon_Name, CID, Phone, Caller_Info"):
+    """Ticket mới nhất có SĐT hoặc CID bắt đầu bằng value (đã chuẩn hóa). None nếu không có."""
+    phone_key, cid_key = normalize_phone(value), normalize_cid(value)
+    clauses, params = [], []
+    if phone_key:
+        clauses.append("Phone_Norm GLOB ?")
+        params.append(glob_prefix(phone_key))
+    if cid_key:
+        clauses.append("CID_Norm GLOB ?")
+        params.append(glob_prefix(cid_key))
+    if not clauses:
+        return None
+    return conn.execute(f"SELECT {columns} FROM tickets WHERE {' OR '.join(clauses)} ORDER BY id DESC LIMIT 1", params).fetchone()
+
+
+# ==========================================
+# BENCHMARK: python db_migrations.py [số ticket]
+# ==========================================
+def _bench(n_tickets=1_000_000, repeat=2000):
+    import random
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    conn = sqlite3.connect(path)
+    run_migrations(conn)
+    agents = [f"Agent {i}" for i in range(30)]
+    print(f"Tạo {n_tickets:,} ticket giả lập...")
+    t0 = time.perf_counter()
+    batch = []
+    for i in range(n_tickets):
+        phone = f"({random.randint(200, 999)}) {random.randint(100, 999)}-{random.randint(1000, 9999)}"
+        batch.append(("01/01/2025", f"Salon {i % 20000}", phone, "General", "note", "Done", "2025-01-01 10:00:00", f"{i % 20000:05d}", random.choice(agents)))
+        if len(batch) == 50_000:
+            conn.executemany("INSERT INTO tickets (Date, Salon_Name, Phone, Issue_Category, Note, Status, Created_At, CID, Agent_Name) VALUES (?,?,?,?,?,?,?,?,?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO tickets (Date, Salon_Name, Phone, Issue_Category, Note, Status, Created_At, CID, Agent_Name) VALUES (?,?,?,?,?,?,?,?,?)", batch)
+    conn.executemany("INSERT INTO dispatches (target_agent, salon_name, phone, note, status, created_by, created_at) VALUES (?, 'S', '1', 'n', ?, 'SUP', '')",
+                     [(random.choice(agents), "Pending" if i % 200 == 0 else random.choice(["Done", "In Progress"])) for i in range(100_000)])
+    conn.executemany("INSERT INTO escalations (agent_name, salon_name, phone, note, status, created_at) VALUES ('A', 'S', '1', 'n', ?, '')",
+                     [("Active" if i % 5000 == 0 else "Resolved",) for i in range(100_000)])
+    conn.commit()
+    print(f"  xong trong {time.perf_counter() - t0:.1f}s")
+
+    samples = conn.execute("SELECT Phone, Agent_Name, CID FROM tickets ORDER BY random() LIMIT 200").fetchall()
+    cases = {
+        "check_recent_duplicate": lambda i: conn.execute("SELECT Created_At FROM tickets WHERE Phone=? AND Agent_Name=? ORDER BY id DESC LIMIT 1", samples[i % 200][:2]).fetchone(),
+        "auto-fill theo SĐT": lambda i: find_latest_by_phone_or_cid(conn, samples[i % 200][0]),
+        "auto-fill theo CID": lambda i: find_latest_by_phone_or_cid(conn, samples[i % 200][2]),
+        "inbox dispatches": lambda i: conn.execute("SELECT id, salon_name, phone, note, created_by, created_at FROM dispatches WHERE target_agent=? AND status='Pending'", (agents[i % 30],)).fetchall(),
+        "escalations Active": lambda i: conn.execute("SELECT * FROM escalations WHERE status='Active'").fetchall(),
+    }
+    for label, func in cases.items():
+        t0 = time.perf_counter()
+        for i in range(repeat):
+            func(i)
+        per_call = (time.perf_counter() - t0) / repeat * 1000
+        print(f"{label:<24} {per_call:8.3f} ms/lần")
+    conn.close()
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    _bench(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
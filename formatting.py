@@ -0,0 +1,103 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+DISPLAY_DATE_FORMAT = '%m/%d/%Y'
+# Các định dạng ngày hay gặp trong Daily Report (thử lần lượt), cái nào không khớp mới để pandas tự đoán
+DATE_FORMATS = ['%m/%d/%Y', '%Y-%m-%d', '%m/%d/%y', '%Y-%m-%d %H:%M:%S']
+
+
+# ==========================================
+# BẢN TỪNG GIÁ TRỊ (dùng cho 1 ô lẻ)
+# ==========================================
+def format_date_display(val):
+    try:
+        return pd.to_datetime(str(val), errors='coerce').strftime('%m/%d/%Y') if not pd.isna(val) and str(val).strip() != "" else str(val)
+    except:
+        return str(val)
+
+
+def map_status_badge(status_str):
+    s = str(status_str).lower()
+    if "done" in s: return f"🟢 {status_str}"
+    elif "support" in s or "pending" in s: return f"🔴 {status_str}"
+    elif "request" in s or "forward" in s: return f"🟠 {status_str}"
+    elif "no answer" in s: return f"⚫ {status_str}"
+    return status_str
+
+
+# ==========================================
+# BẢN VECTOR (cả cột) - chỉ xử lý mỗi giá trị khác nhau 1 lần rồi trải lại theo mã (codes)
+# ==========================================
+def _parse_uniques(uniques):
+    text = pd.Series(uniques, dtype=object).astype(str).str.strip()
+    parsed = pd.Series(pd.NaT, index=text.index, dtype='datetime64[ns]')
+    for fmt in DATE_FORMATS:
+        todo = parsed.isna() & (text != "")
+        if not todo.any():
+            break
+        parsed[todo] = pd.to_datetime(text[todo], format=fmt, errors='coerce')
+    todo = parsed.isna() & (text != "")
+    if todo.any():
+        parsed[todo] = pd.to_datetime(text[todo], format='mixed', errors='coerce')
+    return parsed
+
+
+def parse_dates(values):
+    """Cột ngày -> datetime64 (NaT nếu không đọc được), giữ nguyên index."""
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    parsed = _parse_uniques(uniques).to_numpy()
+    return pd.Series(parsed.take(codes), index=values.index, name=values.name)
+
+
+def format_dates(values):
+    """Bản vector của format_date_display: mm/dd/YYYY, không đọc được thì giữ chuỗi gốc."""
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    shown = _parse_uniques(uniques).dt.strftime(DISPLAY_DATE_FORMAT)
+    shown = shown.where(shown.notna(), pd.Series([str(u) for u in uniques], index=shown.index))
+    return pd.Series(shown.to_numpy(dtype=object).take(codes), index=values.index, name=values.name)
+
+
+def status_badges(values):
+    """Bản vector của map_status_badge."""
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    badges = np.array([map_status_badge(u) for u in uniques], dtype=object)
+    return pd.Series(badges.take(codes), index=values.index, name=values.name)
+
+
+# ==========================================
+# BENCHMARK: python formatting.py [số dòng]
+# ==========================================
+def _bench(n_rows=60_000, repeat=2):
+    import random
+
+    start = pd.Timestamp("2025-01-01")
+    dates = [(start + pd.Timedelta(days=random.randint(0, 89))).strftime(random.choice(['%m/%d/%Y', '%-m/%-d/%Y'])) for _ in range(n_rows)]
+    statuses = [random.choice(["Done", "Support", "Pending", "Request", "Forward", "No Answer", "done ", ""]) for _ in range(n_rows)]
+    df = pd.DataFrame({"Date": dates, "Status": statuses})
+
+    assert format_dates(df['Date']).equals(df['Date'].apply(format_date_display))
+    assert status_badges(df['Status']).equals(df['Status'].apply(map_status_badge))
+
+    cases = [
+        ("format_date_display", lambda: df['Date'].apply(format_date_display), lambda: format_dates(df['Date'])),
+        ("map_status_badge", lambda: df['Status'].apply(map_status_badge), lambda: status_badges(df['Status'])),
+    ]
+    print(f"{n_rows:,} dòng (~1 quý lịch sử)")
+    for label, old, new in cases:
+        timings = []
+        for func in (old, new):
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                func()
+            timings.append((time.perf_counter() - t0) / repeat * 1000)
+        print(f"{label:<22} apply: {timings[0]:9.1f} ms   vector: {timings[1]:7.1f} ms   nhanh hơn x{timings[0] / timings[1]:.0f}")
+
+
+if __name__ == '__main__':
+    _bench(int(sys.argv[1]) if len(sys.argv) > 1 else 60_000)
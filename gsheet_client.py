@@ -0,0 +1,108 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import gspread
+from google.auth.transport.requests import Request
+from google.oauth2.service_account import Credentials
+from requests.adapters import HTTPAdapter
+
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)   # Làm mới token trước khi hết hạn
+WORKSHEET_LIST_TTL = 600                      # Danh sách tab được cache 10 phút (tab ngày mới sẽ tự thấy khi tra cứu hụt)
+HTTP_POOL_SIZE = 16
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class SheetsClient:
+    """
+    1 gspread client đã authorize cho cả process.
+
+    - Token service account được làm mới chủ động trước khi hết hạn, ở mọi lần lấy client/handle (open, worksheets, worksheet - kể cả khi trả từ cache),
+      có khóa nên các thread không refresh chồng nhau. Handle giữ lâu bên ngoài thì lấy lại qua các hàm này trước khi dùng.
+    - Dùng chung 1 HTTP session có connection pool (keep-alive) cho mọi request.
+    - Cache handle Spreadsheet/Worksheet theo tên, nên gọi open() lặp lại không tốn request nào.
+    """
+
+    def __init__(self, service_account_info, scopes=SCOPES):
+        self._credentials = Credentials.from_service_account_info(service_account_info, scopes=scopes)
+        self._gc = gspread.authorize(self._credentials)
+        session = getattr(getattr(self._gc, 'http_client', self._gc), 'session', None)
+        if session is not None:
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount('https://', adapter)
+        self._auth_lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        self._spreadsheets = {}
+        self._worksheets = {}
+
+    def _ensure_token(self):
+        """Làm mới token nếu còn hạn dưới TOKEN_REFRESH_MARGIN (handle Spreadsheet/Worksheet cache dùng chung token này)."""
+        with self._auth_lock:
+            expiry = self._credentials.expiry
+            if not self._credentials.token or expiry is None or expiry - _utcnow() < TOKEN_REFRESH_MARGIN:
+                self._credentials.refresh(Request())
+
+    def client(self):
+        """Trả về gspread client, đảm bảo token còn hạn ít nhất TOKEN_REFRESH_MARGIN."""
+        self._ensure_token()
+        return self._gc
+
+    def list_spreadsheet_files(self):
+        return self.client().list_spreadsheet_files()
+
+    def open(self, title):
+        gc = self.client()
+        with self._cache_lock:
+            sh = self._spreadsheets.get(title)
+        if sh is None:
+            sh = gc.open(title)
+            with self._cache_lock:
+                self._spreadsheets[title] = sh
+        return sh
+
+    def worksheets(self, title, refresh=False):
+        # Trả handle từ cache cũng phải kiểm tra token: request gửi qua handle dùng chung session của client
+        self._ensure_token()
+        now = time.monotonic()
+        with self._cache_lock:
+            cached = self._worksheets.get(title)
+        if refresh or cached is None or now - cached[0] > WORKSHEET_LIST_TTL:
+            wss = self.open(title).worksheets()
+            with self._cache_lock:
+                self._worksheets[title] = (now, wss)
+            return wss
+        return cached[1]
+
+    def worksheet(self, title, tab_title):
+        """Lấy tab theo tên từ cache; tra cứu hụt thì tải lại danh sách tab 1 lần rồi mới báo lỗi."""
+        for refresh in (False, True):
+            for ws in self.worksheets(title, refresh=refresh):
+                if ws.title == tab_title:
+                    return ws
+        raise gspread.exceptions.WorksheetNotFound(tab_title)
+
+    def invalidate(self, title=None):
+        with self._cache_lock:
+            if title is None:
+                self._spreadsheets.clear()
+                self._worksheets.clear()
+            else:
+                self._spreadsheets.pop(title, None)
+                self._worksheets.pop(title, None)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_shared_client(service_account_info):
+    """SheetsClient dùng chung cho cả process (app.py, services.py, thread sync nền), theo từng service account."""
+    key = service_account_info.get('client_email', '')
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = SheetsClient(dict(service_account_info))
+        return _clients[key]
@@ -0,0 +1,88 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from gspread.utils import fill_gaps
+
+from report_parsing import is_ignored_tab
+
+FETCH_WORKERS = 4                 # Số spreadsheet tải song song
+SHEETS_READS_PER_MINUTE = 50      # Quota Sheets API: 60 read/phút/user, chừa lại 1 ít cho thao tác ghi
+
+
+def quote_tab(title):
+    """Tên tab dạng A1 (VD: '12/3'!A:K)."""
+    return "'" + str(title).replace("'", "''") + "'"
+
+
+def fetch_tabs_batched(sh, titles=None):
+    """
+    Tải nhiều tab của 1 spreadsheet bằng đúng 1 request values.batchGet.
+
+    Args:
+        sh: gspread Spreadsheet đã mở
+        titles: Danh sách tên tab cần tải. None = mọi tab không nằm trong IGNORED_TAB_NAMES.
+
+    Returns:
+        dict: {tên tab: list các dòng} - đã pad đều cột giống ws.get_all_values()
+    """
+    if titles is None:
+        titles = [ws.title for ws in sh.worksheets() if not is_ignored_tab(ws.title)]
+    if not titles:
+        return {}
+    res = sh.values_batch_get([quote_tab(t) for t in titles])
+    value_ranges = res.get('valueRanges', [])
+    return {t: fill_gaps(vr.get('values', [])) if vr.get('values') else [] for t, vr in zip(titles, value_ranges)}
+
+
+
+class RateLimiter:
+    """
+    Token bucket giới hạn số request/phút, dùng chung giữa các thread.
+
+    Cho phép bùng nổ tới max_per_minute request (VD: mở 4 tháng cùng lúc),
+    sau đó giãn đều theo tốc độ nạp lại.
+    """
+
+    def __init__(self, max_per_minute=SHEETS_READS_PER_MINUTE):
+        self.capacity = float(max_per_minute)
+        self.rate = max_per_minute / 60.0
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+def map_concurrent(func, items, max_workers=FETCH_WORKERS, initializer=None):
+    """
+    Chạy func(item) song song trên thread pool giới hạn số worker.
+
+    Kết quả trả về đúng thứ tự items (không phụ thuộc thread nào xong trước),
+    item nào lỗi thì vị trí đó là Exception tương ứng thay vì làm hỏng cả lượt.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    def safe_call(item):
+        try:
+            return func(item)
+        except Exception as e:
+            return e
+
+    workers = max(1, min(max_workers, len(items)))
+    if workers == 1:
+        return [safe_call(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers, initializer=initializer) as executor:
+        return list(executor.map(safe_call, items))
@@ -1,28 +1,55 @@
 import pandas as pd
-import sqlite3
+import db
 from datetime import datetime
+import argparse
 import sys
 import io
+import time
+from itertools import islice
+from db_migrations import run_migrations, ticket_import_key, ticket_content_hash, IMPORT_CONTENT_COLUMNS
+from schema_registry import find_column_fuzzy, registry
+
+CSV_FILE = 'cleaned_tickets_history.csv'
+BATCH_SIZE = 5000                 # Số dòng mỗi lần executemany
+CSV_TEMPLATE = 'tickets_csv'      # Tên mẫu trong schema_registry cho file CSV ticket
+
+# Keywords để phân loại vấn đề (theo thứ tự ưu tiên: keyword nào gặp trước thì lấy)
+ISSUE_KEYWORDS = {
+    'wifi': 'Network/Wifi Issue',
+    'internet': 'Network/Wifi Issue',
+    'network': 'Network/Wifi Issue',
+    'pinpad': 'Pinpad Issue',
+    'payment': 'Payment Issue',
+    'tip': 'Payment/Tip Issue',
+    'charge': 'Payment Issue',
+    'clockin': 'Clock In/Out Issue',
+    'clock out': 'Clock In/Out Issue',
+    'booking': 'Booking/Appointment Issue',
+    'appointment': 'Booking/Appointment Issue',
+    'app': 'App Issue',
+    'password': 'Account/Password Issue',
+    'passcode': 'Account/Password Issue',
+    'login': 'Account/Password Issue',
+    'block': 'Account/Blacklist Issue',
+    'blacklist': 'Account/Blacklist Issue',
+    'promotion': 'Promotion/Marketing',
+    'menu': 'Menu/Price Issue',
+    'price': 'Menu/Price Issue',
+    'salary': 'Payroll Issue',
+    'lương': 'Payroll Issue',
+    'support': 'Support Request'
+}
+
+TICKET_COLUMNS = ['Date', 'Salon_Name', 'Phone', 'Issue_Category', 'Note', 'Status', 'Created_At',
+                  'CID', 'Contact', 'Card_16_Digits', 'Training_Note', 'Demo_Note',
+                  'Agent_Name', 'Support_Time', 'Caller_Info']
+# Cột tùy chọn: chuỗi rỗng -> NULL
+OPTIONAL_COLUMNS = ['CID', 'Contact', 'Card_16_Digits', 'Training_Note', 'Demo_Note', 'Agent_Name']
 
 # Cấu hình encoding cho Windows console
 if sys.platform == 'win32':
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
-def find_column_fuzzy(df_columns, keywords):
-    """
-    Tìm cột có chứa bất kỳ keyword nào (case-insensitive, fuzzy matching)
-    Trả về tên cột nếu tìm thấy, None nếu không
-    """
-    if isinstance(keywords, str):
-        keywords = [keywords]
-    
-    for col in df_columns:
-        col_lower = str(col).lower()
-        for keyword in keywords:
-            if keyword.lower() in col_lower:
-                return col
-    return None
-
 def extract_issue_category(note):
     """
     Extract issue category từ Note
@@ -33,39 +60,23 @@ def extract_issue_category(note):
     
     note_lower = str(note).lower()
     
-    # Keywords để phân loại vấn đề
-    keywords = {
-        'wifi': 'Network/Wifi Issue',
-        'internet': 'Network/Wifi Issue',
-        'network': 'Network/Wifi Issue',
-        'pinpad': 'Pinpad Issue',
-        'payment': 'Payment Issue',
-        'tip': 'Payment/Tip Issue',
-        'charge': 'Payment Issue',
-        'clockin': 'Clock In/Out Issue',
-        'clock out': 'Clock In/Out Issue',
-        'booking': 'Booking/Appointment Issue',
-        'appointment': 'Booking/Appointment Issue',
-        'app': 'App Issue',
-        'password': 'Account/Password Issue',
-        'passcode': 'Account/Password Issue',
-        'login': 'Account/Password Issue',
-        'block': 'Account/Blacklist Issue',
-        'blacklist': 'Account/Blacklist Issue',
-        'promotion': 'Promotion/Marketing',
-        'menu': 'Menu/Price Issue',
-        'price': 'Menu/Price Issue',
-        'salary': 'Payroll Issue',
-        'lương': 'Payroll Issue',
-        'support': 'Support Request'
-    }
-    
-    for keyword, category in keywords.items():
+    for keyword, category in ISSUE_KEYWORDS.items():
         if keyword in note_lower:
             return category
     
     return 'General'
 
+def extract_issue_categories(notes):
+    """Bản vector của extract_issue_category cho cả cột Note (mỗi keyword quét cột 1 lần)"""
+    notes_lower = notes.fillna('').astype(str).str.lower()
+    categories = pd.Series('General', index=notes.index, dtype=object)
+    todo = notes_lower != ''
+    for keyword, category in ISSUE_KEYWORDS.items():
+        hit = todo & notes_lower.str.contains(keyword, regex=False)
+        categories[hit] = category
+        todo &= ~hit
+    return categories
+
 def normalize_status(status):
     """
     Normalize status từ CSV sang database format
@@ -84,9 +95,17 @@ def normalize_status(status):
     else:
         return 'Pending'
 
+def normalize_statuses(statuses):
+    """Bản vector của normalize_status"""
+    lowered = statuses.fillna('').astype(str).str.strip().str.lower()
+    result = pd.Series('Pending', index=statuses.index, dtype=object)
+    result[lowered == 'done'] = 'Done'
+    result[lowered == 'no answer'] = 'No Answer'
+    return result
+
 def clean_db():
-    """Xóa toàn bộ dữ liệu và tạo lại bảng tickets"""
-    conn = sqlite3.connect('crm_data.db')
+    """Xóa toàn bộ dữ liệu và tạo lại bảng tickets (mất cả ticket agent tạo trong app - chỉ dùng khi cần làm lại từ đầu)"""
+    conn = db.connect()
     c = conn.cursor()
     
     # Xóa bảng cũ
@@ -113,12 +132,22 @@ def clean_db():
             Caller_Info TEXT
         )
     ''')
-    
     conn.commit()
+    
+    # Index/trigger của bảng cũ đã mất theo DROP TABLE -> chạy lại toàn bộ migration (đều idempotent)
+    c.execute('PRAGMA user_version = 0')
+    run_migrations(conn)
     conn.close()
     print("✅ Đã xóa và tạo lại bảng tickets với schema mới nhất")
 
 def map_csv_columns(df_columns):
+    """
+    {db_column: csv_column_name} của file CSV; header đã gặp thì lấy lại từ schema_registry, không dò lại
+    """
+    schema = registry.resolve(CSV_TEMPLATE, [list(df_columns)], lambda rows: (0, detect_csv_columns(rows[0])))
+    return dict(schema.mapping)
+
+def detect_csv_columns(df_columns):
     """
     Map các cột CSV vào database columns bằng fuzzy matching
     Trả về dictionary: {db_column: csv_column_name}
@@ -158,221 +187,183 @@ def map_csv_columns(df_columns):
     
     return mapping
 
-def safe_get_value(row, column_name, default=''):
+def text_column(df, column_name):
+    """Cả cột dạng chuỗi đã strip, NaN/thiếu cột -> '' (bản vector của việc lấy từng ô)"""
+    if not column_name or column_name not in df.columns:
+        return pd.Series('', index=df.index, dtype=object)
+    col = df[column_name]
+    return col.astype(str).str.strip().where(col.notna(), '').astype(object)
+
+def build_ticket_frame(df, column_mapping):
+    """
+    Chuyển frame CSV sang frame đúng thứ tự TICKET_COLUMNS bằng các phép toán trên cột.
+    Trả về (frame hợp lệ, số dòng bỏ qua vì thiếu Salon Name / Phone)
+    """
+    out = pd.DataFrame(index=df.index)
+    out['Date'] = text_column(df, column_mapping.get('Date', 'Date'))
+    out['Salon_Name'] = text_column(df, column_mapping.get('Salon_Name', 'Salon Name'))
+    out['Phone'] = text_column(df, column_mapping.get('Phone', 'Phone'))
+    out['Note'] = text_column(df, column_mapping.get('Note', 'Note'))
+    out['Status'] = normalize_statuses(text_column(df, column_mapping.get('Status', 'Status')))
+    out['Issue_Category'] = extract_issue_categories(out['Note'])
+    
+    # Tạo Created_At từ Date và Time (nếu có)
+    created_at = out['Date'] + ' 00:00:00'
+    time_col = find_column_fuzzy(df.columns, ['Time'])
+    if time_col:
+        time_str = df[time_col].astype(str).str.split('.').str[0]  # Bỏ phần microsecond
+        has_time = df[time_col].notna() & time_str.str.contains(':', regex=False)
+        created_at = created_at.where(~has_time, out['Date'] + ' ' + time_str)
+    out['Created_At'] = created_at
+    
+    out['CID'] = text_column(df, column_mapping.get('CID', 'CID'))
+    out['Agent_Name'] = text_column(df, column_mapping.get('Agent_Name', 'Name'))
+    for db_col in ['Contact', 'Card_16_Digits', 'Training_Note', 'Demo_Note']:
+        out[db_col] = text_column(df, column_mapping.get(db_col, ''))
+    out['Support_Time'] = None
+    out['Caller_Info'] = None
+    
+    # Validate dữ liệu bắt buộc
+    valid = (out['Salon_Name'] != '') & (out['Phone'] != '')
+    out = out[valid]
+    for db_col in OPTIONAL_COLUMNS:
+        out[db_col] = out[db_col].where(out[db_col] != '', None)
+    return out[TICKET_COLUMNS], int((~valid).sum())
+
+def add_import_keys(frame):
+    """Thêm Import_Key (ngày, nhân viên, SĐT, giờ, hash Note) + Content_Hash (các cột còn lại); trùng khóa trong file thì giữ dòng sau"""
+    frame = frame.copy()
+    frame['Import_Key'] = [ticket_import_key(*row) for row in frame[['Date', 'Agent_Name', 'Phone', 'Created_At', 'Note']].itertuples(index=False, name=None)]
+    frame['Content_Hash'] = [ticket_content_hash(*row) for row in frame[IMPORT_CONTENT_COLUMNS].itertuples(index=False, name=None)]
+    return frame.drop_duplicates(subset=['Import_Key'], keep='last')
+
+def existing_import_keys(conn):
+    """{Import_Key: Content_Hash} của các ticket đã nạp từ report"""
+    return dict(conn.execute("SELECT Import_Key, Content_Hash FROM tickets WHERE Import_Key IS NOT NULL"))
+
+def upsert_tickets(conn, frame, existing=None, batch_size=BATCH_SIZE):
     """
-    Lấy giá trị từ row, nếu không có hoặc NaN thì trả về default
+    Nạp frame (đã qua build_ticket_frame) theo khóa Import_Key: dòng mới -> INSERT, nội dung đổi -> UPDATE, còn lại bỏ qua.
+    existing: kết quả existing_import_keys (truyền vào khi gọi nhiều lô liên tiếp, được cập nhật luôn).
+    Nơi gọi commit (cả lần nạp là 1 transaction). Trả về (inserted, updated, unchanged).
     """
-    if column_name not in row.index:
-        return default
+    if existing is None:
+        existing = existing_import_keys(conn)
+    frame = add_import_keys(frame)
+    is_new = ~frame['Import_Key'].isin(existing.keys())
+    changed = ~is_new & (frame['Import_Key'].map(existing) != frame['Content_Hash'])
     
-    value = row[column_name]
-    if pd.isna(value):
-        return default
+    columns = TICKET_COLUMNS + ['Import_Key', 'Content_Hash']
+    insert_sql = f"INSERT INTO tickets ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    update_sql = f"UPDATE tickets SET {', '.join(f'{c}=?' for c in IMPORT_CONTENT_COLUMNS)}, Content_Hash=? WHERE Import_Key=?"
+    new_rows = frame.loc[is_new, columns]
+    new_rows = new_rows.astype(object).where(new_rows.notna(), None).itertuples(index=False, name=None)
+    while True:
+        batch = list(islice(new_rows, batch_size))
+        if not batch:
+            break
+        conn.executemany(insert_sql, batch)
+    if changed.any():
+        upd = frame.loc[changed, IMPORT_CONTENT_COLUMNS + ['Content_Hash', 'Import_Key']].astype(object)
+        conn.executemany(update_sql, upd.where(upd.notna(), None).itertuples(index=False, name=None))
     
-    # Chuyển thành string và strip
-    value_str = str(value).strip()
-    return value_str if value_str else default
+    # Lô sau (cùng lần nạp) thấy luôn các khóa vừa thêm/sửa
+    existing.update(zip(frame.loc[is_new | changed, 'Import_Key'], frame.loc[is_new | changed, 'Content_Hash']))
+    inserted, updated = int(is_new.sum()), int(changed.sum())
+    return inserted, updated, len(frame) - inserted - updated
 
-def import_tickets_from_csv():
-    """Import dữ liệu từ cleaned_tickets_history.csv vào database"""
+def import_tickets_from_csv(csv_file=CSV_FILE, reset=False):
+    """
+    Import dữ liệu từ cleaned_tickets_history.csv vào database.
+    Nạp lại nhiều lần được: chỉ thêm dòng mới / sửa dòng đổi nội dung, giữ nguyên ticket agent tạo trong app.
+    reset=True: xóa sạch bảng tickets trước (cách cũ)
+    """
     print("=" * 50)
     print("Import du lieu tu CSV vao database CRM")
     print("=" * 50)
     print()
     
-    print("Dang doc file cleaned_tickets_history.csv...")
+    print(f"Dang doc file {csv_file}...")
     
     try:
+        t0 = time.perf_counter()
         # Đọc CSV
-        df = pd.read_csv('cleaned_tickets_history.csv')
+        df = pd.read_csv(csv_file)
         print(f"✅ Đa doc {len(df)} dong tu CSV")
         print(f"   Cac cot co trong CSV: {', '.join(df.columns.tolist())}")
         print()
         
-        # Làm sạch database
-        print("Dang lam sach database...")
-        clean_db()
-        print()
+        if reset:
+            print("Dang lam sach database...")
+            clean_db()
+            print()
         
         # Map các cột
         print("Dang map cac cot...")
         column_mapping = map_csv_columns(df.columns)
-        print(f"   Cot duoc map: {column_mapping}")
         
         # CRITICAL: Ensure Name -> Agent_Name and CID -> CID mappings exist
         if 'Name' in df.columns and 'Agent_Name' not in column_mapping:
             column_mapping['Agent_Name'] = 'Name'
-            print(f"   ✅ Fixed: Agent_Name now mapped to CSV column 'Name'")
-        
         if 'CID' in df.columns and 'CID' not in column_mapping:
             column_mapping['CID'] = 'CID'
-            print(f"   ✅ Fixed: CID now mapped to CSV column 'CID'")
-        
-        # Verify critical mappings
-        if 'Agent_Name' in column_mapping:
-            csv_col = column_mapping['Agent_Name']
-            print(f"   ✅ Agent_Name mapped to CSV column: '{csv_col}'")
-            if csv_col in df.columns:
-                sample_value = df[csv_col].dropna().iloc[0] if len(df[csv_col].dropna()) > 0 else "N/A"
-                print(f"      Sample value: '{sample_value}'")
-            else:
-                print(f"      ⚠️ WARNING: CSV column '{csv_col}' not found in dataframe!")
-        else:
-            print(f"   ❌ ERROR: Agent_Name mapping NOT found!")
-        
-        if 'CID' in column_mapping:
-            csv_col = column_mapping['CID']
-            print(f"   ✅ CID mapped to CSV column: '{csv_col}'")
-            if csv_col in df.columns:
-                sample_value = df[csv_col].dropna().iloc[0] if len(df[csv_col].dropna()) > 0 else "N/A"
-                print(f"      Sample value: '{sample_value}'")
-            else:
-                print(f"      ⚠️ WARNING: CSV column '{csv_col}' not found in dataframe!")
-        else:
-            print(f"   ❌ ERROR: CID mapping NOT found!")
+        print(f"   Cot duoc map: {column_mapping}")
+        for db_col in ['Agent_Name', 'CID']:
+            if db_col not in column_mapping:
+                print(f"   ❌ ERROR: {db_col} mapping NOT found!")
         print()
         
-        # Kết nối database
-        conn = sqlite3.connect('crm_data.db')
-        c = conn.cursor()
-        
-        imported = 0
-        skipped = 0
+        print("Dang chuan hoa du lieu...")
+        t_build = time.perf_counter()
+        frame, skipped = build_ticket_frame(df, column_mapping)
+        t_build = time.perf_counter() - t_build
+        print(frame[['Date', 'Salon_Name', 'CID', 'Agent_Name']].head(3).to_string(index=False))
+        print()
         
         print("Dang import du lieu...")
-        
-        for idx, row in df.iterrows():
-            try:
-                # Lấy các giá trị từ CSV (với mapping)
-                date = safe_get_value(row, column_mapping.get('Date', 'Date'))
-                salon_name = safe_get_value(row, column_mapping.get('Salon_Name', 'Salon Name'))
-                phone = safe_get_value(row, column_mapping.get('Phone', 'Phone'))
-                note = safe_get_value(row, column_mapping.get('Note', 'Note'))
-                status = normalize_status(safe_get_value(row, column_mapping.get('Status', 'Status')))
-                
-                # Extract issue category từ Note
-                issue_category = extract_issue_category(note)
-                
-                # Các cột mới (fuzzy matching)
-                contact = safe_get_value(row, column_mapping.get('Contact', ''))
-                card_16_digits = safe_get_value(row, column_mapping.get('Card_16_Digits', ''))
-                training_note = safe_get_value(row, column_mapping.get('Training_Note', ''))
-                demo_note = safe_get_value(row, column_mapping.get('Demo_Note', ''))
-                
-                # CRITICAL: Extract CID and Agent_Name using mapped column names
-                cid_csv_col = column_mapping.get('CID', 'CID')
-                agent_name_csv_col = column_mapping.get('Agent_Name', 'Name')
-                
-                cid = safe_get_value(row, cid_csv_col)
-                agent_name = safe_get_value(row, agent_name_csv_col)
-                
-                # Debug first few rows
-                if imported < 3:
-                    print(f"   Row {idx+1}: CID column='{cid_csv_col}', value='{cid}', Agent_Name column='{agent_name_csv_col}', value='{agent_name}'")
-                
-                # Tạo Created_At từ Date và Time (nếu có)
-                time_col = find_column_fuzzy(df.columns, ['Time'])
-                if time_col and time_col in row.index and not pd.isna(row[time_col]):
-                    try:
-                        time_str = str(row[time_col]).split('.')[0]  # Bỏ phần microsecond
-                        if ':' in time_str:
-                            created_at = f"{date} {time_str}"
-                        else:
-                            created_at = f"{date} 00:00:00"
-                    except:
-                        created_at = f"{date} 00:00:00"
-                else:
-                    created_at = f"{date} 00:00:00"
-                
-                # Validate dữ liệu bắt buộc
-                if not salon_name or not phone:
-                    skipped += 1
-                    continue
-                
-                # Chuyển None thành chuỗi rỗng cho các trường optional
-                contact = contact if contact else ''
-                card_16_digits = card_16_digits if card_16_digits else ''
-                training_note = training_note if training_note else ''
-                demo_note = demo_note if demo_note else ''
-                note = note if note else ''
-                
-                # Insert vào database (including CID and Agent_Name)
-                # CRITICAL: Ensure CID and Agent_Name are explicitly included in INSERT
-                c.execute('''
-                    INSERT INTO tickets (Date, Salon_Name, Phone, Issue_Category, Note, Status, Created_At,
-                                        CID, Contact, Card_16_Digits, Training_Note, Demo_Note,
-                                        Agent_Name, Support_Time, Caller_Info)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    date, 
-                    salon_name, 
-                    phone, 
-                    issue_category, 
-                    note, 
-                    status, 
-                    created_at,
-                    cid if cid and cid.strip() else None,  # CID: use value if not empty, else None
-                    contact if contact and contact.strip() else None, 
-                    card_16_digits if card_16_digits and card_16_digits.strip() else None,
-                    training_note if training_note and training_note.strip() else None, 
-                    demo_note if demo_note and demo_note.strip() else None,
-                    agent_name if agent_name and agent_name.strip() else None,  # Agent_Name: use value if not empty, else None
-                    None,  # Support_Time
-                    None   # Caller_Info
-                ))
-                
-                imported += 1
-                
-                # Hiển thị progress mỗi 500 dòng
-                if imported % 500 == 0:
-                    print(f"  Da import {imported} tickets...")
-                    
-            except Exception as e:
-                skipped += 1
-                if skipped <= 10:  # Chỉ hiển thị 10 lỗi đầu tiên
-                    print(f"  ⚠️ Loi o dong {idx + 2}: {str(e)}")
-                continue
-        
-        conn.commit()
-        conn.close()
+        t_upsert = time.perf_counter()
+        conn = db.connect()
+        try:
+            run_migrations(conn)
+            inserted, updated, unchanged = upsert_tickets(conn, frame)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        t_upsert = time.perf_counter() - t_upsert
+        elapsed = time.perf_counter() - t0
         
         print(f"\n✅ Hoan thanh!")
-        print(f"  - Da import: {imported} tickets")
+        print(f"  - Them moi: {inserted} | Cap nhat: {updated} | Khong doi: {unchanged} tickets")
         print(f"  - Da bo qua: {skipped} dong (du lieu khong hop le)")
+        print(f"  - Chuan hoa: {t_build:.2f}s | Ghi DB: {t_upsert:.2f}s | Tong: {elapsed:.2f}s")
+        print(f"  - Toc do: {len(frame) / elapsed:,.0f} dong/giay")
         
         # Hiển thị thống kê
-        conn = sqlite3.connect('crm_data.db')
-        c = conn.cursor()
-        c.execute('SELECT COUNT(*) FROM tickets')
-        total_count = c.fetchone()[0]
-        c.execute('SELECT COUNT(*) FROM tickets WHERE Status = "Done"')
-        done_count = c.fetchone()[0]
-        c.execute('SELECT COUNT(*) FROM tickets WHERE Status = "Pending"')
-        pending_count = c.fetchone()[0]
-        c.execute('SELECT COUNT(*) FROM tickets WHERE Status = "No Answer"')
-        no_answer_count = c.fetchone()[0]
-        c.execute('SELECT COUNT(*) FROM tickets WHERE Contact IS NOT NULL AND Contact != ""')
-        contact_count = c.fetchone()[0]
-        c.execute('SELECT COUNT(*) FROM tickets WHERE Card_16_Digits IS NOT NULL AND Card_16_Digits != ""')
-        card_count = c.fetchone()[0]
-        c.execute('SELECT COUNT(*) FROM tickets WHERE Training_Note IS NOT NULL AND Training_Note != ""')
-        training_count = c.fetchone()[0]
-        c.execute('SELECT COUNT(*) FROM tickets WHERE Demo_Note IS NOT NULL AND Demo_Note != ""')
-        demo_count = c.fetchone()[0]
+        conn = db.connect()
+        total_count, done_count, pending_count, no_answer_count, contact_count, card_count, training_count, demo_count = conn.execute('''
+            SELECT COUNT(*),
+                   SUM(Status = 'Done'), SUM(Status = 'Pending'), SUM(Status = 'No Answer'),
+                   SUM(Contact IS NOT NULL AND Contact != ''), SUM(Card_16_Digits IS NOT NULL AND Card_16_Digits != ''),
+                   SUM(Training_Note IS NOT NULL AND Training_Note != ''), SUM(Demo_Note IS NOT NULL AND Demo_Note != '')
+            FROM tickets
+        ''').fetchone()
         conn.close()
         
         print(f"\n📊 Thong ke database:")
         print(f"  - Tong so tickets: {total_count}")
-        print(f"  - Done: {done_count}")
-        print(f"  - Pending: {pending_count}")
-        print(f"  - No Answer: {no_answer_count}")
-        print(f"  - Co Contact: {contact_count}")
-        print(f"  - Co Card_16_Digits: {card_count}")
-        print(f"  - Co Training_Note: {training_count}")
-        print(f"  - Co Demo_Note: {demo_count}")
+        print(f"  - Done: {done_count or 0}")
+        print(f"  - Pending: {pending_count or 0}")
+        print(f"  - No Answer: {no_answer_count or 0}")
+        print(f"  - Co Contact: {contact_count or 0}")
+        print(f"  - Co Card_16_Digits: {card_count or 0}")
+        print(f"  - Co Training_Note: {training_count or 0}")
+        print(f"  - Co Demo_Note: {demo_count or 0}")
         
     except FileNotFoundError:
-        print("❌ Khong tim thay file cleaned_tickets_history.csv")
+        print(f"❌ Khong tim thay file {csv_file}")
         sys.exit(1)
     except Exception as e:
         print(f"❌ Loi: {str(e)}")
@@ -381,7 +372,11 @@ def import_tickets_from_csv():
         sys.exit(1)
 
 if __name__ == '__main__':
-    import_tickets_from_csv()
+    parser = argparse.ArgumentParser(description="Nạp cleaned_tickets_history.csv vào bảng tickets (nạp lại chỉ ghi phần thay đổi)")
+    parser.add_argument('csv_file', nargs='?', default=CSV_FILE)
+    parser.add_argument('--reset', action='store_true', help="Xóa sạch bảng tickets trước khi nạp (mất ticket tạo trong app)")
+    args = parser.parse_args()
+    import_tickets_from_csv(args.csv_file, reset=args.reset)
     
     print("\n" + "=" * 50)
     print("Hoan tat import du lieu!")
@@ -1,6 +1,13 @@
 import pandas as pd
 import sys
 import io
+from pandas.io.parsers import TextParser
+
+import workbook_stream
+from schema_registry import HEADER_SCAN_ROWS, registry
+
+EXCEL_FILE = '2-3-4 DAILY REPORT 12_25.xlsx'
+SPECIAL_TEMPLATE = 'special:{}'   # Tên mẫu trong schema_registry, theo tên sheet
 
 # Cấu hình encoding cho Windows console
 if sys.platform == 'win32':
@@ -76,23 +83,50 @@ def find_cid_column(df_cleaned):
     
     return None
 
-def clean_dataframe(sheet_name):
+def sheet_rows(ws):
+    """
+    Đọc cả sheet 1 lượt (openpyxl read-only), ra list các dòng giống dữ liệu pandas.read_excel dùng:
+    ô trống -> '', số thực nguyên -> int, bỏ ô trống cuối dòng và dòng trống cuối sheet, các dòng cùng độ dài
+    """
+    ws.reset_dimensions()
+    data = []
+    last_row_with_data = -1
+    for row_number, row in enumerate(ws.iter_rows(values_only=True)):
+        cells = ['' if v is None else workbook_stream.cell_value(v) for v in row]
+        while cells and cells[-1] == '':
+            cells.pop()
+        if cells:
+            last_row_with_data = row_number
+        data.append(cells)
+    data = data[:last_row_with_data + 1]
+    width = max((len(r) for r in data), default=0)
+    return [r + [''] * (width - len(r)) for r in data]
+
+def read_rows(rows, header):
+    # Cùng bộ parse với pandas.read_excel (kiểu cột, NaN, tên cột "Unnamed: i") nhưng trên dữ liệu đã đọc sẵn
+    return TextParser(rows, header=header, skip_blank_lines=False).read()
+
+def clean_dataframe(ws, sheet_name):
     """
     Làm sạch dataframe:
-    - Tìm và đặt header
+    - Tìm và đặt header (mẫu sheet đã gặp thì lấy lại header/cột CID từ schema_registry)
     - Xóa các dòng hoàn toàn trống
     - Chuẩn hóa tên cột
     - Tìm và đổi tên cột CID
     - Đặt CID lên đầu
     """
-    # Đọc raw data để tìm header
-    df_raw = pd.read_excel('2-3-4 DAILY REPORT 12_25.xlsx', sheet_name=sheet_name, header=None, nrows=20)
-    
-    # Tìm hàng header
-    header_row = find_header_row(df_raw, sheet_name)
+    # Đọc sheet đúng 1 lần
+    rows = sheet_rows(ws)
+    template = SPECIAL_TEMPLATE.format(sheet_name)
+    schema = registry.find(template, rows[:HEADER_SCAN_ROWS])
+    
+    # Tìm hàng header (chỉ khi chưa gặp mẫu sheet này)
+    if schema is not None:
+        header_row = schema.header_row
+    else:
+        header_row = find_header_row(read_rows(rows[:HEADER_SCAN_ROWS], None), sheet_name)
     
-    # Đọc lại với header đúng
-    df_cleaned = pd.read_excel('2-3-4 DAILY REPORT 12_25.xlsx', sheet_name=sheet_name, header=header_row)
+    df_cleaned = read_rows(rows, header_row)
     
     # Xóa các dòng hoàn toàn trống (tất cả giá trị là NaN hoặc empty)
     df_cleaned = df_cleaned.dropna(how='all')
@@ -107,7 +141,12 @@ def clean_dataframe(sheet_name):
     df_cleaned = df_cleaned.dropna(how='all')
     
     # Tìm và đổi tên cột CID
-    cid_col = find_cid_column(df_cleaned)
+    if schema is not None and (schema.mapping['CID'] is None or schema.mapping['CID'] in df_cleaned.columns):
+        cid_col = schema.mapping['CID']
+    else:
+        cid_col = find_cid_column(df_cleaned)
+        if header_row < len(rows):
+            registry.remember(template, rows[header_row], header_row, {'CID': cid_col})
     cid_found = False
     original_cid_col = None
     
@@ -129,7 +168,7 @@ def clean_dataframe(sheet_name):
     
     return df_cleaned, cid_found, original_cid_col
 
-def process_sheet(sheet_name, output_file):
+def process_sheet(wb, sheet_name, output_file):
     """
     Xử lý một sheet và xuất ra CSV
     """
@@ -139,7 +178,7 @@ def process_sheet(sheet_name, output_file):
     
     try:
         # Làm sạch dữ liệu
-        df_cleaned, cid_found, original_cid_col = clean_dataframe(sheet_name)
+        df_cleaned, cid_found, original_cid_col = clean_dataframe(wb[sheet_name], sheet_name)
         
         # Xác nhận CID
         if cid_found:
@@ -166,9 +205,6 @@ def process_sheet(sheet_name, output_file):
         traceback.print_exc()
         return None
 
-# File Excel
-excel_file = '2-3-4 DAILY REPORT 12_25.xlsx'
-
 print("=" * 70)
 print("IMPORT CAC SHEET DAC BIET TU FILE EXCEL")
 print("=" * 70)
@@ -183,11 +219,15 @@ sheets_to_process = [
 # Dictionary để lưu các dataframe đã xử lý
 processed_dataframes = {}
 
-# Xử lý từng sheet
-for sheet_name, output_file in sheets_to_process:
-    df = process_sheet(sheet_name, output_file)
-    if df is not None:
-        processed_dataframes[sheet_name] = df
+# Xử lý từng sheet (mở file Excel 1 lần cho cả 3 sheet)
+wb = workbook_stream.open_workbook(EXCEL_FILE)
+try:
+    for sheet_name, output_file in sheets_to_process:
+        df = process_sheet(wb, sheet_name, output_file)
+        if df is not None:
+            processed_dataframes[sheet_name] = df
+finally:
+    wb.close()
 
 # In tên các cột của từng file CSV
 print("\n" + "=" * 70)
@@ -0,0 +1,236 @@
+# lldtek_client.py
+import threading
+import time
+from html.parser import HTMLParser
+from io import StringIO
+from urllib.parse import urljoin
+
+import pandas as pd
+
+HAS_REQUESTS = False
+try:
+    import requests
+    HAS_REQUESTS = True
+except ImportError:
+    HAS_REQUESTS = False
+
+LOGIN_URL = "https://www.lldtek.org/salon/login"
+SEARCH_URL = "https://lldtek.org/salon/web/pos/list"
+HTTP_TIMEOUT_SECONDS = 15
+CACHE_TTL_SECONDS = 8 * 3600      # Kết quả tìm thấy được dùng lại trong 1 ca làm việc
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+
+# Kết quả tra cứu: (trạng thái, DataFrame hoặc None) - dùng chung cho bản HTTP và bản Selenium (web_bot)
+FOUND = "found"
+NOT_FOUND = "not_found"
+WRONG_INPUT = "wrong_input"       # Ô nhập ngay trước nút Search là ô Date (giao diện web đổi)
+LOGIN_FAILED = "login_failed"
+
+
+class LookupUnavailable(Exception):
+    """Trang trả về không đúng dạng mong đợi (không có form/bảng, trang render bằng JS...). Gặp lỗi này thì chuyển sang Selenium."""
+
+
+def row_mask(df, search_term):
+    """Dòng nào có ô chứa search_term (không phân biệt hoa thường), so từng cột thay vì cộng chuỗi cả dòng."""
+    mask = pd.Series(False, index=df.index)
+    for col in df.columns:
+        mask |= df[col].astype(str).str.contains(search_term, case=False, regex=False)
+    return mask
+
+
+def matching_rows(df, search_term):
+    """Các dòng khớp search_term; không dòng nào khớp thì trả cả bảng."""
+    mask = row_mask(df, search_term)
+    return df[mask] if mask.any() else df
+
+
+def lookup_cached(cache, ttl, search_term, fetch):
+    """
+    Tra qua cache trước (get(term, max_age) / put(term, df), VD: db.lookup_cache), hụt thì gọi fetch().
+    Chỉ cache kết quả tìm thấy: tiệm chưa có hôm nay có thể được tạo ngay sau đó.
+    """
+    if cache is not None:
+        try:
+            cached = cache.get(search_term, ttl)
+        except Exception:
+            cached = None
+        if cached is not None:
+            return FOUND, cached
+    status, df = fetch()
+    if cache is not None and status == FOUND and df is not None and not df.empty:
+        try:
+            cache.put(search_term, df)
+        except Exception:
+            pass
+    return status, df
+
+
+# ==========================================
+# ĐỌC FORM TRONG HTML (không cần trình duyệt)
+# ==========================================
+class _FormParser(HTMLParser):
+    """Gom các <form>: action, method, danh sách ô nhập/nút theo đúng thứ tự xuất hiện."""
+
+    def __init__(self):
+        super().__init__()
+        self.forms = []
+        self._form = None
+        self._button = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {k: (v or "") for k, v in attrs}
+        if tag == "form":
+            self._form = {"action": attrs.get("action", ""), "method": attrs.get("method", "get").lower(), "fields": []}
+            self.forms.append(self._form)
+        elif self._form is None:
+            return
+        elif tag == "input":
+            kind = attrs.get("type", "text").lower()
+            field = {"tag": "button" if kind in ("submit", "button") else "input", "type": kind, "name": attrs.get("name", ""),
+                     "value": attrs.get("value", ""), "placeholder": attrs.get("placeholder", ""), "text": attrs.get("value", "")}
+            self._form["fields"].append(field)
+        elif tag == "button":
+            self._button = {"tag": "button", "type": attrs.get("type", "submit").lower(), "name": attrs.get("name", ""),
+                            "value": attrs.get("value", ""), "placeholder": "", "text": ""}
+            self._form["fields"].append(self._button)
+
+    def handle_data(self, data):
+        if self._button is not None:
+            self._button["text"] += data
+
+    def handle_endtag(self, tag):
+        if tag == "button":
+            self._button = None
+        elif tag == "form":
+            self._form = None
+
+
+def parse_forms(html):
+    parser = _FormParser()
+    parser.feed(html)
+    return parser.forms
+
+
+def _form_payload(form):
+    # Giữ nguyên các ô ẩn (CSRF token...) và giá trị mặc định của form
+    return {f["name"]: f["value"] for f in form["fields"]
+            if f["tag"] == "input" and f["name"] and f["type"] not in ("checkbox", "radio", "file")}
+
+
+def find_search_form(forms):
+    """(form, ô nhập ngay trước nút Search, nút Search) - giống cách bot Selenium chọn ô nhập. None nếu không có."""
+    for form in forms:
+        for i, field in enumerate(form["fields"]):
+            if field["tag"] != "button" or "search" not in field["text"].lower():
+                continue
+            inputs = [f for f in form["fields"][:i] if f["tag"] == "input" and f["type"] not in ("hidden", "checkbox", "radio")]
+            if inputs:
+                return form, inputs[-1], field
+    return None
+
+
+class HttpLookupClient:
+    """
+    Tra cứu lldtek.org bằng requests.Session (giữ cookie đăng nhập + kết nối keep-alive), không cần Chrome.
+
+    Gửi đúng form tìm kiếm của trang POS list rồi parse bảng trong HTML trả về.
+    Trang không có form/bảng như mong đợi thì raise LookupUnavailable để nơi gọi chuyển sang bot Selenium.
+    """
+
+    def __init__(self, credentials, cache=None, cache_ttl=CACHE_TTL_SECONDS, timeout=HTTP_TIMEOUT_SECONDS,
+                 login_url=LOGIN_URL, search_url=SEARCH_URL):
+        self.credentials = credentials
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self.timeout = timeout
+        self.login_url = login_url
+        self.search_url = search_url
+        self.session = None
+        self.logged_in_at = None
+        self._lock = threading.Lock()   # 1 Session, các lượt tra cứu đi lần lượt
+
+    def _new_session(self):
+        session = requests.Session()
+        session.headers["User-Agent"] = USER_AGENT
+        return session
+
+    @staticmethod
+    def _on_login_page(resp):
+        return "login" in resp.url.lower()
+
+    def _login(self):
+        self.session = self.session or self._new_session()
+        resp = self.session.get(self.login_url, timeout=self.timeout)
+        resp.raise_for_status()
+        form = next((f for f in parse_forms(resp.text) if any(x["name"] == "password" for x in f["fields"])), None)
+        if form is None:
+            raise LookupUnavailable("Không thấy form đăng nhập")
+        payload = _form_payload(form)
+        payload["username"] = self.credentials["username"]
+        payload["password"] = self.credentials["password"]
+        resp = self.session.post(urljoin(resp.url, form["action"] or resp.url), data=payload, timeout=self.timeout)
+        if resp.status_code >= 400 or self._on_login_page(resp):
+            self.logged_in_at = None
+            return False
+        self.logged_in_at = time.time()
+        return True
+
+    def _open_search_page(self):
+        """HTML trang tìm kiếm; bị đẩy về trang login (hết phiên) thì đăng nhập lại. None nếu đăng nhập hỏng."""
+        if not self.logged_in_at and not self._login():
+            return None
+        resp = self.session.get(self.search_url, timeout=self.timeout)
+        if self._on_login_page(resp):
+            if not self._login():
+                return None
+            resp = self.session.get(self.search_url, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp
+
+    def _search(self, search_term):
+        page = self._open_search_page()
+        if page is None:
+            return LOGIN_FAILED, None
+        found = find_search_form(parse_forms(page.text))
+        if found is None:
+            raise LookupUnavailable("Không thấy form tìm kiếm (trang có thể render bằng JS)")
+        form, target_input, button = found
+        ph = target_input["placeholder"].lower()
+        if "date" in ph or "mm/dd" in ph:
+            return WRONG_INPUT, None
+        payload = _form_payload(form)
+        payload[target_input["name"]] = search_term
+        if button["name"]:
+            payload[button["name"]] = button["value"]
+        url = urljoin(page.url, form["action"] or page.url)
+        if form["method"] == "post":
+            resp = self.session.post(url, data=payload, timeout=self.timeout)
+        else:
+            resp = self.session.get(url, params=payload, timeout=self.timeout)
+        resp.raise_for_status()
+        if self._on_login_page(resp):
+            self.logged_in_at = None
+            return LOGIN_FAILED, None
+        if "<table" not in resp.text.lower():
+            raise LookupUnavailable("Trang kết quả không có bảng")
+        # Chỉ xét các dòng trong bảng: trang kết quả có thể lặp lại từ khóa ở ô tìm kiếm / tiêu đề dù bảng trống
+        for df in pd.read_html(StringIO(resp.text)):
+            mask = row_mask(df, search_term)
+            if mask.any():
+                return FOUND, df[mask]
+        return NOT_FOUND, pd.DataFrame()
+
+    def lookup(self, search_term, use_cache=True):
+        """(trạng thái, DataFrame). Lỗi mạng/trang lạ thì raise (LookupUnavailable, requests.RequestException)."""
+        def fetch():
+            with self._lock:
+                return self._search(search_term)
+        return lookup_cached(self.cache if use_cache else None, self.cache_ttl, search_term, fetch)
+
+    def close(self):
+        with self._lock:
+            if self.session is not None:
+                self.session.close()
+            self.session = None
+            self.logged_in_at = None
@@ -1,8 +1,14 @@
 import pandas as pd
+import argparse
+import csv
 import os
 import re
 import sys
 import io
+import time
+import workbook_stream
+from workbook_stream import plan_columns
+from schema_registry import registry
 
 # Cấu hình encoding cho Windows console
 if sys.platform == 'win32':
@@ -10,57 +16,25 @@ if sys.platform == 'win32':
 
 # --- CẤU HÌNH TÊN FILE (Bạn sửa lại tên file nếu khác nhé) ---
 EXCEL_FILE = '2-3-4 DAILY REPORT 12_25.xlsx'
+REPORT_YEAR, REPORT_MONTH = 2024, 12   # Giả định tháng 12/2024
+SALONS_CSV = 'cleaned_salons_master.csv'
+HISTORY_CSV = 'cleaned_tickets_history.csv'
 
-def find_column_fuzzy(df_columns, keyword, exclude_columns=None):
-    """
-    Tìm cột có chứa keyword (case-insensitive, fuzzy matching)
-    Trả về tên cột nếu tìm thấy, None nếu không
-    """
-    if exclude_columns is None:
-        exclude_columns = []
-    keyword_lower = keyword.lower()
-    for col in df_columns:
-        if col in exclude_columns:
-            continue
-        if keyword_lower in str(col).lower():
-            return col
-    return None
+def report_date(day):
+    return f"{REPORT_YEAR}-{REPORT_MONTH:02d}-{day:02d}"
 
-def find_columns_by_keywords(df_columns, keywords):
-    """
-    Tìm các cột dựa trên danh sách keywords (fuzzy matching)
-    Trả về dictionary: {standard_name: actual_column_name}
-    Ưu tiên tìm các từ khóa dài hơn trước (sắp xếp theo độ dài giảm dần)
-    """
-    found_columns = {}
-    used_columns = set()
-    
-    # Sắp xếp keywords theo độ dài giảm dần để ưu tiên từ khóa dài hơn
-    sorted_keywords = sorted(keywords, key=len, reverse=True)
-    
-    for keyword in sorted_keywords:
-        col = find_column_fuzzy(df_columns, keyword, exclude_columns=list(used_columns))
-        if col:
-            used_columns.add(col)
-            # Tạo tên chuẩn hóa từ keyword
-            standard_name = keyword.title() if keyword.islower() else keyword
-            found_columns[standard_name] = col
-    
-    return found_columns
-
-print("⏳ Đang bắt đầu xử lý dữ liệu... Đợi chút nhé!")
-
-try:
+def ingest_pandas(excel_file=EXCEL_FILE):
+    """Cách cũ: pandas đọc lại workbook cho từng sheet (giữ lại để đối chiếu kết quả với bản stream)."""
     # 1. XỬ LÝ DANH SÁCH KHÁCH HÀNG (Sheet SALON CID)
     print("... Đang đọc danh sách Salon...")
     # Thường header nằm ở dòng 1 hoặc 2, code này sẽ tự tìm
-    df_salon = pd.read_excel(EXCEL_FILE, sheet_name='SALON CID', header=0)
+    df_salon = pd.read_excel(excel_file, sheet_name='SALON CID', header=0)
     
     # Chọn đúng cột cần thiết (Sửa tên cột nếu file thật của bạn khác)
     # Giả định cột A là Salon Name, Cột B là CID dựa trên file bạn gửi
     if 'Salon Name' not in df_salon.columns:
          # Nếu không tìm thấy header chuẩn, thử đọc không header và gán thủ công
-         df_salon = pd.read_excel(EXCEL_FILE, sheet_name='SALON CID', header=None)
+         df_salon = pd.read_excel(excel_file, sheet_name='SALON CID', header=None)
          df_salon = df_salon.iloc[:, [0, 1]] # Lấy 2 cột đầu
          df_salon.columns = ['Salon Name', 'CID']
     
@@ -68,85 +42,33 @@ try:
     df_salon['CID'] = df_salon['CID'].astype(str).str.strip()
     
     # Xuất file Salon Master
-    df_salon.to_csv('cleaned_salons_master.csv', index=False)
-    print("✅ Đã tạo xong file: cleaned_salons_master.csv")
+    df_salon.to_csv(SALONS_CSV, index=False)
+    print(f"✅ Đã tạo xong file: {SALONS_CSV}")
 
     # 2. XỬ LÝ LỊCH SỬ TICKET (Gộp các sheet ngày 1 -> 31)
     print("... Đang gộp lịch sử các ngày...")
     all_tickets = []
     
     # Lặp qua các sheet tên là "1", "2", ..., "31"
-    # Bạn có thể điều chỉnh range(1, 32) nếu tháng có ít ngày hơn
-    xls = pd.ExcelFile(EXCEL_FILE)
+    xls = pd.ExcelFile(excel_file)
     
     for day in range(1, 32):
         sheet_name = str(day)
         if sheet_name in xls.sheet_names:
             try:
                 # Dựa vào file bạn gửi, header thường ở dòng 4 (index 3)
-                # Nhưng an toàn nhất là đọc và tìm dòng chứa chữ "Salon Name"
-                df_day = pd.read_excel(EXCEL_FILE, sheet_name=sheet_name, header=3)
+                df_day = pd.read_excel(excel_file, sheet_name=sheet_name, header=3)
                 
                 # Kiểm tra xem có đúng cột không, nếu không thử header=2
                 if 'Salon Name' not in df_day.columns:
-                     df_day = pd.read_excel(EXCEL_FILE, sheet_name=sheet_name, header=2)
+                     df_day = pd.read_excel(excel_file, sheet_name=sheet_name, header=2)
                 
                 # Thêm cột Ngày tháng
-                df_day['Date'] = f"2024-12-{day:02d}" # Giả định tháng 12/2024
-                
-                # Các cột bắt buộc (exact match)
-                cols_exact = ['Name', 'Time', 'Salon Name', 'CID', 'Phone', 'Owner', 'Note', 'Status', 'Date']
-                actual_cols = [c for c in cols_exact if c in df_day.columns]
-                
-                # Thêm các cột tìm được vào danh sách (đổi tên về tên chuẩn)
-                column_mapping = {}
-                card_16_col = None  # Để tránh duplicate mapping cho Card/16
+                df_day['Date'] = report_date(day)
                 
-                # CRITICAL: Ensure Name and CID are preserved (fuzzy match if exact match fails)
-                if 'Name' not in actual_cols:
-                    name_col = find_column_fuzzy(df_day.columns, 'Name')
-                    if name_col:
-                        actual_cols.append(name_col)
-                        column_mapping[name_col] = 'Name'
-                
-                if 'CID' not in actual_cols:
-                    cid_col = find_column_fuzzy(df_day.columns, 'CID')
-                    if cid_col:
-                        actual_cols.append(cid_col)
-                        column_mapping[cid_col] = 'CID'
-                
-                # Tìm các cột mới bằng fuzzy matching
-                # Keywords để tìm: Contact, Card (hoặc 16 Digits), Training, Demo
-                fuzzy_keywords = ['Contact', 'Card', '16', 'Training', 'Demo']
-                fuzzy_columns = find_columns_by_keywords(df_day.columns, fuzzy_keywords)
-                
-                for standard_name, actual_name in fuzzy_columns.items():
-                    if actual_name not in actual_cols:
-                        # Chuẩn hóa tên cột
-                        standard_lower = standard_name.lower()
-                        if standard_lower in ['card', '16']:
-                            # Nếu chưa có cột Card_16_Digits, thêm vào
-                            if card_16_col is None:
-                                card_16_col = actual_name
-                                actual_cols.append(actual_name)
-                                column_mapping[actual_name] = 'Card_16_Digits'
-                            # Nếu đã có, bỏ qua (có thể "Card" và "16" match cùng một cột hoặc khác nhau)
-                        else:
-                            # Thêm cột vào danh sách
-                            actual_cols.append(actual_name)
-                            if standard_lower == 'training':
-                                column_mapping[actual_name] = 'Training_Note'
-                            elif standard_lower == 'demo':
-                                column_mapping[actual_name] = 'Demo_Note'
-                            elif standard_lower == 'contact':
-                                column_mapping[actual_name] = 'Contact'
-                            else:
-                                column_mapping[actual_name] = standard_name
-                
-                # Lọc lấy các cột cần thiết
-                df_day = df_day[actual_cols]
-                
-                # Đổi tên các cột fuzzy matching về tên chuẩn
+                # Lọc lấy các cột cần thiết, đổi tên các cột fuzzy matching về tên chuẩn
+                actual_cols, column_mapping = plan_columns(df_day.columns)
+                df_day = df_day[actual_cols + ['Date']]
                 if column_mapping:
                     df_day = df_day.rename(columns=column_mapping)
                 
@@ -170,14 +92,72 @@ try:
         df_history['Name'] = df_history['Name'].astype(str).str.strip()
         df_history['Name'] = df_history['Name'].replace(['nan', 'None', 'NaT'], '')
         
-        df_history.to_csv('cleaned_tickets_history.csv', index=False)
-        print(f"✅ Đã tạo xong file: cleaned_tickets_history.csv ({len(df_history)} tickets)")
+        df_history.to_csv(HISTORY_CSV, index=False)
+        print(f"✅ Đã tạo xong file: {HISTORY_CSV} ({len(df_history)} tickets)")
         print(f"   Columns in CSV: {', '.join(df_history.columns.tolist())}")
-    else:
-        print("❌ Không tìm thấy dữ liệu ngày nào cả.")
+        return len(df_history)
+    print("❌ Không tìm thấy dữ liệu ngày nào cả.")
+    return 0
+
+def ingest_stream(excel_file=EXCEL_FILE, to_sqlite=False):
+    """
+    Mở workbook 1 lần (openpyxl read-only), đọc mỗi sheet đúng 1 lượt, tự tìm dòng header trong vài dòng đầu.
+    Dòng ticket đi thẳng từ generator ra CSV (hoặc bảng tickets trong SQLite) nên RAM không tăng theo số dòng.
+    """
+    t0 = time.perf_counter()
+    wb = workbook_stream.open_workbook(excel_file)
+    try:
+        # 1. XỬ LÝ DANH SÁCH KHÁCH HÀNG (Sheet SALON CID)
+        print("... Đang đọc danh sách Salon...")
+        with open(SALONS_CSV, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(['Salon Name', 'CID'])
+            writer.writerows(workbook_stream.iter_salons(wb))
+        print(f"✅ Đã tạo xong file: {SALONS_CSV}")
+
+        # 2. XỬ LÝ LỊCH SỬ TICKET (Gộp các sheet ngày 1 -> 31)
+        print("... Đang gộp lịch sử các ngày...")
+        records = workbook_stream.iter_workbook_tickets(wb, report_date, on_sheet=lambda name, e: print(f"⚠️ Bỏ qua ngày {name}: {e}"),
+                                                       registry=registry)
+        if to_sqlite:
+            import db
+            from db_migrations import run_migrations
+            conn = db.connect()
+            try:
+                run_migrations(conn)
+                inserted, updated, unchanged, skipped = workbook_stream.write_sqlite(records, conn)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+            registry.flush()   # Header sheet mới gặp giữa lúc đang giữ transaction ghi ticket
+            count = inserted + updated + unchanged
+            print(f"✅ {db.DB_PATH}: thêm {inserted}, cập nhật {updated}, không đổi {unchanged} tickets (bỏ qua {skipped} dòng thiếu Salon Name/Phone)")
+        else:
+            count = workbook_stream.write_csv(records, HISTORY_CSV)
+            print(f"✅ Đã tạo xong file: {HISTORY_CSV} ({count} tickets)")
+    finally:
+        wb.close()
+    elapsed = time.perf_counter() - t0
+    print(f"   {elapsed:.2f}s - {count / max(elapsed, 1e-9):,.0f} dòng/giây")
+    return count
 
-    print("\n🎉 XONG! Bạn đã có 2 file CSV sạch để Vibe Coding.")
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Gộp Daily Report (Excel) thành file sạch / bảng tickets")
+    parser.add_argument('excel_file', nargs='?', default=EXCEL_FILE)
+    parser.add_argument('--legacy', action='store_true', help="Dùng cách đọc cũ bằng pandas (chậm, để đối chiếu)")
+    parser.add_argument('--sqlite', action='store_true', help="Nạp thẳng vào bảng tickets thay vì ghi cleaned_tickets_history.csv")
+    args = parser.parse_args()
 
-except Exception as e:
-    print(f"\n❌ Lỗi rồi: {e}")
-    print("👉 Gợi ý: Kiểm tra lại tên file Excel hoặc cài thư viện: pip install pandas openpyxl")
\ No newline at end of file
+    print("⏳ Đang bắt đầu xử lý dữ liệu... Đợi chút nhé!")
+    try:
+        if args.legacy:
+            ingest_pandas(args.excel_file)
+        else:
+            ingest_stream(args.excel_file, to_sqlite=args.sqlite)
+        print("\n🎉 XONG! Bạn đã có 2 file CSV sạch để Vibe Coding.")
+    except Exception as e:
+        print(f"\n❌ Lỗi rồi: {e}")
+        print("👉 Gợi ý: Kiểm tra lại tên file Excel hoặc cài thư viện: pip install pandas openpyxl")
@@ -0,0 +1,86 @@
+import atexit
+import threading
+from datetime import datetime, timedelta
+
+FLUSH_INTERVAL_SECONDS = 60       # Ghi last_seen xuống DB tối đa 1 lần/phút (gộp mọi agent trong 1 transaction)
+ONLINE_WINDOW_SECONDS = 300       # Có heartbeat trong 5 phút gần nhất thì tính là đang online
+LAST_SEEN_FORMAT = "%d/%m/%Y %H:%M:%S"
+
+
+class PresenceTracker:
+    """
+    Heartbeat "agent đang online" giữ trong bộ nhớ process.
+
+    Mỗi lần rerun chỉ cập nhật 1 dict (không ghi DB). Thread nền gom các heartbeat mới
+    và ghi users.last_seen theo lô mỗi FLUSH_INTERVAL_SECONDS, nên không tranh khóa với lúc lưu ticket.
+    """
+
+    def __init__(self, user_repo, flush_interval=FLUSH_INTERVAL_SECONDS, online_window=ONLINE_WINDOW_SECONDS):
+        self._users = user_repo
+        self.flush_interval = flush_interval
+        self.online_window = online_window
+        self._beats = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # Tắt process thì ghi nốt heartbeat chưa lưu (đăng ký 1 lần, start() lại không đăng ký thêm)
+        atexit.register(self.flush)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="presence-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def beat(self, username, now=None):
+        if not username:
+            return
+        with self._lock:
+            self._beats[username] = now or datetime.now()
+            self._dirty.add(username)
+
+    def flush(self):
+        """Ghi các heartbeat chưa lưu xuống users.last_seen. Trả về số user đã ghi."""
+        with self._lock:
+            rows = [(self._beats[u].strftime(LAST_SEEN_FORMAT), u) for u in self._dirty]
+            self._dirty.clear()
+        if rows:
+            try:
+                self._users.touch_last_seen_many(rows)
+            except Exception:
+                # Ghi lỗi (DB đang khóa...) thì giữ lại để lần sau ghi tiếp
+                with self._lock:
+                    self._dirty.update(u for _, u in rows)
+                raise
+        return len(rows)
+
+    def online_agents(self, within_seconds=None):
+        """
+        Agent có hoạt động trong khoảng within_seconds gần nhất (mặc định ONLINE_WINDOW_SECONDS).
+
+        Gộp heartbeat trong bộ nhớ với last_seen đã lưu (agent dùng process khác vẫn thấy sau khi flush).
+        Returns: list (username, thời điểm cuối) - mới nhất trước
+        """
+        cutoff = datetime.now() - timedelta(seconds=within_seconds or self.online_window)
+        seen = {}
+        for username, last_seen in self._users.last_seen_all():
+            try: seen[username] = datetime.strptime(str(last_seen), LAST_SEEN_FORMAT)
+            except (TypeError, ValueError): pass
+        with self._lock:
+            for username, ts in self._beats.items():
+                if ts > seen.get(username, datetime.min):
+                    seen[username] = ts
+        online = [(u, ts) for u, ts in seen.items() if ts >= cutoff]
+        return sorted(online, key=lambda x: x[1], reverse=True)
@@ -0,0 +1,151 @@
+import re
+from datetime import datetime
+
+import pandas as pd
+
+from formatting import parse_dates, format_dates
+
+# Các hằng số dùng chung cho mọi đường đọc file "DAILY REPORT"
+# (app.py đọc trực tiếp, sheet_sync.py mirror xuống SQLite).
+IGNORED_TAB_NAMES = ["form request", "sheet 4", "sheet4", "request", "request daily", "total", "summary", "copy of", "bản sao", "copy"]
+KEEP_COLUMNS = ["Date", "Salon_Name", "Agent_Name", "Phone", "CID", "Owner", "Note", "Status", "Issue_Category", "Support_Time", "End_Time", "Ticket_Type", "Caller_Info", "ISO_System", "Training_Note", "Demo_Note", "Card_16_Digits"]
+DAILY_RENAME_MAP = {"Salon Name": "Salon_Name", "Name": "Agent_Name", "Time": "Support_Time", "Owner": "Caller_Info", "Phone": "Phone", "CID": "CID", "Note": "Note", "Status": "Status"}
+HEADER_SCAN_ROWS = 15
+DAILY_TEMPLATE = "gsheet_daily"    # Tên mẫu trong schema_registry cho tab ngày trên Google Sheet
+CATEGORY_COLUMNS = ["Agent_Name", "Ticket_Type"]   # Ít giá trị khác nhau -> category tiết kiệm bộ nhớ, so sánh nhanh
+# Tháng/năm trong tên file: "03/26" trên Google Sheet, "12_25" ở file .xlsx (tên file không chứa được "/")
+REPORT_MONTH_RE = re.compile(r'(\d{1,2})[/_](\d{2})')
+
+
+def is_ignored_tab(title):
+    return any(ign in title.lower() for ign in IGNORED_TAB_NAMES)
+
+
+def is_report_tab(title):
+    """Tab ngày (VD: "1", "12/3") của file Daily Report, không nằm trong danh sách bỏ qua."""
+    if is_ignored_tab(title):
+        return False
+    return len(title) < 10 or "/" in title
+
+
+def clean_headers(headers):
+    seen = {}
+    result = []
+    for h in headers:
+        h = str(h).strip()
+        h = "Unnamed" if not h else h
+        if h in seen:
+            seen[h] += 1
+            result.append(f"{h}_{seen[h]}")
+        else:
+            seen[h] = 0
+            result.append(h)
+    return result
+
+
+def report_month(name):
+    """(năm, tháng) từ tên file report: "... 03/26" (tên Google Sheet) hoặc "... 12_25.xlsx" (file tải về). None nếu không có."""
+    match = REPORT_MONTH_RE.search(name)
+    if not match or not 1 <= int(match.group(1)) <= 12:
+        return None
+    return 2000 + int(match.group(2)), int(match.group(1))
+
+
+def construct_date_from_context(val, sheet_name, tab_name):
+    match = REPORT_MONTH_RE.search(sheet_name)
+    file_year = "20" + match.group(2) if match else str(datetime.now().year)
+    file_month = match.group(1) if match else "01"
+    day_str = str(tab_name).strip()
+    if "/" in day_str and len(day_str) <= 5:
+        return f"{day_str}/{file_year}"
+    if day_str.isdigit() and int(day_str) <= 31:
+        return f"{file_month}/{day_str}/{file_year}"
+    return f"{tab_name}/{file_year}"
+
+
+def safe_process_dataframe(df, rename_map):
+    df = df.rename(columns=rename_map)
+    df = df.loc[:, ~df.columns.duplicated()]
+    for col in KEEP_COLUMNS:
+        if col not in df.columns:
+            df[col] = ""
+    return df[KEEP_COLUMNS]
+
+
+def find_header_row(raw):
+    """Trả về index của dòng header (dòng đầu tiên có chữ "salon"), -1 nếu không có."""
+    for r_idx, row in enumerate(raw[:HEADER_SCAN_ROWS]):
+        if "salon" in "".join([str(c).lower() for c in row]):
+            return r_idx
+    return -1
+
+
+def detect_daily_columns(raw):
+    """(index dòng header, {cột KEEP_COLUMNS: vị trí cột trong sheet}) của 1 tab ngày, None nếu không có header."""
+    header_idx = find_header_row(raw)
+    if header_idx == -1:
+        return None
+    mapping = {}
+    # Giống safe_process_dataframe: đổi tên theo DAILY_RENAME_MAP, trùng tên thì giữ cột đầu tiên
+    for i, name in enumerate(clean_headers(raw[header_idx])):
+        name = DAILY_RENAME_MAP.get(name, name)
+        if name in KEEP_COLUMNS and name not in mapping:
+            mapping[name] = i
+    return header_idx, mapping
+
+
+def parse_daily_tab(raw, sheet_name, tab_title, registry=None):
+    """
+    Chuyển dữ liệu thô của 1 tab ngày (list các dòng, như get_all_values) thành DataFrame chuẩn KEEP_COLUMNS.
+
+    Index của DataFrame là số dòng thật trên Google Sheet (bắt đầu từ 1).
+    registry (schema_registry.SchemaRegistry): dùng lại header/cột đã dò của các tab cùng mẫu.
+    Trả về None nếu tab không có header hợp lệ.
+    """
+    if len(raw) < 2:
+        return None
+    if registry is not None:
+        schema = registry.resolve(DAILY_TEMPLATE, raw, detect_daily_columns)
+    else:
+        schema = detect_daily_columns(raw)
+    if schema is None:
+        return None
+    header_idx, mapping = schema
+    body = raw[header_idx+1:]
+    # Chỉ lấy đúng các cột cần (theo vị trí), không dựng DataFrame cả tab rồi mới bỏ cột
+    data = {col: ([row[mapping[col]] if mapping[col] < len(row) else None for row in body] if col in mapping else "")
+            for col in KEEP_COLUMNS}
+    df_d = pd.DataFrame(data, columns=KEEP_COLUMNS, index=range(header_idx + 2, header_idx + 2 + len(body)))
+    if "Note" in df_d.columns: df_d["Issue_Category"] = df_d["Note"]
+    df_d["Date"] = construct_date_from_context(None, sheet_name, tab_title)
+    df_d["Ticket_Type"] = "Support"
+    df_d["Status"] = df_d["Status"].replace({"Pending": "Support", "pending": "Support"})
+    return df_d
+
+
+def finalize_report_frame(frames):
+    """Gộp các tab đã parse và bỏ dòng trùng (Phone, Date, Support_Time, Agent_Name)."""
+    if not frames:
+        return pd.DataFrame()
+    final_df = pd.concat(frames, ignore_index=True).replace({'nan': '', 'None': '', 'NaN': ''})
+    final_df = final_df.drop_duplicates(subset=['Phone', 'Date', 'Support_Time', 'Agent_Name']).reset_index(drop=True)
+    return add_typed_columns(final_df)
+
+
+def add_typed_columns(df):
+    """
+    Thêm các cột dẫn xuất tính 1 lần lúc tải, các trang chỉ đọc lại (không tự parse nữa):
+    - Date_Obj: datetime64 (NaT nếu không đọc được ngày)
+    - Display_Date: ngày dạng mm/dd/YYYY, không đọc được thì giữ nguyên chuỗi gốc
+    - Status_Norm: Status viết thường (category)
+    - Agent_Name, Ticket_Type: chuyển sang category
+    """
+    if df.empty:
+        return df
+    df['Date_Obj'] = parse_dates(df['Date'])
+    df['Display_Date'] = format_dates(df['Date'])
+    df['Status_Norm'] = df['Status'].astype(str).str.lower().astype('category')
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    return df
@@ -0,0 +1,80 @@
+from datetime import datetime
+
+import pandas as pd
+
+import db
+
+DB_PATH = 'crm_data.db'
+PHONE_COL = 7                     # Cột H (Phone) trên tab ngày, index 0 = cột A
+SALON_COL = 5                     # Cột F (Salon Name)
+
+
+def normalize_date(date_str):
+    """Đưa ngày về dạng mm/dd/YYYY để khóa locator không phụ thuộc cách ghi (3/5/2025 hay 03/05/2025)."""
+    try:
+        return pd.to_datetime(date_str, format='%m/%d/%Y').strftime('%m/%d/%Y')
+    except Exception:
+        try:
+            return pd.to_datetime(date_str).strftime('%m/%d/%Y')
+        except Exception:
+            return str(date_str or "").strip()
+
+
+def locator_key(date_str, phone, salon_name):
+    return "|".join([normalize_date(date_str), str(phone or "").strip(), str(salon_name or "").strip()])
+
+
+def row_matches(row, phone, salon_name):
+    """Cùng điều kiện khớp dòng như khi quét cả tab: SĐT nằm trong cột Phone và tên tiệm nằm trong cột Salon."""
+    if len(row) <= PHONE_COL:
+        return False
+    return str(phone) in str(row[PHONE_COL]).strip() and str(salon_name) in str(row[SALON_COL]).strip()
+
+
+def parse_row_ref(row_ref):
+    """'sheet|tab|row' -> (sheet, tab, row) hoặc None."""
+    try:
+        sheet_name, tab_title, row_idx = str(row_ref).rsplit("|", 2)
+        return sheet_name, tab_title, int(row_idx)
+    except Exception:
+        return None
+
+
+class RowLocator:
+    """
+    Nhớ vị trí (file, tab, dòng) của từng ticket đã ghi lên Google Sheet, lưu trong bảng sheet_locator.
+
+    Tra cứu theo khóa ngày|SĐT|tên tiệm (dòng sửa lấy từ mirror không có id ticket, Row_Ref đã chỉ sẵn dòng),
+    để update_google_sheet_row ghi thẳng vào đúng dòng thay vì tải cả tab về quét.
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self._init_table()
+
+    def _init_table(self):
+        with db.transaction(self.db_path) as conn:
+            c = conn.cursor()
+            c.execute('''CREATE TABLE IF NOT EXISTS sheet_locator (id INTEGER PRIMARY KEY AUTOINCREMENT, ticket_id INTEGER, row_key TEXT, sheet_name TEXT, tab_title TEXT, row_idx INTEGER, updated_at TEXT)''')
+            c.execute("CREATE INDEX IF NOT EXISTS idx_sheet_locator_ticket ON sheet_locator (ticket_id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_sheet_locator_key ON sheet_locator (row_key)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_sheet_locator_pos ON sheet_locator (sheet_name, tab_title, row_idx)")
+
+    def remember(self, sheet_name, tab_title, row_idx, key, ticket_id=None):
+        """Ghi nhận 1 dòng vừa ghi/xác minh. Dòng đó trước đây thuộc ticket khác thì bỏ bản ghi cũ."""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with db.transaction(self.db_path) as conn:
+            c = conn.cursor()
+            c.execute("DELETE FROM sheet_locator WHERE sheet_name=? AND tab_title=? AND row_idx=?", (sheet_name, tab_title, row_idx))
+            if ticket_id is not None:
+                c.execute("DELETE FROM sheet_locator WHERE ticket_id=?", (ticket_id,))
+            c.execute("INSERT INTO sheet_locator (ticket_id, row_key, sheet_name, tab_title, row_idx, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                      (ticket_id, key, sheet_name, tab_title, row_idx, now))
+
+    def forget(self, sheet_name, tab_title, row_idx):
+        db.execute("DELETE FROM sheet_locator WHERE sheet_name=? AND tab_title=? AND row_idx=?", (sheet_name, tab_title, row_idx), self.db_path)
+
+    def by_key(self, key):
+        """Mọi vị trí đã biết của khóa ngày|SĐT|tên tiệm (mới nhất trước)."""
+        rows = db.fetch_all("SELECT sheet_name, tab_title, row_idx FROM sheet_locator WHERE row_key=? ORDER BY id DESC", (key,), self.db_path)
+        return [tuple(r) for r in rows]
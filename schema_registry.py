@@ -0,0 +1,151 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+import db
+
+HEADER_SCAN_ROWS = 20             # Số dòng đầu mỗi sheet cần để tìm header (header thường nằm trong 5 dòng đầu)
+SAVE_BUSY_TIMEOUT_MS = 200        # Chờ khóa ghi ngắn: DB đang bận (VD: chính nơi gọi đang giữ transaction) thì để lần sau lưu
+
+# header_row: index (0-based) của dòng header trong sheet; mapping: dict tùy từng importer (chỉ chứa giá trị JSON được)
+Schema = namedtuple('Schema', ['header_row', 'mapping'])
+
+
+def _normalize_cell(cell):
+    if cell is None:
+        return ''
+    return ' '.join(str(cell).split()).lower()
+
+
+def header_signature(cells):
+    """Chữ ký của 1 dòng header: bỏ khác biệt hoa thường/khoảng trắng và các ô trống cuối dòng."""
+    names = [_normalize_cell(c) for c in cells]
+    while names and names[-1] == '':
+        names.pop()
+    return hashlib.sha1('\x1f'.join(names).encode('utf-8')).hexdigest()
+
+
+def find_column_fuzzy(df_columns, keywords, exclude_columns=None):
+    """
+    Tìm cột có chứa bất kỳ keyword nào (case-insensitive, fuzzy matching), theo thứ tự cột
+    keywords: 1 chuỗi hoặc list. Trả về tên cột nếu tìm thấy, None nếu không
+    """
+    if isinstance(keywords, str):
+        keywords = [keywords]
+    exclude_columns = exclude_columns or []
+    keywords = [k.lower() for k in keywords]
+    for col in df_columns:
+        if col in exclude_columns:
+            continue
+        col_lower = str(col).lower()
+        if any(k in col_lower for k in keywords):
+            return col
+    return None
+
+
+class SchemaRegistry:
+    """
+    Nhớ header + cách map cột đã dò được cho từng mẫu sheet (template), khóa theo chữ ký dòng header.
+
+    Lần sau gặp sheet cùng mẫu (cùng dòng header ở cùng vị trí) thì dùng lại kết quả, không phải dò fuzzy lại.
+    Lưu vào bảng sheet_schemas (db_path=None: chỉ nhớ trong process). Lỗi SQLite không làm hỏng việc đọc sheet;
+    schema chưa lưu được (DB đang bị khóa) sẽ được lưu ở lần remember()/flush() kế tiếp.
+    """
+
+    def __init__(self, db_path=db.DB_PATH):
+        self.db_path = db_path
+        self._schemas = {}            # {template: {signature: Schema}}
+        self._pending = {}            # {(template, signature): Schema} chưa lưu được xuống SQLite
+        self._lock = threading.Lock()
+        self._table_ready = False
+
+    def _connect(self):
+        conn = db.connect(self.db_path)
+        conn.execute(f"PRAGMA busy_timeout = {SAVE_BUSY_TIMEOUT_MS}")
+        if not self._table_ready:
+            conn.execute('''CREATE TABLE IF NOT EXISTS sheet_schemas (template TEXT, signature TEXT, header_row INTEGER, mapping TEXT, created_at REAL, PRIMARY KEY (template, signature))''')
+            self._table_ready = True
+        return conn
+
+    def _known(self, template):
+        """Các schema đã biết của template (lần đầu thì nạp từ SQLite). Gọi khi đang giữ _lock."""
+        if template in self._schemas:
+            return self._schemas[template]
+        known = {}
+        if self.db_path:
+            try:
+                conn = self._connect()
+                try:
+                    rows = conn.execute("SELECT signature, header_row, mapping FROM sheet_schemas WHERE template=?", (template,)).fetchall()
+                finally:
+                    conn.close()
+                known = {sig: Schema(header_row, json.loads(mapping)) for sig, header_row, mapping in rows}
+            except (sqlite3.Error, ValueError):
+                known = {}
+        self._schemas[template] = known
+        return known
+
+    def find(self, template, rows):
+        """Schema đã biết khớp với rows (các dòng đầu của sheet), None nếu chưa gặp mẫu này."""
+        with self._lock:
+            known = self._known(template)
+            for header_row in sorted({s.header_row for s in known.values()}):
+                if header_row < len(rows):
+                    schema = known.get(header_signature(rows[header_row]))
+                    if schema is not None and schema.header_row == header_row:
+                        return schema
+        return None
+
+    def remember(self, template, header, header_row, mapping):
+        """Lưu schema vừa dò được. header: các ô của dòng header."""
+        signature = header_signature(header)
+        schema = Schema(header_row, mapping)
+        with self._lock:
+            self._known(template)[signature] = schema
+            if self.db_path:
+                self._pending[(template, signature)] = schema
+                self._save_pending()
+        return schema
+
+    def flush(self):
+        """Lưu các schema còn chờ (gọi sau khi nơi gọi đã commit transaction của mình)."""
+        with self._lock:
+            self._save_pending()
+
+    def _save_pending(self):
+        if not self._pending:
+            return
+        try:
+            conn = self._connect()
+            try:
+                now = time.time()
+                conn.executemany("INSERT OR REPLACE INTO sheet_schemas (template, signature, header_row, mapping, created_at) VALUES (?,?,?,?,?)",
+                                 [(template, signature, schema.header_row, json.dumps(schema.mapping, ensure_ascii=False), now)
+                                  for (template, signature), schema in self._pending.items()])
+                conn.commit()
+            finally:
+                conn.close()
+            self._pending.clear()
+        except sqlite3.Error:
+            pass
+
+    def resolve(self, template, rows, detect):
+        """
+        Schema của sheet: dùng lại nếu đã biết, không thì gọi detect(rows) -> (header_row, mapping) rồi lưu lại.
+        detect trả về None (hoặc header_row < 0) khi sheet không có header hợp lệ -> trả về None, không lưu.
+        """
+        schema = self.find(template, rows)
+        if schema is not None:
+            return schema
+        detected = detect(rows)
+        if detected is None or detected[0] < 0:
+            return None
+        header_row, mapping = detected
+        return self.remember(template, rows[header_row], header_row, mapping)
+
+
+# Registry dùng chung cho các script import (lưu trong crm_data.db)
+registry = SchemaRegistry()
@@ -0,0 +1,106 @@
+import re
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+SEARCH_COLUMNS = ['Salon_Name', 'Phone', 'CID', 'Agent_Name', 'Date']
+DIGIT_COLUMNS = ['Phone', 'CID']  # Thêm bản chỉ-chữ-số để gõ "7134775054" vẫn ra "(713) 477-5054"
+GRAM = 3                          # Độ dài n-gram; từ khóa ngắn hơn thì quét danh sách đã chuẩn hóa sẵn
+
+
+def _digits(value):
+    return re.sub(r"\D", "", value)
+
+
+def _grams(text):
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+class SearchIndex:
+    """
+    Index tìm kiếm cho trang "Search & History" (khớp chuỗi con không phân biệt hoa thường trên SEARCH_COLUMNS).
+
+    - Mỗi dòng giữ sẵn các giá trị đã lowercase (+ SĐT/CID chỉ còn chữ số).
+    - Index n-gram: từ khóa -> giao các posting list -> kiểm lại trên vài dòng ứng viên.
+    - update() chỉ index lại các dòng mới/đổi (khóa theo Row_Ref), dòng cũ giữ nguyên.
+    """
+
+    def __init__(self):
+        self.version = None
+        self._docs = {}                   # key -> tuple giá trị đã chuẩn hóa
+        self._postings = defaultdict(set)  # n-gram -> tập key
+        self._keys = []                   # key theo thứ tự dòng của DataFrame hiện tại
+        self._positions = {}              # key -> vị trí dòng
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _row_keys(df):
+        if 'Row_Ref' in df.columns:
+            return df['Row_Ref'].astype(str).tolist()
+        return [str(i) for i in range(len(df))]
+
+    @staticmethod
+    def _row_fields(df):
+        cols = [df[c].astype(str).str.lower() if c in df.columns else None for c in SEARCH_COLUMNS]
+        digit_cols = [df[c].astype(str).map(_digits) if c in df.columns else None for c in DIGIT_COLUMNS]
+        series = [s for s in cols + digit_cols if s is not None]
+        if not series:
+            return [()] * len(df)
+        return list(zip(*[s.tolist() for s in series]))
+
+    def _add(self, key, fields):
+        self._docs[key] = fields
+        for gram in set().union(*[_grams(f) for f in fields]):
+            self._postings[gram].add(key)
+
+    def _remove(self, key):
+        fields = self._docs.pop(key)
+        for gram in set().union(*[_grams(f) for f in fields]):
+            bucket = self._postings.get(gram)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._postings[gram]
+
+    def update(self, df, version=None):
+        """Đồng bộ index với DataFrame mới. Cùng version thì bỏ qua. Trả về số dòng đã index lại."""
+        with self._lock:
+            return self._update(df, version)
+
+    def search(self, df, term, version=None):
+        """
+        Vị trí (iloc, tăng dần) các dòng của df có ít nhất 1 cột chứa term.
+
+        Đồng bộ index với df rồi tìm trong cùng 1 lần giữ khóa: index dùng chung nhiều phiên,
+        phiên khác không thể dựng lại index bằng df khác xen vào giữa, vị trí trả về luôn khớp với df này.
+        """
+        term = str(term).strip().lower()
+        with self._lock:
+            self._update(df, version)
+            if not term:
+                return np.arange(len(self._keys))
+            if len(term) < GRAM:
+                candidates = self._keys
+            else:
+                buckets = sorted((self._postings.get(g, set()) for g in _grams(term)), key=len)
+                candidates = set.intersection(*buckets) if buckets and buckets[0] else set()
+            hits = [self._positions[k] for k in candidates if any(term in f for f in self._docs[k])]
+        return np.array(sorted(hits), dtype=int)
+
+    def _update(self, df, version):
+        if version is not None and version == self.version and len(self._keys) == len(df):
+            return 0
+        keys = self._row_keys(df)
+        new_docs = dict(zip(keys, self._row_fields(df)))
+        changed = 0
+        for key in [k for k in self._docs if new_docs.get(k) != self._docs[k]]:
+            self._remove(key)
+        for key, fields in new_docs.items():
+            if key not in self._docs:
+                self._add(key, fields)
+                changed += 1
+        self._keys = keys
+        self._positions = {k: i for i, k in enumerate(keys)}
+        self.version = version
+        return changed
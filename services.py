@@ -1,29 +1,37 @@
+import threading
 import streamlit as st
 import pandas as pd
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
+from gsheet_client import get_shared_client
+from gsheet_loader import FETCH_WORKERS, RateLimiter, map_concurrent
 
-def _load_single_sheet(sheet_name, gc):
+
+def _load_single_sheet(sheet_name, gc, limiter=None):
     """
     Helper function to load data from a single Google Sheet.
     
     Args:
         sheet_name: Name of the Google Spreadsheet to open
-        gc: Authorized gspread client
+        gc: Authorized gspread client (or shared SheetsClient)
+        limiter: Optional RateLimiter shared by concurrent loaders
         
     Returns:
         pandas.DataFrame: DataFrame containing all records from the sheet, or None if failed
     """
     try:
         # Open the spreadsheet by name
+        if limiter: limiter.acquire()
         spreadsheet = gc.open(sheet_name)
         
         # Get the first worksheet (you can modify this to select a specific worksheet)
+        if limiter: limiter.acquire()
         worksheet = spreadsheet.sheet1
         
         # Get all records as a list of dictionaries
+        if limiter: limiter.acquire()
         records = worksheet.get_all_records()
         
         # Convert to DataFrame
@@ -59,12 +67,17 @@ def _load_single_sheet(sheet_name, gc):
 
 
 @st.cache_data(ttl=60)
-def load_data_from_gsheet(list_of_sheet_names):
+def load_data_from_gsheet(list_of_sheet_names, max_workers=FETCH_WORKERS):
     """
     Load data from multiple Google Sheets and combine them into one DataFrame.
     
+    Sheets are fetched in parallel on a bounded thread pool and merged in the
+    order of list_of_sheet_names, so the result does not depend on which
+    request finishes first.
+    
     Args:
         list_of_sheet_names: List of Google Spreadsheet names to open
+        max_workers: Maximum number of spreadsheets fetched at the same time
         
     Returns:
         pandas.DataFrame: Combined DataFrame containing all records from all accessible sheets
@@ -82,29 +95,21 @@ def load_data_from_gsheet(list_of_sheet_names):
         
         service_account_info = st.secrets["gcp_service_account"]
         
-        # Define the scope
-        scope = [
-            'https://spreadsheets.google.com/feeds',
-            'https://www.googleapis.com/auth/drive'
-        ]
-        
-        # Authenticate using service account
-        credentials = ServiceAccountCredentials.from_json_keyfile_dict(
-            service_account_info,
-            scope
+        # Shared process-wide client (one token, pooled HTTP session, cached spreadsheet handles)
+        gc = get_shared_client(service_account_info)
+        
+        # Fetch all sheets concurrently; worker threads get the script context so st.warning still works
+        limiter = RateLimiter()
+        ctx = get_script_run_ctx()
+        results = map_concurrent(
+            lambda sheet_name: _load_single_sheet(sheet_name, gc, limiter),
+            list_of_sheet_names,
+            max_workers,
+            initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)
         )
         
-        # Authorize and open the client
-        gc = gspread.authorize(credentials)
-        
-        # List to store all successfully loaded DataFrames
-        dataframes_list = []
-        
-        # Loop through each sheet name
-        for sheet_name in list_of_sheet_names:
-            df = _load_single_sheet(sheet_name, gc)
-            if df is not None and not df.empty:
-                dataframes_list.append(df)
+        # List to store all successfully loaded DataFrames (same order as list_of_sheet_names)
+        dataframes_list = [df for df in results if isinstance(df, pd.DataFrame) and not df.empty]
         
         # Check if we loaded any data
         if len(dataframes_list) == 0:
@@ -0,0 +1,193 @@
+import json
+import threading
+import time
+from datetime import datetime
+
+import db
+from row_locator import locator_key
+
+DB_PATH = 'crm_data.db'
+POLL_SECONDS = 5                  # Thread nền tự kiểm tra outbox mỗi chừng này giây (ngoài lúc được đánh thức)
+BACKOFF_BASE_SECONDS = 5          # Lần thử lại thứ n chờ BACKOFF_BASE_SECONDS * 2^(n-1)
+BACKOFF_MAX_SECONDS = 600
+MAX_ATTEMPTS = 8                  # Quá số lần này thì chuyển sang 'failed', chờ người bấm thử lại
+
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+KIND_APPEND = 'append'            # Ticket mới -> thêm dòng vào tab ngày
+KIND_UPDATE = 'update'            # Đổi Status/Note của dòng đã có
+
+
+class PermanentError(Exception):
+    """Handler raise lỗi này khi thử lại cũng vô ích (VD: không tìm thấy dòng cần sửa) -> chuyển thẳng sang 'failed', không backoff."""
+
+
+def row_key(date_str, phone, salon_name, row_ref=None):
+    """
+    Khóa gộp lệnh theo dòng trên Sheet: cùng locator_key (ngày đã chuẩn hóa + SĐT + tên tiệm) cho cả lệnh thêm lẫn lệnh sửa,
+    để lần sửa ticket chưa kịp lên Sheet gộp vào lệnh thêm đang chờ. Dòng đã có Row_Ref (đã nằm trên Sheet, không còn lệnh thêm)
+    thì gắn thêm Row_Ref, 2 ticket trùng SĐT trong ngày không bị gộp nhầm.
+    """
+    key = locator_key(date_str, phone, salon_name)
+    return f"{key}|{row_ref}" if row_ref else key
+
+
+def backoff_seconds(attempts):
+    return min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+
+
+class SheetOutbox:
+    """
+    Hàng đợi ghi Google Sheet bền vững (bảng sheet_outbox trong crm_data.db) + 1 thread nền xả hàng đợi.
+
+    - Lưu ticket chỉ tốn 1 lệnh INSERT vào SQLite, agent không phải chờ Google.
+    - Lỗi/quota thì thử lại với backoff lũy thừa, quá MAX_ATTEMPTS thì đánh dấu 'failed'.
+    - Nhiều lần sửa cùng 1 dòng khi lệnh trước chưa gửi được gộp làm 1 (sửa thẳng payload đang chờ).
+    - handlers: {kind: func(payload, checkpoint) -> (success, msg)}, do app.py truyền vào. Lỗi vĩnh viễn thì handler raise PermanentError.
+      checkpoint(payload) lưu lại payload ngay trước khi gửi (VD: dòng đã giữ chỗ), để lần thử lại không ghi trùng.
+    """
+
+    def __init__(self, handlers, db_path=DB_PATH, poll_interval=POLL_SECONDS):
+        self._handlers = handlers
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._init_table()
+
+    def _init_table(self):
+        with db.transaction(self.db_path) as conn:
+            c = conn.cursor()
+            c.execute('''CREATE TABLE IF NOT EXISTS sheet_outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, ticket_id INTEGER, kind TEXT, row_key TEXT, agent_name TEXT, payload TEXT,
+                         status TEXT, attempts INTEGER DEFAULT 0, next_attempt_at REAL, last_error TEXT, result TEXT, created_at TEXT, updated_at TEXT)''')
+            # Process trước bị tắt giữa chừng -> trả các lệnh đang gửi dở về hàng đợi
+            c.execute("UPDATE sheet_outbox SET status=? WHERE status=?", (STATUS_PENDING, STATUS_SENDING))
+
+    # ------------------------------------------------------------------
+    # Thread nền
+    # ------------------------------------------------------------------
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sheet-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.drain()
+            except Exception:
+                pass
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    # ------------------------------------------------------------------
+    # Ghi vào hàng đợi
+    # ------------------------------------------------------------------
+    def enqueue(self, kind, key, payload, ticket_id=None, agent_name=""):
+        """
+        Thêm 1 lệnh ghi Sheet. Nếu dòng `key` còn lệnh chưa gửi thì gộp vào lệnh đó.
+
+        Returns:
+            int: id của lệnh trong sheet_outbox
+        """
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock, db.transaction(self.db_path) as conn:
+            c = conn.cursor()
+            c.execute("SELECT id, kind, payload FROM sheet_outbox WHERE row_key=? AND status IN (?, ?) ORDER BY id DESC LIMIT 1",
+                      (key, STATUS_PENDING, STATUS_FAILED))
+            prev = c.fetchone()
+            if prev and kind == KIND_UPDATE:
+                merged = json.loads(prev[2])
+                if prev[1] == KIND_APPEND:
+                    # Ticket chưa kịp lên Sheet: ghi luôn Status/Note mới vào dòng sẽ thêm
+                    merged.update({"Status": payload.get("new_status", merged.get("Status")), "Note": payload.get("new_note", merged.get("Note"))})
+                else:
+                    merged.update(payload)
+                c.execute("UPDATE sheet_outbox SET payload=?, status=?, attempts=0, next_attempt_at=?, last_error='', updated_at=? WHERE id=?",
+                          (json.dumps(merged, ensure_ascii=False), STATUS_PENDING, time.time(), now, prev[0]))
+                item_id = prev[0]
+            else:
+                c.execute("INSERT INTO sheet_outbox (ticket_id, kind, row_key, agent_name, payload, status, attempts, next_attempt_at, last_error, result, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, 0, ?, '', '', ?, ?)",
+                          (ticket_id, kind, key, agent_name, json.dumps(payload, ensure_ascii=False), STATUS_PENDING, time.time(), now, now))
+                item_id = c.lastrowid
+        self._wake.set()
+        return item_id
+
+    def retry(self, item_id=None):
+        """Đưa lệnh 'failed' (hoặc tất cả nếu item_id=None) về hàng đợi."""
+        if item_id is None:
+            db.execute("UPDATE sheet_outbox SET status=?, attempts=0, next_attempt_at=? WHERE status=?", (STATUS_PENDING, time.time(), STATUS_FAILED), self.db_path)
+        else:
+            db.execute("UPDATE sheet_outbox SET status=?, attempts=0, next_attempt_at=? WHERE id=? AND status=?", (STATUS_PENDING, time.time(), item_id, STATUS_FAILED), self.db_path)
+        self._wake.set()
+
+    # ------------------------------------------------------------------
+    # Xả hàng đợi
+    # ------------------------------------------------------------------
+    def _claim_next(self):
+        with self._lock, db.transaction(self.db_path) as conn:
+            row = conn.execute("SELECT id, kind, payload, attempts FROM sheet_outbox WHERE status=? AND next_attempt_at<=? ORDER BY id LIMIT 1",
+                               (STATUS_PENDING, time.time())).fetchone()
+            if row:
+                conn.execute("UPDATE sheet_outbox SET status=? WHERE id=?", (STATUS_SENDING, row[0]))
+            return row
+
+    def _checkpoint(self, item_id, payload):
+        db.execute("UPDATE sheet_outbox SET payload=? WHERE id=?", (json.dumps(payload, ensure_ascii=False), item_id), self.db_path)
+
+    def _finish(self, item_id, attempts, success, msg, retryable=True):
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if success:
+            db.execute("UPDATE sheet_outbox SET status=?, attempts=?, last_error='', result=?, updated_at=? WHERE id=?", (STATUS_DONE, attempts, msg, now, item_id), self.db_path)
+        else:
+            status = STATUS_FAILED if not retryable or attempts >= MAX_ATTEMPTS else STATUS_PENDING
+            db.execute("UPDATE sheet_outbox SET status=?, attempts=?, next_attempt_at=?, last_error=?, updated_at=? WHERE id=?",
+                       (status, attempts, time.time() + backoff_seconds(attempts), msg, now, item_id), self.db_path)
+
+    def drain(self):
+        """Gửi lần lượt các lệnh đến hạn (theo thứ tự vào hàng đợi). Trả về số lệnh đã xử lý."""
+        processed = 0
+        while not self._stop.is_set():
+            item = self._claim_next()
+            if not item:
+                break
+            item_id, kind, payload, attempts = item
+            retryable = True
+            try:
+                success, msg = self._handlers[kind](json.loads(payload), lambda p, item_id=item_id: self._checkpoint(item_id, p))
+            except PermanentError as e:
+                success, msg, retryable = False, str(e), False
+            except Exception as e:
+                success, msg = False, str(e)
+            self._finish(item_id, attempts + 1, success, str(msg), retryable)
+            processed += 1
+        return processed
+
+    # ------------------------------------------------------------------
+    # Trạng thái cho UI
+    # ------------------------------------------------------------------
+    def pending_count(self):
+        return db.fetch_one("SELECT COUNT(*) FROM sheet_outbox WHERE status IN (?, ?)", (STATUS_PENDING, STATUS_SENDING), self.db_path)[0]
+
+    def recent_items(self, agent_name=None, limit=10):
+        """Các lệnh gần nhất (mới nhất trước): id, ticket_id, kind, payload (dict), status, attempts, last_error, result, updated_at."""
+        sql = "SELECT id, ticket_id, kind, payload, status, attempts, last_error, result, updated_at FROM sheet_outbox"
+        params = []
+        if agent_name:
+            sql += " WHERE agent_name=?"
+            params.append(agent_name)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        rows = db.fetch_all(sql, params, self.db_path)
+        return [r[:3] + (json.loads(r[3] or "{}"),) + r[4:] for r in rows]
@@ -0,0 +1,385 @@
+import hashlib
+import io
+import json
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from gspread.utils import ExportFormat
+
+from gsheet_loader import FETCH_WORKERS, RateLimiter, quote_tab, fetch_tabs_batched, map_concurrent
+from report_parsing import KEEP_COLUMNS, is_report_tab, parse_daily_tab, finalize_report_frame
+from schema_registry import SchemaRegistry
+import workbook_stream
+import db
+
+DB_PATH = 'crm_data.db'
+SYNC_INTERVAL_SECONDS = 120       # Chu kỳ thread nền kiểm tra thay đổi
+FULL_RESYNC_SECONDS = 6 * 3600    # Tab nào quá hạn này sẽ bị tải lại toàn bộ (phòng sửa giữa sheet)
+RETRY_SECONDS = 60                # File tải lần đầu bị lỗi thì chờ bấy lâu mới thử lại (không chặn mỗi lần rerun)
+TAIL_ROWS = 5                     # Số dòng cuối dùng để băm fingerprint
+FINGERPRINT_COLUMNS = 11          # A:K - vùng dữ liệu ticket trên tab ngày
+COUNT_COLUMN = "B"                # Cột Name (Agent) - dòng ticket nào cũng có
+# Cách tải tab của 1 file:
+# - FETCH_API: probe fingerprint rồi batchGet các tab đã đổi qua Sheets API (hợp cho sync định kỳ)
+# - FETCH_XLSX: export cả file dạng XLSX qua Drive trong 1 lần tải rồi parse local (không tốn quota đọc Sheets,
+#   nhưng file XLSX nặng hơn JSON của batchGet - xem _bench ở cuối file)
+FETCH_API = "api"
+FETCH_XLSX = "xlsx"
+
+
+def _normalize_row(row):
+    cells = [str(c) for c in row[:FINGERPRINT_COLUMNS]]
+    while cells and cells[-1] == "":
+        cells.pop()
+    return cells
+
+
+def tail_hash(rows):
+    payload = json.dumps([_normalize_row(r) for r in rows], ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def fingerprint_from_raw(raw):
+    """Tính (row_count, tail_hash) từ dữ liệu đầy đủ của tab, khớp với kết quả probe."""
+    col_idx = ord(COUNT_COLUMN) - ord("A")
+    row_count = 0
+    for i, row in enumerate(raw):
+        if len(row) > col_idx and str(row[col_idx]) != "":
+            row_count = i + 1
+    return row_count, tail_hash(raw[max(0, row_count - TAIL_ROWS):row_count])
+
+
+class SheetMirror:
+    """
+    Mirror các tab ngày của file "DAILY REPORT" xuống bảng sheet_rows trong crm_data.db.
+
+    Mỗi tab giữ 1 fingerprint (số dòng có dữ liệu ở cột Name + hash các dòng cuối).
+    Mỗi lần sync chỉ tốn 2 request probe cho cả spreadsheet, rồi tải lại các tab đã đổi bằng 1 request batchGet.
+    UI luôn đọc từ SQLite qua read_frame().
+    """
+
+    def __init__(self, client_factory, db_path=DB_PATH, interval=SYNC_INTERVAL_SECONDS, max_workers=FETCH_WORKERS, rate_limiter=None):
+        self._client_factory = client_factory
+        self.db_path = db_path
+        self.interval = interval
+        self.max_workers = max_workers
+        self._limiter = rate_limiter or RateLimiter()
+        self.version = 0
+        self.last_sync = None
+        self.last_error = None
+        self._watched = []
+        self._synced = set()
+        self._attempted = {}
+        self._sync_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._schemas = SchemaRegistry(db_path)   # Header/cột của tab ngày: dò 1 lần cho mỗi mẫu tab
+        self._init_tables()
+
+    def _init_tables(self):
+        with db.transaction(self.db_path) as conn:
+            c = conn.cursor()
+            c.execute('''CREATE TABLE IF NOT EXISTS sheet_tabs (sheet_name TEXT, tab_title TEXT, tab_index INTEGER, row_count INTEGER, tail_hash TEXT, synced_at REAL, PRIMARY KEY (sheet_name, tab_title))''')
+            cols = ", ".join(f"{col} TEXT" for col in KEEP_COLUMNS)
+            c.execute(f'''CREATE TABLE IF NOT EXISTS sheet_rows (sheet_name TEXT, tab_title TEXT, row_idx INTEGER, {cols}, PRIMARY KEY (sheet_name, tab_title, row_idx))''')
+            # Đếm số lần app sửa thẳng dòng trong mirror (apply_row_update) - để data_signature đổi theo
+            c.execute('''CREATE TABLE IF NOT EXISTS sheet_edits (sheet_name TEXT PRIMARY KEY, edit_count INTEGER)''')
+
+    # ------------------------------------------------------------------
+    # Thread nền
+    # ------------------------------------------------------------------
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sheet-mirror", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def watch(self, sheet_names):
+        for s in sheet_names:
+            if s not in self._watched:
+                self._watched.append(s)
+
+    def request_sync(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            if self._watched:
+                self.sync_sheets(list(self._watched))
+
+    # ------------------------------------------------------------------
+    # Đồng bộ
+    # ------------------------------------------------------------------
+    def has_sheet(self, sheet_name):
+        if sheet_name in self._synced:
+            return True
+        return db.fetch_one("SELECT 1 FROM sheet_tabs WHERE sheet_name=? LIMIT 1", (sheet_name,), self.db_path) is not None
+
+    def needs_initial_sync(self, sheet_name):
+        """File chưa có trong mirror và chưa thử tải (hoặc lần thử trước đã quá RETRY_SECONDS)."""
+        if self.has_sheet(sheet_name):
+            return False
+        return time.time() - self._attempted.get(sheet_name, 0) > RETRY_SECONDS
+
+    def sync_sheets(self, sheet_names, force=False, mode=FETCH_API):
+        """
+        Đồng bộ song song các spreadsheet (tối đa max_workers file 1 lúc). Trả về số tab đã thay đổi.
+        mode: FETCH_API hoặc FETCH_XLSX (không có openpyxl thì luôn dùng FETCH_API).
+        """
+        if mode == FETCH_XLSX and not workbook_stream.HAS_OPENPYXL:
+            mode = FETCH_API
+        changed = 0
+        with self._sync_lock:
+            for s_name in sheet_names:
+                self._attempted[s_name] = time.time()
+            try:
+                gc = self._client_factory()
+            except Exception as e:
+                self.last_error = str(e)
+                return 0
+            results = map_concurrent(lambda s_name: self._sync_one(gc, s_name, force, mode), sheet_names, self.max_workers)
+            for s_name, res in zip(sheet_names, results):
+                if isinstance(res, Exception):
+                    self.last_error = f"{s_name}: {res}"
+                else:
+                    changed += res
+                    self._synced.add(s_name)
+            if changed:
+                self.version += 1
+            self.last_sync = datetime.now()
+        return changed
+
+    def _load_fingerprints(self, sheet_name):
+        rows = db.fetch_all("SELECT tab_title, row_count, tail_hash, synced_at FROM sheet_tabs WHERE sheet_name=?", (sheet_name,), self.db_path)
+        return {r[0]: (r[1], r[2], r[3]) for r in rows}
+
+    def _probe_counts(self, sh, titles):
+        ranges = [f"{quote_tab(t)}!{COUNT_COLUMN}:{COUNT_COLUMN}" for t in titles]
+        self._limiter.acquire()
+        res = sh.values_batch_get(ranges)
+        return {t: len(vr.get('values', [])) for t, vr in zip(titles, res.get('valueRanges', []))}
+
+    def _probe_tails(self, sh, titles, counts):
+        last_col = chr(ord("A") + FINGERPRINT_COLUMNS - 1)
+        ranges = [f"{quote_tab(t)}!A{max(1, counts[t] - TAIL_ROWS + 1)}:{last_col}{max(1, counts[t])}" for t in titles]
+        self._limiter.acquire()
+        res = sh.values_batch_get(ranges)
+        return {t: tail_hash(vr.get('values', [])) for t, vr in zip(titles, res.get('valueRanges', []))}
+
+    def _export_tabs(self, sh):
+        """{tab: dữ liệu thô như get_all_values} của mọi tab ngày, từ 1 lần export XLSX (Drive API, không tốn quota đọc Sheets)."""
+        content = sh.export(ExportFormat.EXCEL)
+        return workbook_stream.workbook_values(io.BytesIO(content), include=is_report_tab)
+
+    def _sync_one(self, gc, sheet_name, force, mode=FETCH_API):
+        self._limiter.acquire()
+        sh = gc.open(sheet_name)
+        if mode == FETCH_XLSX:
+            try:
+                fetched = self._export_tabs(sh)
+            except Exception as e:
+                # Export lỗi (file quá lớn, không có quyền Drive...) thì tải lại bằng Sheets API như bình thường
+                self.last_error = f"{sheet_name}: export XLSX lỗi ({e}), chuyển sang Sheets API"
+            else:
+                # Đã có đủ dữ liệu mọi tab nên ghi lại hết, không cần probe
+                removed = [t for t in self._load_fingerprints(sheet_name) if t not in fetched]
+                self._store(sheet_name, list(fetched), fetched, removed)
+                return len(fetched) + len(removed)
+        self._limiter.acquire()
+        titles = [ws.title for ws in sh.worksheets() if is_report_tab(ws.title)]
+        known = self._load_fingerprints(sheet_name)
+        now = time.time()
+
+        dirty, unchanged = [], []
+        # File chưa từng mirror (hoặc force) thì bỏ qua probe, tải thẳng mọi tab
+        counts = self._probe_counts(sh, titles) if titles and known and not force else {}
+        for t in titles:
+            fp = known.get(t)
+            if force or fp is None or fp[0] != counts.get(t) or (now - (fp[2] or 0)) > FULL_RESYNC_SECONDS:
+                dirty.append(t)
+            elif counts.get(t):
+                unchanged.append(t)
+        if unchanged:
+            tails = self._probe_tails(sh, unchanged, counts)
+            dirty += [t for t in unchanged if tails.get(t) != known[t][1]]
+
+        fetched = {}
+        if dirty:
+            self._limiter.acquire()
+            fetched = fetch_tabs_batched(sh, dirty)
+        removed = [t for t in known if t not in titles]
+        self._store(sheet_name, titles, fetched, removed)
+        return len(fetched) + len(removed)
+
+    def _store(self, sheet_name, titles, fetched, removed):
+        cols = ["sheet_name", "tab_title", "row_idx"] + KEEP_COLUMNS
+        insert_sql = f"INSERT INTO sheet_rows ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})"
+        # Parse trước khi mở transaction: schema registry cũng ghi vào DB này (bảng sheet_schemas), không được chờ khóa của chính mình
+        parsed = {t: parse_daily_tab(raw, sheet_name, t, self._schemas) for t, raw in fetched.items()}
+        with db.transaction(self.db_path) as conn:
+            c = conn.cursor()
+            for t in removed:
+                c.execute("DELETE FROM sheet_rows WHERE sheet_name=? AND tab_title=?", (sheet_name, t))
+                c.execute("DELETE FROM sheet_tabs WHERE sheet_name=? AND tab_title=?", (sheet_name, t))
+            for t, raw in fetched.items():
+                c.execute("DELETE FROM sheet_rows WHERE sheet_name=? AND tab_title=?", (sheet_name, t))
+                df_d = parsed[t]
+                if df_d is not None and not df_d.empty:
+                    values = df_d.astype(str).values.tolist()
+                    c.executemany(insert_sql, [[sheet_name, t, int(idx)] + v for idx, v in zip(df_d.index, values)])
+                row_count, t_hash = fingerprint_from_raw(raw)
+                c.execute("INSERT OR REPLACE INTO sheet_tabs (sheet_name, tab_title, tab_index, row_count, tail_hash, synced_at) VALUES (?, ?, ?, ?, ?, ?)",
+                          (sheet_name, t, titles.index(t), row_count, t_hash, time.time()))
+            c.executemany("UPDATE sheet_tabs SET tab_index=? WHERE sheet_name=? AND tab_title=?", [(i, sheet_name, t) for i, t in enumerate(titles)])
+
+    def mark_dirty(self, sheet_name, tab_title):
+        """Buộc tab được tải lại ở lần sync kế tiếp (sau khi app tự ghi lên Sheet)."""
+        db.execute("UPDATE sheet_tabs SET row_count=-1 WHERE sheet_name=? AND tab_title=?", (sheet_name, tab_title), self.db_path)
+        self.request_sync()
+
+    def apply_row_update(self, sheet_name, tab_title, row_idx, values):
+        """Ghi thẳng thay đổi của 1 dòng vào mirror (write-through), không cần đợi sync."""
+        fields = {k: v for k, v in values.items() if k in KEEP_COLUMNS}
+        if not fields:
+            return
+        with db.transaction(self.db_path) as conn:
+            cur = conn.execute(f"UPDATE sheet_rows SET {', '.join(f'{k}=?' for k in fields)} WHERE sheet_name=? AND tab_title=? AND row_idx=?",
+                               list(fields.values()) + [sheet_name, tab_title, row_idx])
+            if cur.rowcount:
+                conn.execute("INSERT INTO sheet_edits (sheet_name, edit_count) VALUES (?, 1) ON CONFLICT(sheet_name) DO UPDATE SET edit_count = edit_count + 1", (sheet_name,))
+        if cur.rowcount:
+            self.version += 1
+
+    # ------------------------------------------------------------------
+    # Đọc
+    # ------------------------------------------------------------------
+    def locate_rows(self, sheet_name, tab_title, phone, salon_name):
+        """Số dòng trên Sheet của các ticket khớp SĐT + tên tiệm trong 1 tab (theo dữ liệu đã mirror)."""
+        rows = db.fetch_all("SELECT row_idx FROM sheet_rows WHERE sheet_name=? AND tab_title=? AND instr(Phone, ?) > 0 AND instr(Salon_Name, ?) > 0 ORDER BY row_idx",
+                            (sheet_name, tab_title, str(phone), str(salon_name)), self.db_path)
+        return [r[0] for r in rows]
+
+    def data_signature(self, sheet_names):
+        """
+        Dấu vân tay nội dung mirror của các file (fingerprint từng tab + số lần sửa thẳng), không phụ thuộc process.
+
+        Dùng để biết bản snapshot đã lưu ra đĩa còn khớp SQLite hay không.
+        """
+        parts = []
+        for s_name in sheet_names:
+            tabs = db.fetch_all("SELECT tab_title, tab_index, row_count, tail_hash, synced_at FROM sheet_tabs WHERE sheet_name=? ORDER BY tab_title", (s_name,), self.db_path)
+            edits = db.fetch_one("SELECT edit_count FROM sheet_edits WHERE sheet_name=?", (s_name,), self.db_path)
+            parts.append([s_name, tabs, edits[0] if edits else 0])
+        return hashlib.sha1(json.dumps(parts, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def read_frame(self, sheet_names):
+        """
+        Đọc dữ liệu đã mirror theo đúng thứ tự file -> tab -> dòng như khi tải trực tiếp.
+
+        Ngoài KEEP_COLUMNS có thêm cột Row_Ref ("file|tab|dòng") để cập nhật ngược đúng dòng trên Sheet.
+        """
+        select_cols = ", ".join(f"r.{col}" for col in KEEP_COLUMNS) + ", r.sheet_name || '|' || r.tab_title || '|' || r.row_idx AS Row_Ref"
+        sql = f'''SELECT {select_cols} FROM sheet_rows r JOIN sheet_tabs t ON r.sheet_name = t.sheet_name AND r.tab_title = t.tab_title
+                  WHERE r.sheet_name=? ORDER BY t.tab_index, r.row_idx'''
+        frames = []
+        for s_name in sheet_names:
+            df_s = db.read_df(sql, (s_name,), self.db_path)
+            if not df_s.empty:
+                frames.append(df_s)
+        return finalize_report_frame(frames)
+
+
+# ==========================================
+# BENCHMARK: python sheet_sync.py "<file DAILY REPORT>.xlsx" [ms trễ/request] [Mbit/s]
+# So sánh tải lần đầu 1 file: FETCH_API (batchGet từng tab) và FETCH_XLSX (1 lần export),
+# dùng file .xlsx local làm Google Sheets/Drive giả lập (mỗi request chờ độ trễ + dung lượng/băng thông).
+# ==========================================
+class _LocalSpreadsheet:
+    def __init__(self, path, latency, bytes_per_second):
+        with open(path, 'rb') as f:
+            self._content = f.read()
+        self._tabs = workbook_stream.workbook_values(io.BytesIO(self._content))
+        self.latency = latency
+        self.bytes_per_second = bytes_per_second
+        self.requests = 0
+        self.bytes = 0
+
+    def _transfer(self, size):
+        self.requests += 1
+        self.bytes += size
+        time.sleep(self.latency + size / self.bytes_per_second)
+
+    def _range_values(self, a1):
+        # "'3'!B:B", "'3'!A10:K14" hoặc "'3'" (cả tab); giống API: bỏ ô trống cuối dòng và dòng trống cuối
+        title, _, cells = a1.partition('!')
+        rows = self._tabs.get(title[1:-1].replace("''", "'"), [])
+        if cells:
+            (c1, r1), (c2, r2) = [(ord(p[0]) - ord('A'), p[1:]) for p in cells.split(':')]
+            rows = [r[c1:c2 + 1] for r in rows[int(r1 or 1) - 1:int(r2) if r2 else None]]
+        values = []
+        for r in rows:
+            r = list(r)
+            while r and r[-1] == '':
+                r.pop()
+            values.append(r)
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def worksheets(self):
+        self._transfer(200 * len(self._tabs))
+        return [type('Worksheet', (), {'title': t})() for t in self._tabs]
+
+    def values_batch_get(self, ranges):
+        res = {'valueRanges': [{'range': r, 'values': self._range_values(r)} for r in ranges]}
+        # Sheets API trả JSON nén gzip
+        self._transfer(len(zlib.compress(json.dumps(res).encode('utf-8'))))
+        return res
+
+    def export(self, fmt):
+        self._transfer(len(self._content))
+        return self._content
+
+
+def _bench(path, latency_ms=300, mbps=20):
+    import os
+    import shutil
+    import tempfile
+
+    sheet_name = os.path.splitext(os.path.basename(path))[0].replace('_', '/')   # "... 12_25" -> "... 12/25" (tháng/năm trong tên file)
+    frames = {}
+    for mode in (FETCH_API, FETCH_XLSX):
+        sh = _LocalSpreadsheet(path, latency_ms / 1000, mbps * 1_000_000 / 8)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            mirror = SheetMirror(lambda: type('Client', (), {'open': lambda self, title: sh})(), db_path=os.path.join(tmp_dir, "bench.db"),
+                                 rate_limiter=RateLimiter(0))
+            t0 = time.perf_counter()
+            tabs = mirror.sync_sheets([sheet_name], mode=mode)
+            elapsed = time.perf_counter() - t0
+            frames[mode] = mirror.read_frame([sheet_name])
+        finally:
+            db.close_connection(os.path.join(tmp_dir, "bench.db"))
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        if mirror.last_error:
+            print(f"⚠️ {mirror.last_error}")
+        print(f"{mode:<5} {tabs:3d} tab  {len(frames[mode]):6,} dòng  {sh.requests} request  {sh.bytes / 1024:8.1f} KB  {elapsed:6.2f}s")
+    same = frames[FETCH_API].drop(columns=['Row_Ref']).astype(str).equals(frames[FETCH_XLSX].drop(columns=['Row_Ref']).astype(str))
+    print(f"Dữ liệu 2 cách tải {'giống nhau' if same else 'KHÁC NHAU'}")
+
+
+if __name__ == '__main__':
+    import sys
+    _bench(sys.argv[1], *[float(a) for a in sys.argv[2:4]])
@@ -0,0 +1,155 @@
+import threading
+import time
+
+DATA_START_ROW = 7                 # Dòng ticket đầu tiên trên tab ngày
+SCAN_RANGE = "A6:K1000"            # Đọc kèm dòng header (6) để lấy STT dòng trước khi tab còn trống
+TAIL_CACHE_TTL = 120               # Giây; quá hạn thì quét lại tab trước khi ghi (phòng người khác ghi tay)
+
+COLORS = {'red': {"red": 1.0, "green": 0.0, "blue": 0.0}, 'blue': {"red": 0.0, "green": 0.0, "blue": 1.0}, 'black': {"red": 0.0, "green": 0.0, "blue": 0.0}}
+FORMAT_FIELDS = "userEnteredFormat(textFormat,verticalAlignment,horizontalAlignment,wrapStrategy)"
+# Căn lề từng vùng cột của 1 dòng ticket (giống apply_full_format cũ): (cột đầu, cột cuối, căn ngang, wrap) - index 0 = cột A
+ROW_LAYOUT = [(1, 4, "CENTER", "CLIP"), (5, 5, "LEFT", "CLIP"), (6, 7, "CENTER", "CLIP"), (8, 8, "CENTER", "CLIP"), (9, 9, "LEFT", "WRAP"), (10, 10, "LEFT", "CLIP")]
+
+
+def _cell_format(color_type, h_align, wrap):
+    return {
+        "textFormat": {"fontFamily": "Times New Roman", "fontSize": 12, "foregroundColor": COLORS.get(color_type, COLORS['black'])},
+        "verticalAlignment": "BOTTOM", "horizontalAlignment": h_align, "wrapStrategy": wrap
+    }
+
+
+def _extended_value(val):
+    if isinstance(val, bool):
+        return {"boolValue": val}
+    if isinstance(val, (int, float)):
+        return {"numberValue": val}
+    return {"stringValue": "" if val is None else str(val)}
+
+
+def format_row_requests(sheet_id, row_idx, color_type):
+    """Các request repeatCell định dạng 1 dòng ticket (B:K), gộp được vào 1 batchUpdate."""
+    requests = []
+    for col_start, col_end, h_align, wrap in ROW_LAYOUT:
+        requests.append({"repeatCell": {
+            "range": {"sheetId": sheet_id, "startRowIndex": row_idx - 1, "endRowIndex": row_idx, "startColumnIndex": col_start, "endColumnIndex": col_end + 1},
+            "cell": {"userEnteredFormat": _cell_format(color_type, h_align, wrap)},
+            "fields": FORMAT_FIELDS
+        }})
+    return requests
+
+
+def update_cells_request(sheet_id, row_idx, col_idx, values):
+    """Ghi giá trị (kiểu RAW) vào 1 dòng bắt đầu từ cột col_idx (0 = A)."""
+    return {"updateCells": {
+        "range": {"sheetId": sheet_id, "startRowIndex": row_idx - 1, "endRowIndex": row_idx, "startColumnIndex": col_idx, "endColumnIndex": col_idx + len(values)},
+        "rows": [{"values": [{"userEnteredValue": _extended_value(v)} for v in values]}],
+        "fields": "userEnteredValue"
+    }}
+
+
+def append_row_request(sheet_id, values):
+    """Thêm 1 dòng sau dòng cuối có dữ liệu của tab (thay cho ws.append_row)."""
+    return {"appendCells": {
+        "sheetId": sheet_id,
+        "rows": [{"values": [{"userEnteredValue": _extended_value(v)} for v in values]}],
+        "fields": "userEnteredValue"
+    }}
+
+
+def ticket_row_requests(sheet_id, row_idx, stt, row_data, color_type):
+    """STT (cột A) + dữ liệu B:K + định dạng của 1 ticket, dạng list request cho spreadsheets.batchUpdate."""
+    return [update_cells_request(sheet_id, row_idx, 0, [stt]), update_cells_request(sheet_id, row_idx, 1, row_data)] + format_row_requests(sheet_id, row_idx, color_type)
+
+
+def find_append_row(grid):
+    """
+    Tìm dòng trống đầu tiên để ghi ticket và STT cuối cùng phía trên nó.
+
+    grid: giá trị vùng SCAN_RANGE (dòng đầu là dòng 6).
+    Returns: (số dòng trên sheet, STT cuối cùng)
+    """
+    rows = grid[1:]
+    last_stt = 0
+    target_row_idx = -1
+    for i, row in enumerate(rows):
+        row_padded = [str(x).strip() for x in row] + [""] * (11 - len(row))
+        if bool(row_padded[1] or row_padded[5] or row_padded[7] or row_padded[9]):
+            if row_padded[0].isdigit(): last_stt = int(row_padded[0])
+            continue
+        target_row_idx = DATA_START_ROW + i
+        break
+    if target_row_idx == -1:
+        target_row_idx = DATA_START_ROW + len(rows)
+    if last_stt == 0:
+        prev = grid[target_row_idx - DATA_START_ROW] if grid else []
+        prev_stt = str(prev[0]).strip() if prev else ""
+        if prev_stt.isdigit(): last_stt = int(prev_stt)
+    return target_row_idx, last_stt
+
+
+def _padded(row):
+    return [str(x).strip() for x in (row or [])] + [""] * (11 - len(row or []))
+
+
+class TailPointerCache:
+    """
+    Con trỏ "dòng trống kế tiếp" của từng tab ngày, giữ trong bộ nhớ process.
+
+    Lần đầu (hoặc khi quá TAIL_CACHE_TTL) đọc SCAN_RANGE 1 lần, sau đó các lần lưu ticket
+    tính dòng đích ngay trong bộ nhớ. Có khóa theo tab nên 2 agent lưu cùng lúc không bị trùng dòng.
+    Dòng tính từ cache được đọc lại (2 dòng, qua probe) trước khi dùng: có người ghi tay / process khác ghi vào thì quét lại tab.
+    """
+
+    def __init__(self, ttl=TAIL_CACHE_TTL):
+        self.ttl = ttl
+        self._grids = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def _lock_for(self, key):
+        with self._guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def _still_free(grid, target_row_idx, probe):
+        """Trên Sheet, dòng đích vẫn trống và dòng ngay trên vẫn mang STT như trong cache."""
+        live = probe(target_row_idx - 1, target_row_idx)
+        live_prev, live_target = (list(live) + [[], []])[:2]
+        cached_prev = grid[target_row_idx - DATA_START_ROW] if len(grid) > target_row_idx - DATA_START_ROW else []
+        return not any(_padded(live_target)) and _padded(live_prev)[0] == _padded(cached_prev)[0]
+
+    def reserve(self, key, loader, row_data, probe=None):
+        """
+        Giữ chỗ 1 dòng cho row_data (B:K). loader() trả về giá trị SCAN_RANGE khi cần quét lại.
+        probe(dòng đầu, dòng cuối): giá trị A:K của vài dòng, dùng để kiểm tra dòng tính từ cache. Returns: (dòng, STT).
+        """
+        with self._lock_for(key):
+            cached = self._grids.get(key)
+            fresh = cached is None or time.monotonic() - cached[0] > self.ttl
+            if fresh:
+                cached = (time.monotonic(), [list(r) for r in loader()])
+                self._grids[key] = cached
+            grid = cached[1]
+            target_row_idx, last_stt = find_append_row(grid)
+            if not fresh and probe is not None and not self._still_free(grid, target_row_idx, probe):
+                # Cache đã cũ so với Sheet: quét lại, không ghi đè dòng người khác vừa nhập
+                cached = (time.monotonic(), [list(r) for r in loader()])
+                self._grids[key] = cached
+                grid = cached[1]
+                target_row_idx, last_stt = find_append_row(grid)
+            stt = last_stt + 1
+            pos = target_row_idx - DATA_START_ROW + 1
+            while len(grid) <= pos:
+                grid.append([])
+            grid[pos] = [str(stt)] + [str(v) for v in row_data]
+            return target_row_idx, stt
+
+    def invalidate(self, key=None):
+        with self._guard:
+            if key is None:
+                self._grids.clear()
+            else:
+                self._grids.pop(key, None)
+
+
+tail_pointers = TailPointerCache()
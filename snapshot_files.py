@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+HAS_ARROW = False
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    HAS_ARROW = True
+except ImportError:
+    HAS_ARROW = False
+
+SNAPSHOT_DIR = 'crm_snapshots'    # Nằm cạnh crm_data.db
+
+
+def _base_path(snapshot_dir, name):
+    digest = hashlib.sha1(repr(name).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(snapshot_dir, digest)
+
+
+def _write_atomic(path, write):
+    tmp = f"{path}.tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _save_frame(path, df):
+    """Ghi 1 DataFrame. Trả về True nếu tên cột là số (VD: sheet NOTE đọc không header) để lúc đọc đổi lại."""
+    int_columns = len(df.columns) > 0 and all(isinstance(c, int) for c in df.columns)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    def write(tmp):
+        with pa.OSFile(tmp, 'wb') as sink, pa_ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    _write_atomic(path, write)
+    return int_columns
+
+
+def _load_frame(path, int_columns=False):
+    # Memory-map: Arrow đọc thẳng từ page cache của OS thay vì đọc cả file vào 1 buffer trước.
+    # to_pandas() vẫn copy dữ liệu sang bộ nhớ của pandas (dtype như frame gốc, theo metadata pandas trong file) - cần như vậy
+    # vì file map bị đóng ngay sau khối with và có thể bị ghi đè (os.replace) bởi lần save() kế tiếp.
+    with pa.memory_map(path, 'r') as source:
+        df = pa_ipc.open_file(source).read_all().to_pandas()
+    if int_columns:
+        df.columns = [int(c) for c in df.columns]
+    return df
+
+
+def save(snapshot_dir, name, value, meta=None):
+    """
+    Lưu 1 bản dữ liệu (DataFrame, dict DataFrame hoặc giá trị JSON) kèm meta ra file Arrow IPC.
+
+    Returns:
+        bool: False nếu không lưu được (thiếu pyarrow / kiểu dữ liệu không hỗ trợ)
+    """
+    if not HAS_ARROW:
+        return False
+    os.makedirs(snapshot_dir, exist_ok=True)
+    base = _base_path(snapshot_dir, name)
+    manifest = {"name": repr(name), "saved_at": time.time(), "meta": meta}
+    if isinstance(value, pd.DataFrame):
+        manifest["kind"] = "frame"
+        manifest["int_columns"] = [0] if _save_frame(f"{base}.arrow", value) else []
+    elif isinstance(value, dict) and value and all(isinstance(v, pd.DataFrame) for v in value.values()):
+        manifest["kind"] = "frames"
+        manifest["keys"] = list(value.keys())
+        manifest["int_columns"] = [i for i, key in enumerate(manifest["keys"]) if _save_frame(f"{base}.{i}.arrow", value[key])]
+    else:
+        manifest["kind"] = "json"
+        manifest["value"] = value
+
+    def write_manifest(tmp):
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+    # Manifest ghi sau cùng: chỉ trỏ tới các file dữ liệu đã ghi xong
+    _write_atomic(f"{base}.json", write_manifest)
+    return True
+
+
+def load(snapshot_dir, name):
+    """(value, meta, saved_at) của bản đã lưu, None nếu chưa có hoặc đọc lỗi."""
+    if not HAS_ARROW:
+        return None
+    base = _base_path(snapshot_dir, name)
+    try:
+        with open(f"{base}.json", encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest["kind"] == "frame":
+            value = _load_frame(f"{base}.arrow", 0 in manifest["int_columns"])
+        elif manifest["kind"] == "frames":
+            value = {key: _load_frame(f"{base}.{i}.arrow", i in manifest["int_columns"]) for i, key in enumerate(manifest["keys"])}
+        else:
+            value = manifest["value"]
+        return value, manifest.get("meta"), manifest.get("saved_at")
+    except Exception:
+        return None
@@ -0,0 +1,116 @@
+# lldtek_fixture_server.py
+import html
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "lldtek")
+LOGIN_PATH = "/salon/login"
+SEARCH_PATH = "/salon/web/pos/list"
+JS_SEARCH_PATH = "/salon/web/pos/app"     # Trang POS list render bằng JS (không có form) -> client phải raise LookupUnavailable
+USERNAME = "agent01"
+PASSWORD = "secret"
+SESSION_COOKIE = "lldtek_session"
+KNOWN_TERMS = ("40123", "lovely nails", "555-0134")   # Các từ khóa có trong found.html
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURE_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "LldtekFixture/1.0"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _logged_in(self):
+        return f"{SESSION_COOKIE}={self.server.session_id}" in (self.headers.get("Cookie") or "")
+
+    def _send_html(self, name, status=200, headers=None, keyword=""):
+        # Trang kết quả lặp lại từ khóa (ô tìm kiếm + tiêu đề) như trang thật, kể cả khi không tìm thấy
+        body = read_fixture(name).replace("{keyword}", html.escape(keyword)).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _redirect(self, path, headers=None):
+        self.send_response(302)
+        self.send_header("Location", path)
+        self.send_header("Content-Length", "0")
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        self.server.requests.append(("GET", url.path, parse_qs(url.query)))
+        if url.path == LOGIN_PATH:
+            return self._send_html("login.html")
+        if url.path not in (SEARCH_PATH, JS_SEARCH_PATH):
+            return self._send_html("not_found.html", status=404)
+        if not self._logged_in():
+            return self._redirect(LOGIN_PATH)
+        if url.path == JS_SEARCH_PATH:
+            return self._send_html("pos_list_js.html")
+        keyword = parse_qs(url.query).get("keyword", [""])[0].strip()
+        if not keyword:
+            return self._send_html("pos_list.html")
+        return self._send_html("found.html" if any(keyword.lower() in t for t in KNOWN_TERMS) else "not_found.html", keyword=keyword)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode("utf-8")).items()}
+        self.server.requests.append(("POST", url.path, form))
+        if url.path != LOGIN_PATH:
+            return self._send_html("not_found.html", status=404)
+        if form.get("_token") != "f1x7ur3t0k3n" or (form.get("username"), form.get("password")) != (USERNAME, PASSWORD):
+            # Sai tài khoản: trang login hiện lại kèm thông báo lỗi (HTTP 200, vẫn ở URL login)
+            return self._send_html("login_failed.html")
+        self.server.session_id += 1
+        return self._redirect(SEARCH_PATH, {"Set-Cookie": f"{SESSION_COOKIE}={self.server.session_id}; Path=/"})
+
+
+class FixtureServer:
+    """
+    Giả lập lldtek.org bằng http.server, trả về các trang HTML trong tests/fixtures/lldtek.
+
+    Chạy trên 1 cổng ngẫu nhiên ở thread nền; requests ghi lại các lệnh đã nhận, expire_sessions() giả lập hết phiên đăng nhập.
+    """
+
+    def __init__(self):
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._httpd.session_id = 0
+        self._httpd.requests = []
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    @property
+    def requests(self):
+        return self._httpd.requests
+
+    def url(self, path):
+        return self.base_url + path
+
+    def expire_sessions(self):
+        # Đổi mã phiên: cookie cũ không còn hợp lệ, trang tìm kiếm sẽ đẩy về trang login
+        self._httpd.session_id += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="lldtek-fixture", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,125 @@
+# Chạy từ thư mục gốc repo: pytest  (hoặc python -m unittest discover tests)
+import unittest
+
+import lldtek_client
+from lldtek_client import FOUND, NOT_FOUND, LOGIN_FAILED, WRONG_INPUT, HttpLookupClient, LookupUnavailable
+from lldtek_fixture_server import FixtureServer, LOGIN_PATH, SEARCH_PATH, JS_SEARCH_PATH, USERNAME, PASSWORD, read_fixture
+
+
+class DictCache:
+    """Cache trong bộ nhớ, cùng giao diện get(term, max_age)/put(term, df) như db.lookup_cache."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, term, max_age):
+        return self.data.get(term)
+
+    def put(self, term, df):
+        self.data[term] = df
+
+
+@unittest.skipUnless(lldtek_client.HAS_REQUESTS, "cần requests")
+class HttpLookupClientTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FixtureServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.requests.clear()
+
+    def make_client(self, password=PASSWORD, search_path=SEARCH_PATH, cache=None):
+        client = HttpLookupClient({"username": USERNAME, "password": password}, cache=cache, timeout=5,
+                                  login_url=self.server.url(LOGIN_PATH), search_url=self.server.url(search_path))
+        self.addCleanup(client.close)
+        return client
+
+    def searches(self):
+        return [r for r in self.server.requests if r[0] == "GET" and r[1] == SEARCH_PATH and r[2].get("keyword")]
+
+    def test_found_returns_matching_rows(self):
+        status, df = self.make_client().lookup("40123")
+        self.assertEqual(status, FOUND)
+        self.assertEqual(len(df), 1)
+        self.assertEqual(df.iloc[0]["Salon Name"], "Lovely Nails & Spa")
+
+    def test_search_form_keeps_hidden_fields_and_button(self):
+        self.make_client().lookup("40123")
+        login = next(r for r in self.server.requests if r[0] == "POST")
+        self.assertEqual(login[2]["_token"], "f1x7ur3t0k3n")
+        self.assertNotIn("remember", login[2])
+        params = self.searches()[0][2]
+        self.assertEqual(params["keyword"], ["40123"])
+        self.assertEqual(params["action"], ["search"])
+        self.assertEqual(params["_token"], ["f1x7ur3t0k3n"])
+
+    def test_not_found(self):
+        # Trang không tìm thấy vẫn lặp lại "99999" trong ô tìm kiếm/tiêu đề: chỉ dòng trong bảng mới tính
+        cache = DictCache()
+        status, df = self.make_client(cache=cache).lookup("99999")
+        self.assertEqual(status, NOT_FOUND)
+        self.assertTrue(df.empty)
+        self.assertEqual(cache.data, {})
+
+    def test_bad_login(self):
+        status, df = self.make_client(password="wrong").lookup("40123")
+        self.assertEqual(status, LOGIN_FAILED)
+        self.assertIsNone(df)
+        self.assertEqual(self.searches(), [])
+
+    def test_session_reused_between_lookups(self):
+        client = self.make_client()
+        client.lookup("40123")
+        client.lookup("99999")
+        self.assertEqual(sum(1 for r in self.server.requests if r[0] == "POST"), 1)
+
+    def test_expired_session_logs_in_again(self):
+        client = self.make_client()
+        client.lookup("40123")
+        self.server.expire_sessions()
+        status, _ = client.lookup("lovely nails")
+        self.assertEqual(status, FOUND)
+        self.assertEqual(sum(1 for r in self.server.requests if r[0] == "POST"), 2)
+
+    def test_found_result_is_cached(self):
+        cache = DictCache()
+        client = self.make_client(cache=cache)
+        client.lookup("40123")
+        status, df = client.lookup("40123")
+        self.assertEqual(status, FOUND)
+        self.assertEqual(len(df), 1)
+        self.assertEqual(len(self.searches()), 1)
+        # Không tìm thấy thì không cache: tiệm có thể được tạo ngay sau đó
+        client.lookup("99999")
+        self.assertNotIn("99999", cache.data)
+
+    def test_js_rendered_page_raises_lookup_unavailable(self):
+        # Nơi gọi (app.run_search_engine) gặp lỗi này thì chuyển sang bot Selenium
+        with self.assertRaises(LookupUnavailable):
+            self.make_client(search_path=JS_SEARCH_PATH).lookup("40123")
+
+
+class SearchFormTest(unittest.TestCase):
+    def test_picks_input_right_before_search_button(self):
+        form, target, button = lldtek_client.find_search_form(lldtek_client.parse_forms(read_fixture("pos_list.html")))
+        self.assertEqual(target["name"], "keyword")
+        self.assertEqual(button["value"], "search")
+
+    def test_login_page_has_no_search_form(self):
+        self.assertIsNone(lldtek_client.find_search_form(lldtek_client.parse_forms(read_fixture("login.html"))))
+
+    def test_date_input_before_search_is_wrong_input(self):
+        # Giao diện đổi: ô ngay trước nút Search là ô ngày -> WRONG_INPUT, không gửi tìm kiếm
+        html = read_fixture("pos_list.html").replace('name="keyword" class="form-control" placeholder="CID, Salon name, Phone"',
+                                                     'name="keyword" class="form-control" placeholder="mm/dd/yyyy"')
+        client = HttpLookupClient({"username": USERNAME, "password": PASSWORD})
+        client._open_search_page = lambda: type("Page", (), {"text": html, "url": "http://fixture" + SEARCH_PATH})()
+        self.assertEqual(client.lookup("40123", use_cache=False), (WRONG_INPUT, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
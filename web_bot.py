@@ -1,82 +1,287 @@
 # web_bot.py
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache
+from io import StringIO
+
+import pandas as pd
 from selenium import webdriver
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException, WebDriverException
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
-from bs4 import BeautifulSoup
-import pandas as pd
-import time
-import streamlit as st
 
-def get_web_data(search_term):
+from lldtek_client import (LOGIN_URL, SEARCH_URL, CACHE_TTL_SECONDS, FOUND, NOT_FOUND, WRONG_INPUT, LOGIN_FAILED,
+                           matching_rows, lookup_cached)
+
+POOL_SIZE = 2                     # Số Chrome chạy sẵn (mỗi cái 1 thread phục vụ hàng đợi)
+WAIT_SECONDS = 15
+LOOKUP_TIMEOUT_SECONDS = 60       # Người tra cứu chờ tối đa bấy lâu (kể cả lúc xếp hàng)
+PAGE_REUSE_SECONDS = 600          # Đang đứng sẵn ở trang tìm kiếm thì tìm luôn; quá 10 phút không dùng thì mở lại trang để phát hiện hết phiên
+RESULT_WAIT_SECONDS = 8           # Chờ bảng kết quả render lại sau khi bấm Search; quá hạn mà không thấy từ khóa = không tìm thấy
+RESULT_POLL_SECONDS = 0.1
+RESULT_ROWS_CSS = "table tbody tr"
+NO_DATA_MARKERS = ("no data", "no matching", "no record", "không có dữ liệu", "không tìm thấy")
+LOADING_MARKERS = ("loading", "processing", "đang tải")
+EMPTY_RESULT = object()           # _wait_for_result_table: bảng đã render xong nhưng không có từ khóa
+SEARCH_BUTTON_XPATH = "//button[contains(translate(., 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'search')]"
+
+
+@lru_cache(maxsize=1)
+def chromedriver_path():
+    # Chỉ tải/kiểm tra chromedriver 1 lần cho cả process (install() có thể gọi mạng)
+    return ChromeDriverManager().install()
+
+
+def chrome_options():
+    options = Options()
+    options.page_load_strategy = 'eager'
+    options.add_argument("--headless=new")
+    options.add_argument("--window-size=1920,1080")
+    options.add_argument("--ignore-certificate-errors")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    return options
+
+
+def extract_final_data(driver, search_term):
+    try:
+        html = driver.page_source
+        dfs = pd.read_html(StringIO(html))
+        if dfs:
+            for df in dfs:
+                str_df = df.astype(str).sum(axis=1)
+                if str_df.str.contains(search_term, case=False).any():
+                     final_rows = df[str_df.str.contains(search_term, case=False)]
+                     return final_rows
+            return max(dfs, key=lambda x: x.shape[1])
+        return None
+    except:
+        return None
+
+
+def extract_result_table(table, search_term):
+    """Chỉ parse HTML của bảng kết quả (không parse cả trang)."""
+    try:
+        dfs = pd.read_html(StringIO(table.get_attribute("outerHTML")))
+    except Exception:
+        return None
+    return matching_rows(dfs[0], search_term) if dfs else None
+
+
+def _wait_for_result_table(driver, search_term, old_row):
     """
-    Hàm khởi động Chrome ẩn danh, đăng nhập và tìm kiếm dữ liệu
+    Chờ trang render xong kết quả thay vì ngủ cố định.
+
+    Chỉ tin bảng kết quả sau khi dòng cũ (old_row) đã bị thay (stale), để không đọc nhầm kết quả của lần tìm trước.
+    Trả về bảng chứa search_term; None nếu bảng mới đã có dòng (hoặc dòng báo "no data") mà không có từ khóa, hoặc hết RESULT_WAIT_SECONDS.
     """
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")  # Chạy ngầm không hiện cửa sổ (bỏ dòng này nếu muốn xem nó chạy)
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    
-    # Khởi tạo trình duyệt
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
-    
+    term = search_term.lower()
+    state = {"replaced": old_row is None}
+
+    def settled(d):
+        if not state["replaced"]:
+            try:
+                old_row.is_enabled()
+                return False
+            except StaleElementReferenceException:
+                state["replaced"] = True
+        for table in d.find_elements(By.TAG_NAME, "table"):
+            try:
+                if term in table.text.lower():
+                    return table
+            except StaleElementReferenceException:
+                continue
+        # Bảng mới đã render (có dòng dữ liệu hoặc dòng báo trống) mà không có từ khóa -> không cần chờ tiếp
+        try:
+            texts = [row.text.lower() for row in d.find_elements(By.CSS_SELECTOR, RESULT_ROWS_CSS)]
+        except StaleElementReferenceException:
+            return False
+        if any(m in t for t in texts for m in NO_DATA_MARKERS):
+            return EMPTY_RESULT
+        if texts and not any(m in t for t in texts for m in LOADING_MARKERS):
+            return EMPTY_RESULT
+        return False
+
     try:
-        # 1. ĐĂNG NHẬP
-        login_url = "https://lldtek.org/login"  # Dự đoán URL login
-        driver.get(login_url)
-        
-        # Đợi ô username xuất hiện
-        wait = WebDriverWait(driver, 10)
-        
-        # Tìm ô user (thường là input type text đầu tiên hoặc name='username')
-        # Chiến thuật: Tìm input text đầu tiên trong form
+        result = WebDriverWait(driver, RESULT_WAIT_SECONDS, poll_frequency=RESULT_POLL_SECONDS).until(settled)
+    except TimeoutException:
+        return None
+    return None if result is EMPTY_RESULT else result
+
+
+class BrowserSession:
+    """1 Chrome headless đã đăng nhập lldtek.org, giữ sống giữa các lần tra cứu. Hết phiên thì tự đăng nhập lại."""
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.driver = None
+        self.logged_in_at = None
+        self.last_used = 0
+
+    def _start(self):
+        self.driver = webdriver.Chrome(service=Service(chromedriver_path()), options=chrome_options())
+        self.logged_in_at = None
+
+    def quit(self):
+        if self.driver:
+            try: self.driver.quit()
+            except Exception: pass
+        self.driver = None
+        self.logged_in_at = None
+
+    def _login(self):
+        driver = self.driver
+        wait = WebDriverWait(driver, WAIT_SECONDS)
+        driver.get(LOGIN_URL)
+        try:
+            user_in = wait.until(EC.presence_of_element_located((By.NAME, "username")))
+            pass_in = driver.find_element(By.NAME, "password")
+            user_in.send_keys(self.credentials["username"])
+            pass_in.send_keys(self.credentials["password"])
+            pass_in.submit()
+            wait.until(lambda d: "login" not in d.current_url.lower())
+        except Exception:
+            return False
+        self.logged_in_at = time.time()
+        return True
+
+    def _open_search_page(self):
+        """Đưa trình duyệt về trang tìm kiếm; bị đẩy về trang login (hết phiên) thì đăng nhập lại."""
+        driver = self.driver
+        fresh = time.time() - self.last_used < PAGE_REUSE_SECONDS
+        if self.logged_in_at and fresh and driver.current_url.rstrip("/").endswith("/pos/list"):
+            return True
+        if not self.logged_in_at and not self._login():
+            return False
+        driver.get(SEARCH_URL)
+        if "login" in driver.current_url.lower():
+            if not self._login():
+                return False
+            driver.get(SEARCH_URL)
+        return True
+
+    def warm_up(self):
+        """Mở Chrome + đăng nhập sẵn trước khi có yêu cầu đầu tiên."""
+        try:
+            if self.driver is None:
+                self._start()
+            self._open_search_page()
+        except Exception:
+            self.quit()
+
+    def search(self, search_term):
+        if self.driver is None:
+            self._start()
+        if not self._open_search_page():
+            return LOGIN_FAILED, None
+        self.last_used = time.time()
+        driver = self.driver
+        wait = WebDriverWait(driver, WAIT_SECONDS)
+        search_btn = wait.until(EC.element_to_be_clickable((By.XPATH, SEARCH_BUTTON_XPATH)))
+        target_input = search_btn.find_element(By.XPATH, "./preceding::input[1]")
+
+        ph = str(target_input.get_attribute("placeholder")).lower()
+        if "date" in ph or "mm/dd" in ph:
+            return WRONG_INPUT, None
+        # Giữ 1 dòng của bảng kết quả cũ: nó bị thay (stale) nghĩa là trang đã trả lời xong
+        old_rows = driver.find_elements(By.CSS_SELECTOR, RESULT_ROWS_CSS)
+        target_input.click()
+        target_input.clear()
+        target_input.send_keys(search_term)
+        driver.execute_script("arguments[0].click();", search_btn)
+
+        table = _wait_for_result_table(driver, search_term, old_rows[0] if old_rows else None)
+        if table is not None:
+            try:
+                return FOUND, extract_result_table(table, search_term)
+            except StaleElementReferenceException:
+                return FOUND, extract_final_data(driver, search_term)
+        return NOT_FOUND, pd.DataFrame()
+
+
+class LookupBot:
+    """
+    Dịch vụ tra cứu lldtek.org dùng chung cho cả process.
+
+    Giữ POOL_SIZE Chrome headless đã đăng nhập (mỗi Chrome 1 thread), các yêu cầu xếp hàng trong queue.
+    Không phải mở Chrome + đăng nhập lại cho mỗi lần tìm; Chrome nào lỗi thì bỏ, mở cái mới rồi thử lại 1 lần.
+    cache (VD: db.lookup_cache): có get(term, max_age)/put(term, df) thì kết quả tìm thấy được dùng lại trong cache_ttl giây.
+    """
+
+    def __init__(self, credentials, pool_size=POOL_SIZE, cache=None, cache_ttl=CACHE_TTL_SECONDS):
+        self.credentials = credentials
+        self.pool_size = pool_size
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self._jobs = queue.Queue()
+        self._threads = []
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            self._stop.clear()
+            for i in range(len(self._threads), self.pool_size):
+                t = threading.Thread(target=self._run, name=f"lookup-bot-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self):
+        self._stop.set()
+        for _ in self._threads:
+            self._jobs.put(None)
+
+    def _run(self):
+        session = BrowserSession(self.credentials)
+        session.warm_up()
         try:
-            user_input = driver.find_element(By.CSS_SELECTOR, "input[name='username']") 
-        except:
-            user_input = driver.find_element(By.CSS_SELECTOR, "input[type='text']")
-            
-        pass_input = driver.find_element(By.CSS_SELECTOR, "input[type='password']")
-        submit_btn = driver.find_element(By.XPATH, "//button[contains(text(), 'SUBMIT')]") # Tìm nút có chữ SUBMIT
-        
-        # Nhập liệu từ secrets
-        user_input.send_keys(st.secrets["web_account"]["username"])
-        pass_input.send_keys(st.secrets["web_account"]["password"])
-        submit_btn.click()
-        
-        # 2. VÀO TRANG TÌM KIẾM
-        target_url = "https://lldtek.org/salon/web/pos/list"
-        # Đợi chuyển trang xong (check url hoặc check element trang chủ)
-        time.sleep(2) 
-        driver.get(target_url)
-        
-        # 3. THỰC HIỆN TÌM KIẾM
-        # Tìm ô search có placeholder="Search"
-        search_box = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@placeholder='Search']")))
-        search_btn = driver.find_element(By.XPATH, "//button[contains(., 'SEARCH')]") # Tìm nút có chữ SEARCH
-        
-        search_box.clear()
-        search_box.send_keys(search_term)
-        search_btn.click()
-        
-        # 4. LẤY DỮ LIỆU BẢNG
-        time.sleep(3) # Đợi bảng load (có thể thay bằng WebDriverWait chờ bảng xuất hiện)
-        
-        # Lấy HTML của bảng
-        page_source = driver.page_source
-        soup = BeautifulSoup(page_source, 'html.parser')
-        
-        # Tìm bảng kết quả (thường là thẻ <table>)
-        table = soup.find('table')
-        if table:
-            df = pd.read_html(str(table))[0]
-            return df
-        else:
-            return None
-
-    except Exception as e:
-        return f"Lỗi: {str(e)}"
-    finally:
-        driver.quit()
\ No newline at end of file
+            while not self._stop.is_set():
+                job = self._jobs.get()
+                if job is None:
+                    break
+                search_term, future = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(self._search(session, search_term))
+                except Exception as e:
+                    future.set_exception(e)
+        finally:
+            session.quit()
+
+    def _search(self, session, search_term):
+        for attempt in range(2):
+            try:
+                return session.search(search_term)
+            except WebDriverException:
+                # Chrome chết / phiên hỏng: bỏ Chrome này, lần thử sau tự mở cái mới
+                session.quit()
+                if attempt:
+                    raise
+
+    def submit(self, search_term):
+        """Đưa 1 yêu cầu vào hàng đợi, trả về Future -> (trạng thái, DataFrame)."""
+        self.start()
+        future = Future()
+        self._jobs.put((search_term, future))
+        return future
+
+    def lookup(self, search_term, timeout=LOOKUP_TIMEOUT_SECONDS, use_cache=True):
+        def fetch():
+            future = self.submit(search_term)
+            try:
+                return future.result(timeout=timeout)
+            except Exception:
+                future.cancel()   # Chưa tới lượt thì bỏ khỏi hàng đợi luôn
+                raise
+        return lookup_cached(self.cache if use_cache else None, self.cache_ttl, search_term, fetch)
+
+    def pending_count(self):
+        return self._jobs.qsize()
@@ -0,0 +1,347 @@
+import csv
+import re
+from datetime import date, datetime, time, timedelta
+from itertools import chain, islice
+
+import pandas as pd
+
+from schema_registry import find_column_fuzzy
+
+HAS_OPENPYXL = False
+try:
+    import openpyxl
+    HAS_OPENPYXL = True
+except ImportError:
+    HAS_OPENPYXL = False
+
+HEADER_SCAN_ROWS = 10             # Dòng header nằm trong 10 dòng đầu của mỗi sheet ngày (thường là dòng 4)
+HEADER_KEY = 'Salon Name'
+SALON_SHEET = 'SALON CID'
+DAY_SHEETS = [str(day) for day in range(1, 32)]
+BATCH_SIZE = 5000                 # Số dòng mỗi lô khi ghi vào SQLite
+
+# Cột giữ nguyên tên (exact match) + các cột tìm bằng fuzzy matching (đổi về tên chuẩn)
+EXACT_COLUMNS = ['Name', 'Time', 'Salon Name', 'CID', 'Phone', 'Owner', 'Note', 'Status']
+FUZZY_KEYWORDS = ['Contact', 'Card', '16', 'Training', 'Demo']
+FUZZY_TARGETS = {'contact': 'Contact', 'card': 'Card_16_Digits', '16': 'Card_16_Digits', 'training': 'Training_Note', 'demo': 'Demo_Note'}
+# Bản stream ghi CSV ngay từ dòng đầu nên dùng bộ cột cố định (cột fuzzy không có trong tháng đó thì để trống)
+TICKET_COLUMNS = EXACT_COLUMNS + ['Date', 'Contact', 'Card_16_Digits', 'Training_Note', 'Demo_Note']
+EMPTY_MARKERS = ('nan', 'None', 'NaT')
+DAY_TEMPLATE = 'daily_xlsx'       # Tên mẫu trong schema_registry cho sheet ngày của file .xlsx
+
+
+# ==========================================
+# CHỌN CỘT (dùng chung cho bản pandas và bản stream)
+# ==========================================
+def find_columns_by_keywords(df_columns, keywords):
+    """
+    Tìm các cột dựa trên danh sách keywords (fuzzy matching)
+    Trả về dictionary: {standard_name: actual_column_name}
+    Ưu tiên tìm các từ khóa dài hơn trước (sắp xếp theo độ dài giảm dần)
+    """
+    found_columns = {}
+    used_columns = set()
+    for keyword in sorted(keywords, key=len, reverse=True):
+        col = find_column_fuzzy(df_columns, keyword, exclude_columns=list(used_columns))
+        if col:
+            used_columns.add(col)
+            standard_name = keyword.title() if keyword.islower() else keyword
+            found_columns[standard_name] = col
+    return found_columns
+
+
+def plan_columns(columns):
+    """
+    Các cột cần lấy của 1 sheet ngày + cách đổi tên về tên chuẩn.
+    Returns:
+        (actual_cols, column_mapping): column_mapping = {tên trong sheet: tên chuẩn} cho các cột tìm bằng fuzzy
+    """
+    actual_cols = [c for c in EXACT_COLUMNS if c in columns]
+    column_mapping = {}
+    # CRITICAL: Name và CID luôn phải có (fuzzy match nếu không có cột đúng tên)
+    for standard in ('Name', 'CID'):
+        if standard not in actual_cols:
+            col = find_column_fuzzy(columns, standard)
+            if col:
+                actual_cols.append(col)
+                column_mapping[col] = standard
+    card_16_col = None  # "Card" và "16" chỉ lấy 1 cột
+    for standard_name, actual_name in find_columns_by_keywords(columns, FUZZY_KEYWORDS).items():
+        if actual_name in actual_cols:
+            continue
+        target = FUZZY_TARGETS.get(standard_name.lower(), standard_name)
+        if target == 'Card_16_Digits':
+            if card_16_col is not None:
+                continue
+            card_16_col = actual_name
+        actual_cols.append(actual_name)
+        column_mapping[actual_name] = target
+    return actual_cols, column_mapping
+
+
+# ==========================================
+# ĐỌC STREAM (openpyxl read-only: mở workbook 1 lần, đọc mỗi sheet đúng 1 lượt)
+# ==========================================
+def open_workbook(source):
+    """source: đường dẫn hoặc file-like (VD: BytesIO của file XLSX tải về)."""
+    return openpyxl.load_workbook(source, read_only=True, data_only=True)
+
+
+def header_names(cells):
+    """Tên cột giống pandas: ô trống -> "Unnamed: i", trùng tên -> "X.1", "X.2"..."""
+    names, seen = [], {}
+    for i, cell in enumerate(cells):
+        name = f"Unnamed: {i}" if cell is None or str(cell).strip() == "" else str(cell)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def find_header(rows, key=HEADER_KEY, scan_rows=HEADER_SCAN_ROWS):
+    """Index của dòng header (dòng đầu tiên có ô đúng bằng key) trong scan_rows dòng đầu, -1 nếu không có."""
+    for idx, row in enumerate(rows[:scan_rows]):
+        if any(cell is not None and str(cell).strip() == key for cell in row):
+            return idx
+    return -1
+
+
+def detect_day_columns(rows):
+    """(index dòng header, {tên chuẩn: vị trí cột}) của 1 sheet ngày, None nếu không có header."""
+    header_idx = find_header(rows)
+    if header_idx == -1:
+        return None
+    header = header_names(rows[header_idx])
+    actual_cols, column_mapping = plan_columns(header)
+    return header_idx, {column_mapping.get(col, col): header.index(col) for col in actual_cols}
+
+
+def cell_value(value):
+    # Giống pandas.read_excel: số thực nguyên (6305182360.0) -> int
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def clean_text(value):
+    if value is None:
+        return ''
+    text = str(value).strip()
+    return '' if text in EMPTY_MARKERS else text
+
+
+def iter_sheet_tickets(ws, date_str, registry=None):
+    """
+    Các dòng ticket (dict theo tên chuẩn + Date) của 1 sheet ngày, bỏ dòng không có Salon Name.
+    registry (schema_registry.SchemaRegistry): dùng lại header/cột đã dò của các sheet cùng mẫu.
+    """
+    rows = ws.iter_rows(values_only=True)
+    head = list(islice(rows, HEADER_SCAN_ROWS))
+    if registry is not None:
+        schema = registry.resolve(DAY_TEMPLATE, head, detect_day_columns)
+    else:
+        schema = detect_day_columns(head)
+    if schema is None:
+        return
+    header_idx, mapping = schema
+    picks = list(mapping.items())
+    salon_idx = mapping[HEADER_KEY]
+    for row in chain(head[header_idx + 1:], rows):
+        if salon_idx >= len(row) or row[salon_idx] is None:
+            continue
+        record = {name: (cell_value(row[idx]) if idx < len(row) else None) for name, idx in picks}
+        record['Name'] = clean_text(record.get('Name'))
+        record['CID'] = clean_text(record.get('CID'))
+        record['Date'] = date_str
+        yield record
+
+
+def iter_workbook_tickets(wb, date_for_day, on_sheet=None, registry=None):
+    """
+    Các dòng ticket của mọi sheet ngày "1".."31" (theo thứ tự ngày).
+    date_for_day(day) -> chuỗi ngày. on_sheet(sheet_name, error) được gọi khi 1 sheet lỗi (bỏ qua sheet đó).
+    """
+    for day, sheet_name in enumerate(DAY_SHEETS, start=1):
+        if sheet_name not in wb.sheetnames:
+            continue
+        try:
+            yield from iter_sheet_tickets(wb[sheet_name], date_for_day(day), registry)
+        except Exception as e:
+            if on_sheet:
+                on_sheet(sheet_name, e)
+
+
+def iter_salons(wb, sheet_name=SALON_SHEET):
+    """(Salon Name, CID) của sheet SALON CID; header không chuẩn thì lấy 2 cột đầu."""
+    rows = wb[sheet_name].iter_rows(values_only=True)
+    first = next(rows, None)
+    if first is None:
+        return
+    header = header_names(first)
+    if HEADER_KEY in header and 'CID' in header:
+        name_idx, cid_idx = header.index(HEADER_KEY), header.index('CID')
+    else:
+        name_idx, cid_idx = 0, 1
+        rows = chain([first], rows)
+    for row in rows:
+        cid = row[cid_idx] if cid_idx < len(row) else None
+        if cid is None:
+            continue
+        yield (row[name_idx] if name_idx < len(row) else None), str(cell_value(cid)).strip()
+
+
+# ==========================================
+# GIÁ TRỊ HIỂN THỊ (chuỗi giống Sheets API / get_all_values, cho file XLSX export từ Google Drive)
+# ==========================================
+_DATE_TOKEN_RE = re.compile(r'"[^"]*"|\\.|\[[^\]]*\]|_.|\*.|yyyy|yy|mmmm|mmm|mm|m|dddd|ddd|dd|d|hh|h|ss|s|am/pm|a/p|\.0+|.', re.IGNORECASE)
+_NUMBER_FORMAT_RE = re.compile(r'^(.*?)([#0][#0,]*(?:\.[#0]+)?)(.*)$')
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+
+
+def _literal(text):
+    # Bỏ phần định dạng không hiện ra chữ: [màu/locale], _x (chừa khoảng), *x (lấp đầy); giữ chữ trong "..." và sau \\
+    text = re.sub(r'\[[^\]]*\]|_.|\*.', '', text)
+    return re.sub(r'"([^"]*)"|\\(.)', lambda m: m.group(1) if m.group(1) is not None else m.group(2), text)
+
+
+def _format_datetime(value, fmt):
+    if isinstance(value, time):
+        value = datetime.combine(_EXCEL_EPOCH.date(), value)
+    elif isinstance(value, timedelta):
+        value = _EXCEL_EPOCH + value
+    elif not isinstance(value, datetime):
+        value = datetime.combine(value, time())
+    tokens = _DATE_TOKEN_RE.findall(fmt)
+    lowered = [t.lower() for t in tokens]
+    twelve_hour = any(t in ('am/pm', 'a/p') for t in lowered)
+    out = []
+    for i, (token, low) in enumerate(zip(tokens, lowered)):
+        if low in ('m', 'mm'):
+            # "m" sau giờ hoặc trước giây là phút, còn lại là tháng
+            prev = next((t for t in reversed(lowered[:i]) if t[0] in 'ydhs'), '')
+            nxt = next((t for t in lowered[i + 1:] if t[0] in 'ydhs'), '')
+            number = value.minute if prev.startswith('h') or nxt.startswith('s') else value.month
+            out.append(f"{number:02d}" if low == 'mm' else str(number))
+        elif low == 'yyyy':
+            out.append(f"{value.year:04d}")
+        elif low == 'yy':
+            out.append(f"{value.year % 100:02d}")
+        elif low in ('mmm', 'mmmm'):
+            out.append(value.strftime('%b' if low == 'mmm' else '%B'))
+        elif low in ('ddd', 'dddd'):
+            out.append(value.strftime('%a' if low == 'ddd' else '%A'))
+        elif low in ('d', 'dd'):
+            out.append(f"{value.day:02d}" if low == 'dd' else str(value.day))
+        elif low in ('h', 'hh'):
+            hour = (value.hour % 12 or 12) if twelve_hour else value.hour
+            out.append(f"{hour:02d}" if low == 'hh' else str(hour))
+        elif low in ('s', 'ss'):
+            out.append(f"{value.second:02d}" if low == 'ss' else str(value.second))
+        elif low == 'am/pm':
+            out.append('AM' if value.hour < 12 else 'PM')
+        elif low == 'a/p':
+            out.append('A' if value.hour < 12 else 'P')
+        elif low.startswith('.0') and i and lowered[i - 1] in ('s', 'ss'):
+            out.append('.' + f"{value.microsecond:06d}"[:len(low) - 1])
+        else:
+            out.append(_literal(token))
+    return ''.join(out)
+
+
+def _format_number(value, fmt):
+    # [$$-409] -> "$" (ký hiệu tiền tệ theo locale), các [...] khác (màu) bỏ đi trước khi tách phần số
+    fmt = re.sub(r'\[[^\]]*\]', '', re.sub(r'\[\$([^\]-]*)[^\]]*\]', r'"\1"', fmt))
+    match = _NUMBER_FORMAT_RE.match(fmt)
+    if fmt in ('General', '@') or match is None:
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return f"{value:.15g}" if isinstance(value, float) else str(value)
+    prefix, body, suffix = match.groups()
+    if '%' in suffix:
+        value = value * 100
+    decimals = len(body.split('.')[1]) if '.' in body else 0
+    grouping = ',' if ',' in body else ''
+    return f"{_literal(prefix)}{value:{grouping}.{decimals}f}{_literal(suffix)}"
+
+
+def format_cell(value, number_format='General'):
+    """Chuỗi hiển thị của 1 ô theo number_format (giống FORMATTED_VALUE của Sheets API cho các định dạng thường gặp)."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, str):
+        return value
+    fmt = (number_format or 'General').split(';')[0]
+    if isinstance(value, (datetime, date, time, timedelta)):
+        return _format_datetime(value, fmt)
+    return _format_number(value, fmt)
+
+
+def sheet_values(ws):
+    """Cả sheet dạng list các dòng chuỗi, giống ws.get_all_values(): bỏ ô trống cuối dòng + dòng trống cuối sheet, pad đều cột."""
+    ws.reset_dimensions()
+    data = []
+    last_row_with_data = -1
+    for row_number, row in enumerate(ws.iter_rows()):
+        cells = [format_cell(cell.value, getattr(cell, 'number_format', 'General')) for cell in row]
+        while cells and cells[-1] == '':
+            cells.pop()
+        if cells:
+            last_row_with_data = row_number
+        data.append(cells)
+    data = data[:last_row_with_data + 1]
+    width = max((len(r) for r in data), default=0)
+    return [r + [''] * (width - len(r)) for r in data]
+
+
+def workbook_values(source, include=None):
+    """
+    {tên sheet: các dòng chuỗi} của workbook theo đúng thứ tự tab. include(title) -> bool để chọn sheet.
+    Dùng cho file XLSX export 1 lần từ Google Drive thay cho đọc từng tab qua Sheets API.
+    """
+    wb = open_workbook(source)
+    try:
+        return {title: sheet_values(wb[title]) for title in wb.sheetnames if include is None or include(title)}
+    finally:
+        wb.close()
+
+
+# ==========================================
+# GHI RA (CSV / SQLite) - nhận generator, không giữ cả tháng trong RAM
+# ==========================================
+def write_csv(records, path, columns=TICKET_COLUMNS):
+    """Ghi dần từng dòng ra CSV. Trả về số dòng đã ghi."""
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(columns)
+        for record in records:
+            writer.writerow(['' if record.get(col) is None else record.get(col) for col in columns])
+            count += 1
+    return count
+
+
+def write_sqlite(records, conn, batch_size=BATCH_SIZE):
+    """
+    Nạp dần các dòng ticket vào bảng tickets qua pipeline của import_data (chuẩn hóa theo cột + upsert theo Import_Key), mỗi lô batch_size dòng.
+    Nơi gọi commit. Trả về (inserted, updated, unchanged, skipped).
+    """
+    import import_data
+
+    records = iter(records)
+    existing = import_data.existing_import_keys(conn)
+    totals = [0, 0, 0, 0]
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        frame = pd.DataFrame.from_records(batch, columns=TICKET_COLUMNS)
+        tickets, bad = import_data.build_ticket_frame(frame, import_data.map_csv_columns(frame.columns))
+        for i, n in enumerate(import_data.upsert_tickets(conn, tickets, existing, batch_size) + (bad,)):
+            totals[i] += n
+        print(f"  Da xu ly {sum(totals)} dong...")
+    return tuple(totals)